@@ -0,0 +1,166 @@
+"""
+Activity Digest Module
+Aggregated user_activity presence per storage room
+
+Clients report their state ('idle', 'editing', 'recording') with user_activity pings.
+Instead of relaying every ping to the whole room (O(clients²) messages per heartbeat),
+each worker keeps the latest state of its own users and emits one 'presence_digest'
+per room listing all of them:
+    - at most every ACTIVITY_DIGEST_SECONDS, and only for rooms whose states changed
+    - plus a keepalive every ACTIVITY_DIGEST_KEEPALIVE_SECONDS while the room has users,
+      so clients can expire the digest of a worker that went away
+Pings from one user closer together than ACTIVITY_MIN_INTERVAL_MS are throttled: the
+newest state is kept and applied once the interval has passed
+Users whose last ping is older than ACTIVITY_TTL_SECONDS are dropped from the digest
+
+    {'storage_id', 'source': <worker id>, 'timestamp',
+     'users': [{'user_id', 'activity', 'updated_at'}]}
+With several workers every worker sends its own digest; clients merge them by source
+"""
+import os
+import threading
+import time
+import uuid
+from datetime import datetime, timezone
+
+from structured_logging import get_logger
+
+log = get_logger('presence')
+
+MAX_ACTIVITY_LENGTH = 32
+
+
+def _iso(timestamp):
+    return datetime.fromtimestamp(timestamp, tz=timezone.utc).isoformat()
+
+
+class ActivityDigest:
+    def __init__(self):
+        self.min_interval = int(os.getenv('ACTIVITY_MIN_INTERVAL_MS', 1000)) / 1000.0
+        self.digest_interval = float(os.getenv('ACTIVITY_DIGEST_SECONDS', 2))
+        self.keepalive = float(os.getenv('ACTIVITY_DIGEST_KEEPALIVE_SECONDS', 30))
+        self.ttl = float(os.getenv('ACTIVITY_TTL_SECONDS', 90))
+        self.source = f"{os.getpid()}-{uuid.uuid4().hex[:8]}"
+        self.socketio = None
+        self._rooms = {}  # storage_id -> {user_id: entry}
+        self._sids = {}  # sid -> {(storage_id, user_id)}
+        self._holders = {}  # (storage_id, user_id) -> {sid}; one user may have several tabs open
+        self._dirty = set()
+        self._last_sent = {}  # storage_id -> time of the last digest
+        self._lock = threading.Lock()
+        self._started = False
+        self._stats = {'received': 0, 'throttled': 0, 'digests': 0}
+
+    def init_app(self, socketio):
+        self.socketio = socketio
+        if not self._started:
+            self._started = True
+            socketio.start_background_task(self._loop)
+
+    # --- Producers ---
+    def record(self, storage_id, user_id, activity, sid=None):
+        """Take one ping; returns False when it was throttled"""
+        activity = str(activity or 'idle')[:MAX_ACTIVITY_LENGTH]
+        now = time.time()
+        with self._lock:
+            self._stats['received'] += 1
+            if sid is not None:
+                self._sids.setdefault(sid, set()).add((storage_id, user_id))
+                self._holders.setdefault((storage_id, user_id), set()).add(sid)
+            room = self._rooms.setdefault(storage_id, {})
+            entry = room.get(user_id)
+            if entry is not None and now - entry['accepted'] < self.min_interval:
+                # Keep the newest state; the digest loop applies it when the interval is over
+                entry['pending'] = activity
+                entry['seen'] = now
+                self._stats['throttled'] += 1
+                return False
+            if entry is None or entry['activity'] != activity:
+                self._dirty.add(storage_id)
+            room[user_id] = {'activity': activity, 'accepted': now, 'seen': now, 'pending': None}
+            return True
+
+    def forget(self, sid, storage_id=None):
+        """
+        Release the users a connection reported (all of them, or only in storage_id)
+        A user leaves the digest once no other connection on this worker reports them
+        """
+        with self._lock:
+            keys = self._sids.get(sid, set())
+            removed = {key for key in keys if storage_id is None or key[0] == storage_id}
+            keys -= removed
+            if not keys:
+                self._sids.pop(sid, None)
+            for key in removed:
+                holders = self._holders.get(key, set())
+                holders.discard(sid)
+                if holders:
+                    continue
+                self._holders.pop(key, None)
+                room_id, user_id = key
+                if self._rooms.get(room_id, {}).pop(user_id, None) is not None:
+                    self._dirty.add(room_id)
+
+    def digest(self, storage_id):
+        """Current digest payload for a room"""
+        with self._lock:
+            return self._payload(storage_id, time.time())
+
+    # --- Emitting ---
+    def _payload(self, storage_id, now):
+        users = [{'user_id': user_id, 'activity': entry['activity'], 'updated_at': _iso(entry['accepted'])}
+                 for user_id, entry in self._rooms.get(storage_id, {}).items()]
+        return {'storage_id': storage_id, 'source': self.source, 'timestamp': _iso(now), 'users': users}
+
+    def _loop(self):
+        while True:
+            self.socketio.sleep(self.digest_interval)
+            try:
+                self.flush()
+            except Exception as e:
+                log.warning('Presence digest failed', error=str(e))
+
+    def flush(self):
+        """Apply throttled states, expire silent users and emit digests that are due"""
+        now = time.time()
+        with self._lock:
+            for storage_id, room in list(self._rooms.items()):
+                for user_id, entry in list(room.items()):
+                    if now - entry['seen'] > self.ttl:
+                        del room[user_id]
+                        self._dirty.add(storage_id)
+                    elif entry['pending'] is not None and now - entry['accepted'] >= self.min_interval:
+                        if entry['pending'] != entry['activity']:
+                            entry['activity'] = entry['pending']
+                            entry['accepted'] = now
+                            self._dirty.add(storage_id)
+                        entry['pending'] = None
+                if room and now - self._last_sent.get(storage_id, 0) >= self.keepalive:
+                    self._dirty.add(storage_id)
+            due = []
+            for storage_id in self._dirty:
+                due.append(self._payload(storage_id, now))
+                self._last_sent[storage_id] = now
+                if not self._rooms.get(storage_id):
+                    # The empty digest tells clients this worker has no users there any more
+                    self._rooms.pop(storage_id, None)
+                    self._last_sent.pop(storage_id, None)
+            self._dirty.clear()
+            self._stats['digests'] += len(due)
+        for payload in due:
+            self.socketio.emit('presence_digest', payload, room=f"storage_{payload['storage_id']}")
+
+    def stats(self):
+        with self._lock:
+            return {
+                'source': self.source,
+                'rooms': len(self._rooms),
+                'users': sum(len(room) for room in self._rooms.values()),
+                'min_interval_ms': int(self.min_interval * 1000),
+                'digest_seconds': self.digest_interval,
+                **self._stats
+            }
+
+
+# Global instance
+activity_digest = ActivityDigest()
@@ -2,17 +2,43 @@ import os
 import sys
 import uuid
 import base64
-from datetime import datetime
-from flask import Flask, request, jsonify, send_file, send_from_directory
+import json
+import hashlib
+import click
+from io import BytesIO
+from datetime import datetime, timedelta, timezone
+from flask import Flask, request, jsonify, send_file, send_from_directory, Response
 from flask_pymongo import PyMongo
 from flask_cors import CORS
 from flask_socketio import SocketIO, emit, join_room, leave_room
 from bson.objectid import ObjectId
 from werkzeug.utils import secure_filename
+from werkzeug.security import safe_join
+from werkzeug.exceptions import RequestedRangeNotSatisfiable
+from pymongo import ReturnDocument, InsertOne, UpdateOne, DeleteOne
+from pymongo.errors import BulkWriteError
 from pymongo.errors import ConnectionFailure, ServerSelectionTimeoutError
 import azure_config
 from azure_storage import azure_storage
+from fake_blob_storage import FakeResourceNotFoundError
+from task_cache import task_cache
+from broadcast import broadcaster, make_patch
+from db_health import db_health
+from presence import presence, create_redis_client
+from blocking_io import blocking_io
+from upload_sessions import upload_sessions, UploadSessionError
+from content_store import content_store
+from media_gc import media_gc
+from metrics import metrics
+from activity_digest import activity_digest
 import cors_config
+from structured_logging import configure_logging, get_logger, stats as logging_stats
+
+configure_logging()
+api_log = get_logger('api')
+socket_log = get_logger('socket')
+upload_log = get_logger('upload')
+db_log = get_logger('db')
 
 # --- Check if running directly (local environment) ---
 if __name__ == '__main__':
@@ -28,7 +54,10 @@ if cors_config.USE_CORS:
         r"/*": {
             "origins": cors_config.CORS_ORIGINS,
             "methods": ["GET", "POST", "PUT", "DELETE", "OPTIONS"],
-            "allow_headers": ["Content-Type", "Authorization"],
+            # x-ms-blob-type: direct uploads against the fake blob emulator routes
+            "allow_headers": ["Content-Type", "Authorization", "x-ms-blob-type"],
+            # Read by the frontend to start delta sync (see get_tasks)
+            "expose_headers": ["X-Sync-Watermark"],
             "supports_credentials": True
         }
     })
@@ -62,11 +91,65 @@ else:
     print(f"📁 Using local storage: {local_uploads_folder}")
 app.config['MAX_CONTENT_LENGTH'] = int(os.environ.get("MAX_CONTENT_LENGTH", azure_config.MAX_CONTENT_LENGTH))
 
+# --- Index Configuration ---
+# Tombstones older than this are not guaranteed to exist; older watermarks need a full reload
+TOMBSTONE_RETENTION_DAYS = int(os.environ.get('TOMBSTONE_RETENTION_DAYS', 7))
+AUTO_CREATE_INDEXES = os.environ.get('AUTO_CREATE_INDEXES', 'True').lower() in ('true', '1', 'yes')
+# Cosmos DB's (RU-based) Mongo API only accepts TTL indexes on its system _ts field, the time of
+# the last write; tombstones are never updated, so there it is their deletion time
+TOMBSTONE_TTL_FIELD = '_ts' if '.mongo.cosmos.azure.com' in MONGO_URI.lower() else 'deleted_at'
+
+# (collection, index name, keys, options) matching the query shapes used by the API
+DB_INDEXES = [
+    ('tasks', 'storage_completed', [('storage_id', 1), ('completed', 1)], {}),
+    ('tasks', 'storage_updated_at', [('storage_id', 1), ('updated_at', 1)], {}),
+    ('tasks', 'storage_is_backup', [('storage_id', 1), ('is_backup', 1)], {}),
+    ('tasks', 'storage_created_at', [('storage_id', 1), ('created_at', 1)], {}),
+    ('task_tombstones', 'storage_deleted_at', [('storage_id', 1), ('deleted_at', 1)], {}),
+    ('task_tombstones', f'{TOMBSTONE_TTL_FIELD}_ttl', [(TOMBSTONE_TTL_FIELD, 1)],
+     {'expireAfterSeconds': TOMBSTONE_RETENTION_DAYS * 86400}),
+    ('upload_sessions', 'expires_at', [('expires_at', 1)], {}),
+    ('upload_sessions', 'unique_filename', [('unique_filename', 1)], {}),
+    # Bulk reference checks of the orphaned media sweeper
+    ('tasks', 'attachments_unique_filename', [('attachments.unique_filename', 1)], {}),
+    ('tasks', 'audio_notes_unique_filename', [('audio_notes.unique_filename', 1)], {}),
+    ('content_refs', 'unique_filename', [('unique_filename', 1)], {}),
+]
+
+def ensure_indexes(db):
+    """
+    Create the indexes the API relies on
+    create_index is idempotent, so every worker can run this at startup;
+    a failure on one index (e.g. unsupported on Cosmos DB) never blocks startup
+    """
+    for collection_name, name, keys, options in DB_INDEXES:
+        collection = db[collection_name]
+        try:
+            existing = collection.index_information()
+            if name in existing:
+                print(f"ℹ️ Index {collection_name}.{name} already exists")
+                continue
+            collection.create_index(keys, name=name, background=True, **options)
+            print(f"✅ Index {collection_name}.{name} created")
+        except Exception as e:
+            db_log.warning('Could not create index', collection=collection_name, index=name, error=str(e))
+
 # --- Initialize PyMongo with error handling ---
 try:
-    mongo = PyMongo(app, serverSelectionTimeoutMS=10000, connectTimeoutMS=20000, socketTimeoutMS=20000, maxPoolSize=10, retryWrites=False)
+    # db_health listens to the driver's server heartbeats, so handlers never need their own ping;
+    # metrics times every command
+    mongo = PyMongo(app, serverSelectionTimeoutMS=10000, connectTimeoutMS=20000, socketTimeoutMS=20000, maxPoolSize=10, retryWrites=False,
+                    event_listeners=[db_health, metrics.mongo_listener])
     mongo.db.command('ping')
+    db_health.record_ping(True)
+    db_health.set_probe(lambda: mongo.db.command('ping'))
     tasks_collection = mongo.db.tasks
+    tombstones_collection = mongo.db.task_tombstones
+    stats_collection = mongo.db.storage_stats
+    upload_sessions.init_app(mongo.db.upload_sessions, azure_storage, lambda: app.config.get('UPLOAD_FOLDER', 'uploads'))
+    content_store.init_app(mongo.db.content_refs)
+    if AUTO_CREATE_INDEXES:
+        ensure_indexes(mongo.db)
     print("="*60)
     print("✅ MongoDB/Cosmos DB connection established")
     print(f"📊 Database: {mongo.db.name}")
@@ -77,9 +160,13 @@ try:
 except (ConnectionFailure, ServerSelectionTimeoutError) as e:
     print("="*60, f"❌ MongoDB connection error: {e}", "="*60, sep="\n")
     tasks_collection = None
+    tombstones_collection = None
+    stats_collection = None
 except Exception as e:
     print(f"⚠️ MongoDB initialization warning: {e}")
     tasks_collection = None
+    tombstones_collection = None
+    stats_collection = None
 
 # --- SocketIO Configuration ---
 # Determine async_mode based on environment and available packages
@@ -112,31 +199,105 @@ else:
         async_mode = 'threading'
         print("✅ Using threading for Socket.IO (local development)")
 
+# --- Multi-worker Configuration ---
+# With more than one worker, emits are relayed between workers through a message queue
+# (Redis by default) and presence/cache state lives in Redis as well
+GUNICORN_WORKERS = int(os.environ.get('GUNICORN_WORKERS', 1))
+REDIS_URL = os.environ.get('REDIS_URL', '')
+SOCKETIO_MESSAGE_QUEUE = os.environ.get('SOCKETIO_MESSAGE_QUEUE', '' if REDIS_URL.startswith('fakeredis://') else REDIS_URL)
+# gunicorn has no sticky sessions, so long-polling only works with a single worker
+SOCKETIO_TRANSPORTS = os.environ.get('SOCKETIO_TRANSPORTS', 'websocket' if GUNICORN_WORKERS > 1 else 'polling,websocket').split(',')
+
+if GUNICORN_WORKERS > 1 and not SOCKETIO_MESSAGE_QUEUE:
+    print("⚠️ Multiple workers without SOCKETIO_MESSAGE_QUEUE/REDIS_URL: clients only receive events from their own worker")
+if GUNICORN_WORKERS > 1 and not presence.shared:
+    print("⚠️ Multiple workers with in-memory presence: online counts will be per worker")
+
+SOCKETIO_PACKET_LOGGING = os.environ.get('SOCKETIO_PACKET_LOGGING', 'False').lower() in ('true', '1', 'yes')
+
+socketio_options = {}
+if SOCKETIO_MESSAGE_QUEUE:
+    socketio_options['message_queue'] = SOCKETIO_MESSAGE_QUEUE
+    socketio_options['channel'] = os.environ.get('SOCKETIO_CHANNEL', 'flask-socketio')
+    print(f"✅ Socket.IO message queue: {SOCKETIO_MESSAGE_QUEUE.split('@')[-1]}")
+
 socketio = SocketIO(
     app,
     cors_allowed_origins=cors_config.SOCKETIO_CORS_ORIGINS if cors_config.USE_CORS else None,
     async_mode=async_mode,
-    logger=True,
-    engineio_logger=True,
+    # Per-packet logging is very chatty; opt in with SOCKETIO_PACKET_LOGGING=true
+    logger=SOCKETIO_PACKET_LOGGING,
+    engineio_logger=SOCKETIO_PACKET_LOGGING,
     ping_timeout=60,
-    ping_interval=25
+    ping_interval=25,
+    transports=SOCKETIO_TRANSPORTS,
+    **socketio_options
 )
 
+# Task change notifications are coalesced per room before being emitted
+broadcaster.init_app(socketio)
+# user_activity pings are throttled and sent to rooms as periodic presence digests
+activity_digest.init_app(socketio)
+# Blob SDK and disk calls leave the eventlet hub so they can't stall heartbeats
+blocking_io.init_app(async_mode)
+
 if cors_config.USE_CORS:
     print(f"🔌 Socket.IO CORS enabled with origins: {cors_config.SOCKETIO_CORS_ORIGINS}")
 else:
     print("⚠️ Socket.IO CORS is disabled")
 
 # --- Helper Functions & State ---
-storage_connections = {}
-sid_to_storages = {}
-
 def update_and_broadcast_online_count(storage_id: str):
     room = f'storage_{storage_id}'
-    count = len(storage_connections.get(storage_id, set()))
-    print(f"📊 Broadcasting online count for storage {storage_id[:8]}...: {count} users")
+    count = presence.count(storage_id)
+    socket_log.debug('Broadcasting online count', storage=storage_id[:8], count=count)
     socketio.emit('storage_online_count', {'storage_id': storage_id, 'count': count}, room=room)
 
+def presence_metrics():
+    """Room sizes for /metrics; storage ids are secrets, so rooms are only counted by size"""
+    sizes = presence.room_sizes()
+    buckets = (1, 2, 5, 10, 25, 50, 100)
+    return [
+        ('socketio_rooms', 'gauge', 'Storage rooms with at least one connection', [({}, len(sizes))]),
+        ('socketio_room_connections', 'gauge', 'Connections joined to storage rooms', [({}, sum(sizes))]),
+        ('socketio_room_size_max', 'gauge', 'Connections in the largest storage room', [({}, max(sizes, default=0))]),
+        ('socketio_rooms_by_size', 'gauge', 'Storage rooms with at most `le` connections',
+         [({'le': str(bound)}, sum(1 for size in sizes if size <= bound)) for bound in buckets] + [({'le': '+Inf'}, len(sizes))])
+    ]
+
+# Shared state for multi-worker deployments
+presence.init_app(socketio, on_reaped=update_and_broadcast_online_count)
+shared_redis = None
+if presence.shared:
+    shared_redis = presence.store.client
+elif REDIS_URL:
+    try:
+        shared_redis = create_redis_client(REDIS_URL)
+    except Exception as e:
+        print(f"⚠️ Shared cache invalidation unavailable: {e}")
+if shared_redis is not None:
+    task_cache.attach_bus(shared_redis, socketio.start_background_task)
+# Workers publish metric snapshots to Redis so any worker can serve the whole instance's /metrics
+metrics.init_app(app, socketio, shared_redis)
+metrics.add_collector(presence_metrics)
+if tasks_collection is not None:
+    media_gc.init_app(mongo.db, azure_storage, lambda: app.config.get('UPLOAD_FOLDER', 'uploads'), socketio)
+
+@app.cli.command('media-gc')
+@click.option('--dry-run', is_flag=True, help='Only report orphaned files')
+def media_gc_command(dry_run):
+    """Sweep stored files no task references (flask --app app media-gc)"""
+    if tasks_collection is None:
+        raise click.ClickException('MongoDB is not connected')
+    report = media_gc.sweep(dry_run=dry_run)
+    click.echo(json.dumps(report, indent=2))
+
+def sign_media_entry(entry):
+    """Replace a blob-backed attachment/audio entry's blob_url with a short-lived read SAS URL (in place)"""
+    if entry.get('blob_url') and entry.get('unique_filename') and azure_storage.is_configured():
+        entry['blob_url'] = azure_storage.get_read_url(entry['unique_filename']) or entry['blob_url']
+    return entry
+
 def serialize_document(doc):
     if not doc: return doc
     if '_id' in doc: doc['_id'] = str(doc['_id'])
@@ -145,17 +306,15 @@ def serialize_document(doc):
             doc[key] = value.isoformat()
         elif isinstance(value, list):
             for item in value:
-                if isinstance(item, dict): serialize_document(item)
+                if isinstance(item, dict): sign_media_entry(serialize_document(item))
     return doc
 
 def check_db_connection():
     if tasks_collection is None: return jsonify({'error':'Database not available'}), 503
-    try:
-        mongo.db.command('ping')
-        return None
-    except Exception as e:
-        print(f"❌ Database connection lost: {e}")
+    # Cached state from the background heartbeat monitor; no round-trip here
+    if not db_health.is_connected():
         return jsonify({'error': 'Database connection lost'}), 503
+    return None
 
 def toIdString(id_val):
     """Convert various ID formats to string"""
@@ -167,6 +326,390 @@ def toIdString(id_val):
         return id_val
     return str(id_val)
 
+# --- Task Query Helpers (filtering, sorting, keyset pagination) ---
+TASK_SORT_FIELDS = ('_id', 'created_at', 'updated_at')
+TASKS_PAGE_SIZE_MAX = int(os.environ.get('TASKS_PAGE_SIZE_MAX', 500))
+
+def parse_bool_arg(value):
+    """Parse a boolean query-string value, returning None when absent"""
+    if value is None or value == '':
+        return None
+    lowered = value.lower()
+    if lowered in ('true', '1', 'yes'):
+        return True
+    if lowered in ('false', '0', 'no'):
+        return False
+    raise ValueError(f"Invalid boolean value: {value}")
+
+def encode_cursor(doc, sort_field):
+    """Build an opaque keyset cursor from the last document of a page"""
+    value = doc.get(sort_field) if sort_field != '_id' else None
+    payload = {'id': str(doc['_id'])}
+    if sort_field != '_id':
+        payload['v'] = value.isoformat() if hasattr(value, 'isoformat') else value
+    return base64.urlsafe_b64encode(json.dumps(payload).encode('utf-8')).decode('ascii')
+
+def decode_cursor(cursor, sort_field):
+    """Decode a keyset cursor into (sort value, ObjectId)"""
+    payload = json.loads(base64.urlsafe_b64decode(cursor.encode('ascii')).decode('utf-8'))
+    last_id = ObjectId(payload['id'])
+    value = payload.get('v')
+    if sort_field != '_id' and isinstance(value, str):
+        value = datetime.fromisoformat(value)
+    return value, last_id
+
+def build_task_query(storage_id, args):
+    """
+    Translate GET /api/tasks query-string options into a Mongo filter and sort
+    Raises ValueError on invalid options
+    """
+    query = {'storage_id': storage_id}
+
+    completed = parse_bool_arg(args.get('completed'))
+    if completed is not None:
+        query['completed'] = completed
+    is_backup = parse_bool_arg(args.get('is_backup'))
+    if is_backup is True:
+        query['is_backup'] = True
+    elif is_backup is False:
+        # Older documents may not carry the flag at all
+        query['is_backup'] = {'$ne': True}
+
+    sort_field = args.get('sort', '_id')
+    if sort_field not in TASK_SORT_FIELDS:
+        raise ValueError(f"Invalid sort field: {sort_field}")
+    order = args.get('order', 'asc').lower()
+    if order not in ('asc', 'desc'):
+        raise ValueError(f"Invalid sort order: {order}")
+    direction = 1 if order == 'asc' else -1
+    op = '$gt' if direction == 1 else '$lt'
+
+    cursor = args.get('cursor')
+    if cursor:
+        try:
+            value, last_id = decode_cursor(cursor, sort_field)
+        except Exception:
+            raise ValueError('Invalid cursor')
+        if sort_field == '_id':
+            query['_id'] = {op: last_id}
+        else:
+            query['$or'] = [
+                {sort_field: {op: value}},
+                {sort_field: value, '_id': {op: last_id}}
+            ]
+
+    sort = [(sort_field, direction)]
+    if sort_field != '_id':
+        sort.append(('_id', direction))
+    return query, sort, sort_field
+
+# --- Delta Sync Helpers ---
+# Returned watermarks lag "now" so writes still in flight are picked up by the next delta
+DELTA_SYNC_OVERLAP_SECONDS = int(os.environ.get('DELTA_SYNC_OVERLAP_SECONDS', 5))
+# Full task lists carry their starting watermark in this header (the body stays a plain list)
+SYNC_WATERMARK_HEADER = 'X-Sync-Watermark'
+
+def sync_watermark(now=None):
+    """Watermark for a read starting now; take it before querying"""
+    return ((now or datetime.utcnow()) - timedelta(seconds=DELTA_SYNC_OVERLAP_SECONDS)).isoformat()
+
+def parse_watermark(value):
+    """Parse a sync watermark (ISO timestamp or epoch milliseconds) into a naive UTC datetime"""
+    try:
+        return datetime.utcfromtimestamp(float(value) / 1000.0)
+    except ValueError:
+        pass
+    parsed = datetime.fromisoformat(value.replace('Z', '+00:00'))
+    if parsed.tzinfo is not None:
+        parsed = parsed.astimezone(timezone.utc).replace(tzinfo=None)
+    return parsed
+
+def record_tombstones(storage_id, task_ids):
+    """Remember deleted task IDs so delta sync clients can drop them"""
+    if tombstones_collection is None or not task_ids:
+        return
+    deleted_at = datetime.utcnow()
+    tombstones_collection.insert_many([
+        {'task_id': toIdString(task_id), 'storage_id': storage_id, 'deleted_at': deleted_at}
+        for task_id in task_ids
+    ])
+
+# --- Task Document Builders ---
+def build_new_task(data, storage_id):
+    """Build a new task document from a create request payload"""
+    now = datetime.utcnow()
+    return {
+        'title': data.get('title', ''),
+        'description': data.get('description', ''),
+        'completed': False,
+        'storage_id': storage_id,
+        'created_at': now,
+        'updated_at': now,
+        'attachments': [],
+        'audio_notes': [],
+        'is_backup': data.get('is_backup', False),
+        'original_id': data.get('original_id'),
+        'backup_reason': data.get('backup_reason'),
+        'version': 1
+    }
+
+def build_task_update(data):
+    """Build the $set document for an update request payload"""
+    update_data = {'updated_at': datetime.utcnow()}
+    if 'title' in data:
+        update_data['title'] = data['title']
+    if 'description' in data:
+        update_data['description'] = data.get('description', '')
+    if 'completed' in data:
+        update_data['completed'] = bool(data['completed'])
+    return update_data
+
+# --- Media Helpers ---
+AUDIO_EXTENSIONS = {
+    'audio/webm': '.webm',
+    'audio/ogg': '.ogg',
+    'audio/mp4': '.m4a',
+    'audio/mpeg': '.mp3',
+    'audio/wav': '.wav',
+    'audio/x-wav': '.wav'
+}
+MEDIA_STREAM_CHUNK_SIZE = int(os.environ.get('MEDIA_STREAM_CHUNK_SIZE', 256 * 1024))
+
+class CountingReader:
+    """File-like wrapper that counts (and optionally hashes) the bytes read through it"""
+    def __init__(self, stream, hasher=None):
+        self.stream = stream
+        self.hasher = hasher
+        self.bytes_read = 0
+
+    def read(self, size=-1):
+        chunk = self.stream.read(size)
+        self.bytes_read += len(chunk)
+        if self.hasher is not None:
+            self.hasher.update(chunk)
+        return chunk
+
+def store_media_stream(stream, unique_filename, length=None, content_type=None):
+    """
+    Copy a stream to Azure Blob Storage or the local upload folder chunk by chunk
+    Returns (media_info, size); media_info is None if the blob upload failed
+    With content-addressed storage on, media_info may point at an identical file stored earlier
+    """
+    reader = CountingReader(stream, content_store.hasher())
+    if azure_storage.is_configured():
+        upload_result = azure_storage.upload_stream(reader, unique_filename, length=length, content_type=content_type)
+        if not upload_result:
+            return None, 0
+        media_info = {
+            'filename': upload_result.get('filename', unique_filename),
+            'unique_filename': upload_result.get('unique_filename'),
+            'blob_url': upload_result.get('blob_url')
+        }
+    else:
+        upload_folder = app.config.get('UPLOAD_FOLDER', 'uploads')
+        os.makedirs(upload_folder, exist_ok=True)
+        # The stream may be the request socket (green), so only the disk writes are offloaded
+        with blocking_io.run('file_open', open, os.path.join(upload_folder, unique_filename), 'wb') as f:
+            while True:
+                chunk = reader.read(MEDIA_STREAM_CHUNK_SIZE)
+                if not chunk:
+                    break
+                blocking_io.run('file_write', f.write, chunk)
+        media_info = {'filename': unique_filename, 'unique_filename': unique_filename}
+    if reader.hasher is not None and reader.bytes_read:
+        deduplicate_media(media_info, reader.hasher.hexdigest(), reader.bytes_read)
+    return media_info, reader.bytes_read
+
+def deduplicate_media(media_info, digest, size):
+    """Reference an identical stored file instead of the one just written, if there is one"""
+    media_info['sha256'] = digest
+    stored = content_store.acquire(digest, size, media_info)
+    if stored and stored['unique_filename'] != media_info['unique_filename']:
+        remove_stored_file(media_info['unique_filename'])
+        media_info['unique_filename'] = stored['unique_filename']
+        if stored.get('blob_url'):
+            media_info['blob_url'] = stored['blob_url']
+        upload_log.info('Deduplicated upload', size=size, unique_filename=stored['unique_filename'])
+
+# Stored files are never modified under their UUID name, so they can be cached forever
+MEDIA_CACHE_MAX_AGE = int(os.environ.get('MEDIA_CACHE_MAX_AGE', 365 * 24 * 3600))
+
+def media_etag(unique_filename, size):
+    """Strong ETag for an immutable stored file"""
+    return hashlib.sha1(f"{unique_filename}:{size}".encode()).hexdigest()
+
+def send_local_media(filename, mimetype=None, as_attachment=False):
+    """
+    Serve a file from the local upload folder with Range (206), ETag/If-None-Match,
+    If-Modified-Since and immutable Cache-Control; returns None if the file doesn't exist
+    """
+    upload_folder = app.config.get('UPLOAD_FOLDER', 'uploads')
+    filepath = safe_join(upload_folder, filename)
+    if not filepath or not os.path.isfile(filepath):
+        return None
+    try:
+        response = send_file(filepath, mimetype=mimetype, as_attachment=as_attachment, conditional=True,
+                             etag=media_etag(filename, os.path.getsize(filepath)), max_age=MEDIA_CACHE_MAX_AGE)
+    except RequestedRangeNotSatisfiable as e:
+        # 416 with Content-Range: bytes */<size>
+        return e.get_response()
+    response.cache_control.public = True
+    response.cache_control.immutable = True
+    return response
+
+def remove_stored_file(unique_filename):
+    """Delete an uploaded file from Azure Storage or the local uploads folder"""
+    if not unique_filename:
+        return
+    if azure_storage.is_configured():
+        azure_storage.delete_file(unique_filename)
+    else:
+        upload_folder = app.config.get('UPLOAD_FOLDER', 'uploads')
+        filepath = os.path.join(upload_folder, unique_filename)
+        if os.path.exists(filepath):
+            blocking_io.run('file_remove', os.remove, filepath)
+
+def release_stored_media(entry):
+    """Drop an entry's claim on its stored file; the bytes go once nothing references them"""
+    if entry.get('sha256') and content_store.collection is not None:
+        remove_stored_file(content_store.release(entry['sha256']))
+    else:
+        remove_stored_file(entry.get('unique_filename'))
+
+def release_task_media(task):
+    """Release the stored files of a deleted task that are shared by content address"""
+    for field in ('attachments', 'audio_notes'):
+        for entry in task.get(field) or []:
+            # Plain (unshared) files are left for the orphan sweeper
+            if entry.get('sha256'):
+                release_stored_media(entry)
+
+def push_media_entry(task_id, storage_id, field, entry):
+    """
+    Atomically append an attachment/audio entry to a task and publish the change
+    Returns the published patch, or None (after deleting the stored file) if the task does not exist
+    """
+    updated_at = datetime.utcnow()
+    updated_task = tasks_collection.find_one_and_update(
+        {'_id': ObjectId(task_id), 'storage_id': storage_id},
+        {'$push': {field: entry}, '$set': {'updated_at': updated_at}, '$inc': {'version': 1}},
+        projection={'version': 1},
+        return_document=ReturnDocument.AFTER
+    )
+    if not updated_task:
+        # Task vanished or never existed; don't leave the uploaded file orphaned
+        release_stored_media(entry)
+        return None
+    task_cache.invalidate(storage_id)
+    apply_stats_delta(storage_id, attachment_bytes=entry.get('size') or 0)
+    # The stored entry keeps the bare URL; clients (response and patch) get a signed one
+    sign_media_entry(entry)
+    # Queue Socket.IO notification carrying only the new entry
+    patch = make_patch(task_id, updated_task['version'], updated_at, push={field: [entry]})
+    broadcaster.task_patched(storage_id, patch)
+    return patch
+
+def pull_media_entry(task_id, storage_id, field, entry_id):
+    """
+    Atomically remove an attachment/audio entry matched by _id or unique_filename
+    Returns a patch describing the change plus the removed entries; the patch is None if nothing matched
+    """
+    match = {'$or': [{'_id': entry_id}, {'unique_filename': entry_id}]}
+    updated_at = datetime.utcnow()
+    task = tasks_collection.find_one_and_update(
+        {'_id': ObjectId(task_id), 'storage_id': storage_id, field: {'$elemMatch': match}},
+        {'$pull': {field: match}, '$set': {'updated_at': updated_at}, '$inc': {'version': 1}},
+        projection={field: 1, 'version': 1},
+        return_document=ReturnDocument.BEFORE
+    )
+    if not task:
+        return None, []
+    def is_match(entry):
+        return toIdString(entry.get('_id', '')) == entry_id or entry.get('unique_filename') == entry_id
+    removed = [entry for entry in task.get(field, []) if is_match(entry)]
+    patch = make_patch(task_id, task.get('version', 0) + 1, updated_at,
+                       pull={field: [toIdString(entry.get('_id')) for entry in removed]})
+    return patch, removed
+
+def task_exists(task_id, storage_id):
+    return tasks_collection.count_documents({'_id': ObjectId(task_id), 'storage_id': storage_id}, limit=1) > 0
+
+# Fields needed for counter deltas and to release a deleted task's stored files
+MEDIA_PROJECTION = {f'{field}.{key}': 1 for field in ('attachments', 'audio_notes')
+                    for key in ('size', 'unique_filename', 'sha256')}
+
+def media_bytes(task):
+    """Total size of a task's attachments and audio notes"""
+    return sum((entry.get('size') or 0) for field in ('attachments', 'audio_notes') for entry in (task.get(field) or []))
+
+# --- Task Statistics Helpers ---
+# Per-storage counters live in storage_stats and are $inc'd by every mutation.
+# They are rebuilt from an aggregation when missing or older than this many seconds,
+# which also heals any drift from a mutation racing the initial seed.
+STATS_RECONCILE_SECONDS = int(os.environ.get('STATS_RECONCILE_SECONDS', 600))
+STATS_FIELDS = ('completed', 'pending', 'backups', 'attachment_bytes')
+
+def aggregate_storage_stats(storage_id):
+    """Compute all counters for a storage with a single $group pass"""
+    pipeline = [
+        {'$match': {'storage_id': storage_id}},
+        {'$project': {
+            'completed': 1,
+            'is_backup': 1,
+            'media_bytes': {'$add': [{'$sum': '$attachments.size'}, {'$sum': '$audio_notes.size'}]}
+        }},
+        {'$group': {
+            '_id': None,
+            'completed': {'$sum': {'$cond': [{'$eq': ['$completed', True]}, 1, 0]}},
+            'pending': {'$sum': {'$cond': [{'$eq': ['$completed', False]}, 1, 0]}},
+            'backups': {'$sum': {'$cond': [{'$eq': ['$is_backup', True]}, 1, 0]}},
+            'attachment_bytes': {'$sum': '$media_bytes'}
+        }}
+    ]
+    result = next(iter(tasks_collection.aggregate(pipeline)), None) or {}
+    return {field: result.get(field, 0) for field in STATS_FIELDS}
+
+def seed_storage_stats(storage_id):
+    """Rebuild the counters document for a storage from an aggregation"""
+    stats = aggregate_storage_stats(storage_id)
+    now = datetime.utcnow()
+    stats_collection.replace_one(
+        {'_id': storage_id},
+        {**stats, 'computed_at': now, 'updated_at': now},
+        upsert=True
+    )
+    return stats
+
+def get_storage_stats(storage_id):
+    """Point lookup of the counters, seeding or reconciling them when needed"""
+    doc = stats_collection.find_one({'_id': storage_id})
+    if not doc or doc.get('computed_at', datetime.min) < datetime.utcnow() - timedelta(seconds=STATS_RECONCILE_SECONDS):
+        return seed_storage_stats(storage_id)
+    return {field: doc.get(field, 0) for field in STATS_FIELDS}
+
+def broadcast_task_stats(storage_id, stats):
+    broadcaster.stats_changed(storage_id, stats)
+
+def apply_stats_delta(storage_id, **deltas):
+    """Atomically adjust a storage's counters and push the new values to its room"""
+    if stats_collection is None:
+        return
+    inc = {field: value for field, value in deltas.items() if value}
+    if not inc:
+        return
+    try:
+        doc = stats_collection.find_one_and_update(
+            {'_id': storage_id},
+            {'$inc': inc, '$set': {'updated_at': datetime.utcnow()}},
+            return_document=ReturnDocument.AFTER
+        )
+        # No counters yet: seed them (the aggregation already includes this mutation)
+        stats = {field: doc.get(field, 0) for field in STATS_FIELDS} if doc else seed_storage_stats(storage_id)
+        broadcast_task_stats(storage_id, stats)
+    except Exception as e:
+        # Counters are advisory; reconciliation on read repairs them
+        api_log.warning('Failed to update task stats', storage=storage_id[:8], error=str(e))
+
 # --- Static & Health Routes ---
 @app.route('/')
 def index(): return send_from_directory('static', 'index.html')
@@ -181,12 +724,9 @@ def health():
     db_status = 'disconnected'
     db_error = None
     if tasks_collection is not None:
-        try:
-            mongo.db.command('ping')
-            db_status = 'connected'
-        except Exception as e:
-            db_status = 'error'
-            db_error = str(e)
+        monitor_status = db_health.status()
+        db_status = monitor_status['status']
+        db_error = monitor_status['error']
     return jsonify({
         'status': 'healthy' if db_status == 'connected' else 'degraded',
         'mongodb': db_status,
@@ -205,19 +745,30 @@ def diagnostic():
             'configured': tasks_collection is not None,
             'connection_string_prefix': MONGO_URI[:50] + '...' if MONGO_URI else 'None'
         },
-        'azure_storage': azure_storage.get_container_info()
+        'azure_storage': azure_storage.get_container_info(),
+        'task_cache': task_cache.stats(),
+        'presence': presence.stats(),
+        'blocking_io': blocking_io.stats(),
+        'content_store': content_store.stats(),
+        'media_gc': media_gc.stats(),
+        'logging': logging_stats(),
+        'activity': activity_digest.stats()
     }
     if tasks_collection is not None:
-        try:
-            mongo.db.command('ping')
-            diagnostics['mongodb'].update({
-                'status': 'connected',
-                'database': mongo.db.name,
-                'collections': mongo.db.list_collection_names(),
-                'task_count': mongo.db.tasks.count_documents({})
-            })
-        except Exception as e:
-            diagnostics['mongodb'].update({'status': 'error', 'error': str(e)})
+        monitor_status = db_health.status()
+        diagnostics['mongodb'].update({
+            'status': monitor_status['status'],
+            'health_monitor': monitor_status
+        })
+        if monitor_status['status'] == 'connected':
+            try:
+                diagnostics['mongodb'].update({
+                    'database': mongo.db.name,
+                    'collections': mongo.db.list_collection_names(),
+                    'task_count': mongo.db.tasks.estimated_document_count()
+                })
+            except Exception as e:
+                diagnostics['mongodb'].update({'status': 'error', 'error': str(e)})
     else:
         diagnostics['mongodb']['status'] = 'not configured'
     
@@ -254,64 +805,64 @@ def list_storage_files():
             'count': len(files)
         })
     except Exception as e:
-        print(f"❌ Error listing storage files: {e}")
+        api_log.error('Error listing storage files', error=str(e))
         return jsonify({'error': f'Failed to list files: {str(e)}'}), 500
 
+@app.route('/metrics', methods=['GET'])
+def metrics_endpoint():
+    """Prometheus scrape endpoint"""
+    if not metrics.enabled:
+        return jsonify({'error': 'Metrics are disabled'}), 404
+    return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
+
 # --- SocketIO Handlers (FIXED & VERIFIED for real-time user count) ---
 @socketio.on('connect')
+@metrics.track_event('connect')
 def on_connect():
-    print(f'✅ Client connected: {request.sid}')
+    socket_log.info('Client connected', sid=request.sid)
 
 @socketio.on('disconnect')
+@metrics.track_event('disconnect')
 def on_disconnect():
     sid = request.sid
-    print(f"👋 Client disconnected: {sid}")
-    storages = sid_to_storages.pop(sid, set())
+    socket_log.info('Client disconnected', sid=sid)
+    storages = presence.disconnect(sid)
+    activity_digest.forget(sid)
     for storage_id in list(storages):
-        s = storage_connections.get(storage_id)
-        if s and sid in s:
-            s.remove(sid)
-            if not s: del storage_connections[storage_id]
         # This broadcast is crucial for real-time updates
         update_and_broadcast_online_count(storage_id)
 
 @socketio.on('join_storage')
+@metrics.track_event('join_storage')
 def on_join_storage(data):
     storage_id = data.get('storage_id')
     if storage_id:
-        print(f"🔌 Client {request.sid} joining storage room: {storage_id[:8]}...")
         join_room(f'storage_{storage_id}')
         sid = request.sid
-        storage_connections.setdefault(storage_id, set()).add(sid)
-        sid_to_storages.setdefault(sid, set()).add(storage_id)
-        print(f"📊 Storage {storage_id[:8]}... now has {len(storage_connections[storage_id])} connection(s)")
+        count = presence.join(storage_id, sid)
+        socket_log.info('Client joined storage', sid=sid, storage=storage_id[:8], connections=count)
         update_and_broadcast_online_count(storage_id)
         emit('joined_storage', {'storage_id': storage_id})
+        # Who is active right now (on this worker); later changes arrive with the room digests
+        emit('presence_digest', activity_digest.digest(storage_id))
 
 @socketio.on('leave_storage')
+@metrics.track_event('leave_storage')
 def on_leave_storage(data):
     storage_id = data.get('storage_id')
     if storage_id:
         leave_room(f'storage_{storage_id}')
-        sid = request.sid
-        s = storage_connections.get(storage_id)
-        if s and sid in s:
-            s.remove(sid)
-            if not s:
-                del storage_connections[storage_id]
-        else:
-            storage_connections[storage_id] = s
-        if sid in sid_to_storages and storage_id in sid_to_storages[sid]:
-            sid_to_storages[sid].remove(storage_id)
-            if not sid_to_storages[sid]:
-                del sid_to_storages[sid]
+        presence.leave(storage_id, request.sid)
+        activity_digest.forget(request.sid, storage_id)
         update_and_broadcast_online_count(storage_id)
 
 @socketio.on('user_activity')
+@metrics.track_event('user_activity')
 def on_user_activity(data):
     storage_id, user_id, activity = data.get('storage_id'), data.get('user_id'), data.get('activity')
     if storage_id and user_id:
-        emit('user_activity_update', {'user_id': user_id, 'activity': activity, 'timestamp': datetime.utcnow().isoformat()}, room=f'storage_{storage_id}', include_self=False)
+        # Aggregated into the room's next presence digest instead of being relayed to every client
+        activity_digest.record(storage_id, str(user_id), activity, request.sid)
 
 # --- Task API Endpoints ---
 @app.route('/api/tasks', methods=['GET'])
@@ -322,15 +873,88 @@ def get_tasks():
     storage_id = request.args.get('storage_id')
     if not storage_id:
         return jsonify({'error': 'Storage ID is required'}), 400
+    paginate = 'limit' in request.args or 'cursor' in request.args
+    filtered = any(key in request.args for key in ('completed', 'is_backup', 'sort', 'order'))
     try:
-        tasks = [serialize_document(task) for task in tasks_collection.find({'storage_id': storage_id})]
-        return jsonify(tasks)
+        if not paginate and not filtered:
+            # Clients start delta sync from this watermark rather than from the newest task they got
+            watermark = sync_watermark()
+            # Serve the serialized list from the per-storage cache; mutations invalidate it
+            body = task_cache.get_or_load(storage_id, lambda: app.json.dumps(
+                [serialize_document(task) for task in tasks_collection.find({'storage_id': storage_id})]
+            ).encode('utf-8'))
+            return app.response_class(body, mimetype='application/json', headers={SYNC_WATERMARK_HEADER: watermark})
+
+        try:
+            query, sort, sort_field = build_task_query(storage_id, request.args)
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+        try:
+            limit = int(request.args.get('limit', TASKS_PAGE_SIZE_MAX))
+        except ValueError:
+            limit = 0
+        if limit < 1:
+            return jsonify({'error': 'Limit must be a positive integer'}), 400
+        limit = min(limit, TASKS_PAGE_SIZE_MAX)
+
+        if not paginate:
+            return jsonify([serialize_document(task) for task in tasks_collection.find(query).sort(sort)])
+
+        # Fetch one extra document to know whether another page exists
+        docs = list(tasks_collection.find(query).sort(sort).limit(limit + 1))
+        has_more = len(docs) > limit
+        docs = docs[:limit]
+        next_cursor = encode_cursor(docs[-1], sort_field) if has_more else None
+        return jsonify({
+            'tasks': [serialize_document(task) for task in docs],
+            'next_cursor': next_cursor,
+            'has_more': has_more
+        })
     except Exception as e:
-        print(f"❌ Error fetching tasks: {e}")
-        import traceback
-        traceback.print_exc()
+        api_log.exception('Error fetching tasks')
         return jsonify({'error': f'Failed to fetch tasks: {str(e)}'}), 500
 
+@app.route('/api/tasks/changes', methods=['GET'])
+def get_task_changes():
+    """Return tasks created or modified since a watermark, plus IDs of deleted tasks"""
+    db_check = check_db_connection()
+    if db_check:
+        return db_check
+    storage_id = request.args.get('storage_id')
+    if not storage_id:
+        return jsonify({'error': 'Storage ID is required'}), 400
+    since = request.args.get('since')
+    if not since:
+        return jsonify({'error': 'since watermark is required'}), 400
+    try:
+        since_dt = parse_watermark(since)
+    except (ValueError, OverflowError, OSError):
+        return jsonify({'error': f'Invalid since watermark: {since}'}), 400
+    try:
+        now = datetime.utcnow()
+        watermark = sync_watermark(now)
+        if since_dt < now - timedelta(days=TOMBSTONE_RETENTION_DAYS):
+            # Deletions this old may already be pruned; the client must reload everything
+            return jsonify({'full_resync': True, 'tasks': [], 'deleted': [], 'watermark': watermark})
+
+        changed = [serialize_document(task) for task in tasks_collection.find({
+            'storage_id': storage_id,
+            'updated_at': {'$gte': since_dt}
+        })]
+        deleted = [tomb['task_id'] for tomb in tombstones_collection.find(
+            {'storage_id': storage_id, 'deleted_at': {'$gte': since_dt}},
+            {'task_id': 1, '_id': 0}
+        )]
+        return jsonify({
+            'full_resync': False,
+            'tasks': changed,
+            'deleted': deleted,
+            'watermark': watermark
+        })
+    except Exception as e:
+        api_log.exception('Error fetching task changes')
+        return jsonify({'error': f'Failed to fetch task changes: {str(e)}'}), 500
+
 @app.route('/api/tasks', methods=['POST'])
 def create_task():
     db_check = check_db_connection()
@@ -342,37 +966,48 @@ def create_task():
         if not storage_id:
             return jsonify({'error': 'Storage ID is required'}), 400
         
-        task_data = {
-            'title': data.get('title', ''),
-            'description': data.get('description', ''),
-            'completed': False,
-            'storage_id': storage_id,
-            'created_at': datetime.utcnow(),
-            'updated_at': datetime.utcnow(),
-            'attachments': [],
-            'audio_notes': [],
-            'is_backup': data.get('is_backup', False),
-            'original_id': data.get('original_id'),
-            'backup_reason': data.get('backup_reason')
-        }
+        task_data = build_new_task(data, storage_id)
+        if task_data['is_backup']:
+            # Backups keep the original's files when they can share them by reference
+            task_data['attachments'] = content_store.retain(data.get('attachments'))
+            task_data['audio_notes'] = content_store.retain(data.get('audio_notes'))
         
-        result = tasks_collection.insert_one(task_data)
+        try:
+            result = tasks_collection.insert_one(task_data)
+        except Exception:
+            release_task_media(task_data)
+            raise
         task_data['_id'] = str(result.inserted_id)
+        task_cache.invalidate(storage_id)
+        apply_stats_delta(storage_id, pending=1, backups=1 if task_data['is_backup'] else 0,
+                          attachment_bytes=media_bytes(task_data))
         
-        # Emit Socket.IO event for real-time sync
-        print(f"📤 Emitting task_created event to room storage_{storage_id[:8]}...")
-        socketio.emit('task_created', {
-            'task': serialize_document(task_data),
-            'storage_id': storage_id
-        }, room=f'storage_{storage_id}')
+        # Queue Socket.IO notification for real-time sync
+        broadcaster.task_created(storage_id, serialize_document(task_data))
         
-        return jsonify(serialize_document(task_data)), 201
+        return jsonify(task_data), 201
     except Exception as e:
-        print(f"❌ Error creating task: {e}")
-        import traceback
-        traceback.print_exc()
+        api_log.exception('Error creating task')
         return jsonify({'error': f'Failed to create task: {str(e)}'}), 500
 
+@app.route('/api/tasks/<task_id>', methods=['GET'])
+def get_task(task_id):
+    """Full document for a single task (used by clients that detect a patch version gap)"""
+    db_check = check_db_connection()
+    if db_check:
+        return db_check
+    storage_id = request.args.get('storage_id')
+    if not storage_id:
+        return jsonify({'error': 'Storage ID is required'}), 400
+    try:
+        task = tasks_collection.find_one({'_id': ObjectId(task_id), 'storage_id': storage_id})
+        if not task:
+            return jsonify({'error': 'Task not found'}), 404
+        return jsonify(serialize_document(task))
+    except Exception as e:
+        api_log.error('Error fetching task', error=str(e))
+        return jsonify({'error': f'Failed to fetch task: {str(e)}'}), 500
+
 @app.route('/api/tasks/<task_id>', methods=['PUT'])
 def update_task(task_id):
     db_check = check_db_connection()
@@ -384,43 +1019,32 @@ def update_task(task_id):
         if not storage_id:
             return jsonify({'error': 'Storage ID is required'}), 400
         
-        # Find the task to ensure it exists and belongs to the storage
-        task = tasks_collection.find_one({'_id': ObjectId(task_id), 'storage_id': storage_id})
-        if not task:
-            return jsonify({'error': 'Task not found'}), 404
-        
         # Build update data
-        update_data = {'updated_at': datetime.utcnow()}
-        if 'title' in data:
-            update_data['title'] = data['title']
-        if 'description' in data:
-            update_data['description'] = data.get('description', '')
-        if 'completed' in data:
-            update_data['completed'] = data['completed']
-        
-        # Update the task
-        tasks_collection.update_one(
+        update_data = build_task_update(data)
+        
+        # Update the task in one round-trip; the pre-image tells us whether completion flipped
+        updated_task = tasks_collection.find_one_and_update(
             {'_id': ObjectId(task_id), 'storage_id': storage_id},
-            {'$set': update_data}
+            {'$set': update_data, '$inc': {'version': 1}},
+            return_document=ReturnDocument.BEFORE
         )
-        
-        # Fetch updated task
-        updated_task = tasks_collection.find_one({'_id': ObjectId(task_id)})
-        
-        # Emit Socket.IO event for real-time sync
-        update_type = 'completed' if 'completed' in data else 'updated'
-        print(f"📤 Emitting task_updated event (type: {update_type}) to room storage_{storage_id[:8]}...")
-        socketio.emit('task_updated', {
-            'task': serialize_document(updated_task),
-            'storage_id': storage_id,
-            'update_type': update_type
-        }, room=f'storage_{storage_id}')
+        if not updated_task:
+            return jsonify({'error': 'Task not found'}), 404
+        was_completed = updated_task.get('completed') is True
+        updated_task.update(update_data)
+        updated_task['version'] = updated_task.get('version', 0) + 1
+        task_cache.invalidate(storage_id)
+        if 'completed' in update_data and update_data['completed'] != was_completed:
+            flip = 1 if update_data['completed'] else -1
+            apply_stats_delta(storage_id, completed=flip, pending=-flip)
+        
+        # Queue Socket.IO notification carrying only the changed fields
+        changed = serialize_document({key: value for key, value in update_data.items() if key != 'updated_at'})
+        broadcaster.task_patched(storage_id, make_patch(task_id, updated_task['version'], update_data['updated_at'], changed))
         
         return jsonify(serialize_document(updated_task))
     except Exception as e:
-        print(f"❌ Error updating task: {e}")
-        import traceback
-        traceback.print_exc()
+        api_log.exception('Error updating task')
         return jsonify({'error': f'Failed to update task: {str(e)}'}), 500
 
 @app.route('/api/tasks/<task_id>', methods=['DELETE'])
@@ -433,28 +1057,186 @@ def delete_task(task_id):
         if not storage_id:
             return jsonify({'error': 'Storage ID is required'}), 400
         
-        # Find the task to ensure it exists and belongs to the storage
-        task = tasks_collection.find_one({'_id': ObjectId(task_id), 'storage_id': storage_id})
-        if not task:
+        # Delete the task (the returned document tells us whether it existed)
+        deleted_task = tasks_collection.find_one_and_delete(
+            {'_id': ObjectId(task_id), 'storage_id': storage_id},
+            projection={'_id': 1, 'completed': 1, 'is_backup': 1, **MEDIA_PROJECTION}
+        )
+        if not deleted_task:
             return jsonify({'error': 'Task not found'}), 404
+        release_task_media(deleted_task)
+        record_tombstones(storage_id, [task_id])
+        task_cache.invalidate(storage_id)
+        apply_stats_delta(
+            storage_id,
+            completed=-1 if deleted_task.get('completed') is True else 0,
+            pending=-1 if deleted_task.get('completed') is False else 0,
+            backups=-1 if deleted_task.get('is_backup') is True else 0,
+            attachment_bytes=-media_bytes(deleted_task)
+        )
         
-        # Delete the task
-        tasks_collection.delete_one({'_id': ObjectId(task_id), 'storage_id': storage_id})
-        
-        # Emit Socket.IO event for real-time sync
-        print(f"📤 Emitting task_deleted event to room storage_{storage_id[:8]}...")
-        socketio.emit('task_deleted', {
-            'task_id': task_id,
-            'storage_id': storage_id
-        }, room=f'storage_{storage_id}')
+        # Queue Socket.IO notification for real-time sync
+        broadcaster.task_deleted(storage_id, task_id)
         
         return jsonify({'message': 'Task deleted successfully'})
     except Exception as e:
-        print(f"❌ Error deleting task: {e}")
-        import traceback
-        traceback.print_exc()
+        api_log.exception('Error deleting task')
         return jsonify({'error': f'Failed to delete task: {str(e)}'}), 500
 
+BATCH_MAX_OPERATIONS = int(os.environ.get('BATCH_MAX_OPERATIONS', 500))
+
+@app.route('/api/tasks/batch', methods=['POST'])
+def batch_tasks():
+    """
+    Apply an ordered list of create/update/complete/delete operations with one bulk_write
+    Replies with one result per operation (updates carry their field-level patch instead of
+    the re-read task) and emits a single tasks_changed event
+    """
+    db_check = check_db_connection()
+    if db_check:
+        return db_check
+    try:
+        data = request.get_json() or {}
+        storage_id = data.get('storage_id')
+        if not storage_id:
+            return jsonify({'error': 'Storage ID is required'}), 400
+        operations = data.get('operations')
+        if not isinstance(operations, list) or not operations:
+            return jsonify({'error': 'operations must be a non-empty list'}), 400
+        if len(operations) > BATCH_MAX_OPERATIONS:
+            return jsonify({'error': f'At most {BATCH_MAX_OPERATIONS} operations per batch'}), 400
+
+        # One read for every task referenced, used for existence checks and counter deltas
+        referenced = set()
+        for operation in operations:
+            if isinstance(operation, dict) and ObjectId.is_valid(operation.get('task_id') or ''):
+                referenced.add(ObjectId(operation['task_id']))
+        state = {}
+        if referenced:
+            for task in tasks_collection.find(
+                {'_id': {'$in': list(referenced)}, 'storage_id': storage_id},
+                {'completed': 1, 'is_backup': 1, 'version': 1, **MEDIA_PROJECTION}
+            ):
+                state[task['_id']] = task
+
+        results = [None] * len(operations)
+        writes = []       # pymongo write models
+        write_index = []  # operation index of each write model
+        created = {}
+        removed_tasks = {}  # operation index -> task document of a delete
+        patches = {}  # operation index -> field-level patch of an update/complete
+        deltas = {'completed': 0, 'pending': 0, 'backups': 0, 'attachment_bytes': 0}
+
+        for index, operation in enumerate(operations):
+            op = operation.get('op') if isinstance(operation, dict) else None
+            if op == 'create':
+                fields = operation.get('task') or {}
+                task_data = build_new_task(fields, storage_id)
+                task_data['_id'] = ObjectId()
+                if task_data['is_backup']:
+                    # Same sharing as create_task; released again below if the write doesn't happen
+                    task_data['attachments'] = content_store.retain(fields.get('attachments'))
+                    task_data['audio_notes'] = content_store.retain(fields.get('audio_notes'))
+                writes.append(InsertOne(task_data))
+                created[index] = task_data
+                deltas['pending'] += 1
+                deltas['backups'] += 1 if task_data['is_backup'] else 0
+                deltas['attachment_bytes'] += media_bytes(task_data)
+            elif op in ('update', 'complete', 'delete'):
+                task_id = operation.get('task_id') or ''
+                if not ObjectId.is_valid(task_id):
+                    results[index] = {'op': op, 'task_id': task_id, 'status': 'error', 'error': 'Invalid task ID'}
+                    continue
+                oid = ObjectId(task_id)
+                current = state.get(oid)
+                if current is None:
+                    results[index] = {'op': op, 'task_id': task_id, 'status': 'not_found'}
+                    continue
+                if op == 'delete':
+                    writes.append(DeleteOne({'_id': oid, 'storage_id': storage_id}))
+                    deltas['completed'] -= 1 if current.get('completed') is True else 0
+                    deltas['pending'] -= 1 if current.get('completed') is False else 0
+                    deltas['backups'] -= 1 if current.get('is_backup') is True else 0
+                    deltas['attachment_bytes'] -= media_bytes(current)
+                    removed_tasks[index] = state.pop(oid)
+                else:
+                    fields = operation.get('fields') or {}
+                    if op == 'complete':
+                        fields = {'completed': operation.get('completed', True)}
+                    update_data = build_task_update(fields)
+                    writes.append(UpdateOne({'_id': oid, 'storage_id': storage_id},
+                                            {'$set': update_data, '$inc': {'version': 1}}))
+                    # Ordered writes apply in sequence, so the resulting version is known up front
+                    current['version'] = current.get('version', 0) + 1
+                    changed = serialize_document({key: value for key, value in update_data.items() if key != 'updated_at'})
+                    patches[index] = make_patch(task_id, current['version'], update_data['updated_at'], changed)
+                    if 'completed' in update_data and update_data['completed'] != (current.get('completed') is True):
+                        flip = 1 if update_data['completed'] else -1
+                        deltas['completed'] += flip
+                        deltas['pending'] -= flip
+                        current['completed'] = update_data['completed']
+            else:
+                results[index] = {'op': op, 'status': 'error', 'error': f'Unknown operation: {op}'}
+                continue
+            write_index.append(index)
+
+        failed_at = None
+        if writes:
+            try:
+                tasks_collection.bulk_write(writes, ordered=True)
+            except BulkWriteError as e:
+                # Ordered writes stop at the first error; nothing after it was applied
+                write_error = e.details['writeErrors'][0]
+                failed_at = write_error['index']
+                results[write_index[failed_at]] = {
+                    'op': operations[write_index[failed_at]].get('op'),
+                    'status': 'error',
+                    'error': write_error.get('errmsg')
+                }
+                for skipped in write_index[failed_at + 1:]:
+                    results[skipped] = {'op': operations[skipped].get('op'), 'status': 'skipped'}
+                # Counters would no longer match what was written; rebuild them instead
+                deltas = None
+            except Exception:
+                for task_data in created.values():
+                    release_task_media(task_data)
+                raise
+
+        applied = set(write_index[:failed_at] if failed_at is not None else write_index)
+        created_tasks, patched, deleted = [], [], []
+        for index in write_index:
+            if index not in applied:
+                if index in created:
+                    release_task_media(created[index])
+                continue
+            operation = operations[index]
+            if index in created:
+                task = serialize_document(dict(created[index]))
+                created_tasks.append(task)
+                results[index] = {'op': 'create', 'status': 'ok', 'task': task}
+            elif operation.get('op') == 'delete':
+                deleted.append(operation['task_id'])
+                release_task_media(removed_tasks[index])
+                results[index] = {'op': 'delete', 'task_id': operation['task_id'], 'status': 'ok'}
+            else:
+                patch = patches[index]
+                patched.append(patch)
+                results[index] = {'op': operation.get('op'), 'task_id': operation['task_id'], 'status': 'ok', 'patch': patch}
+
+        if applied:
+            record_tombstones(storage_id, deleted)
+            task_cache.invalidate(storage_id)
+            if deltas is None:
+                broadcast_task_stats(storage_id, seed_storage_stats(storage_id))
+            else:
+                apply_stats_delta(storage_id, **deltas)
+            broadcaster.changes(storage_id, created=created_tasks, patched=patched, deleted=deleted)
+
+        return jsonify({'results': results})
+    except Exception as e:
+        api_log.exception('Error applying task batch')
+        return jsonify({'error': f'Failed to apply task batch: {str(e)}'}), 500
+
 @app.route('/api/tasks/stats', methods=['GET'])
 def get_task_stats():
     db_check = check_db_connection()
@@ -464,11 +1246,9 @@ def get_task_stats():
     if not storage_id:
         return jsonify({'error': 'Storage ID is required'}), 400
     try:
-        completed = tasks_collection.count_documents({'storage_id': storage_id, 'completed': True})
-        pending = tasks_collection.count_documents({'storage_id': storage_id, 'completed': False})
-        return jsonify({'completed': completed, 'pending': pending})
+        return jsonify(get_storage_stats(storage_id))
     except Exception as e:
-        print(f"❌ Error fetching task stats: {e}")
+        api_log.error('Error fetching task stats', error=str(e))
         return jsonify({'error': f'Failed to fetch task stats: {str(e)}'}), 500
 
 @app.route('/api/storage/online-count', methods=['GET'])
@@ -477,10 +1257,10 @@ def get_online_count():
     if not storage_id:
         return jsonify({'error': 'Storage ID is required'}), 400
     try:
-        count = len(storage_connections.get(storage_id, set()))
+        count = presence.count(storage_id)
         return jsonify({'count': count, 'storage_id': storage_id})
     except Exception as e:
-        print(f"❌ Error fetching online count: {e}")
+        api_log.error('Error fetching online count', error=str(e))
         return jsonify({'error': f'Failed to fetch online count: {str(e)}'}), 500
 
 @app.route('/api/test-socket', methods=['GET'])
@@ -536,48 +1316,36 @@ def upload_file(task_id):
         if file.filename == '':
             return jsonify({'error': 'No file selected'}), 400
         
-        # Find the task to ensure it exists and belongs to the storage
-        task = tasks_collection.find_one({'_id': ObjectId(task_id), 'storage_id': storage_id})
-        if not task:
-            return jsonify({'error': 'Task not found'}), 404
-        
-        # Upload file (Azure or local)
+        # Upload file (Azure or local); task existence is checked atomically when attaching
         # Get file size before upload
         file.seek(0, 2)  # Seek to end
         file_size = file.tell()
         file.seek(0)  # Reset to beginning
         
-        print(f"📤 File upload request:")
-        print(f"   📋 Original filename: {file.filename}")
-        print(f"   📏 File size: {file_size} bytes")
-        print(f"   🔧 Azure Storage configured: {azure_storage.is_configured()}")
-        print(f"   🌍 Azure Environment: {azure_config.AzureEnvironment}")
+        upload_log.info('File upload', task_id=task_id, filename=file.filename, size=file_size,
+                        backend='azure' if azure_storage.is_configured() else 'local')
         
-        if azure_storage.is_configured():
-            print(f"   ☁️ Using Azure Storage for upload")
-            upload_result = azure_storage.upload_file(file)
-            if not upload_result:
-                print(f"❌ Azure Storage upload returned None")
+        unique_filename = f"{uuid.uuid4()}_{secure_filename(file.filename)}"
+        if azure_storage.is_configured() or content_store.hasher() is not None:
+            # Streamed in chunks, hashed on the way when content-addressed storage is on
+            media_info, size = store_media_stream(file.stream, unique_filename, file_size, file.mimetype)
+            if media_info is None:
+                upload_log.error('Azure Storage upload returned None', task_id=task_id)
                 return jsonify({'error': 'Failed to upload file to Azure Storage'}), 500
-            print(f"   ✅ Upload result received: {upload_result.get('unique_filename')}")
             file_info = {
                 '_id': str(uuid.uuid4()),
-                'filename': upload_result.get('filename'),
-                'unique_filename': upload_result.get('unique_filename'),
-                'blob_url': upload_result.get('blob_url'),
+                **media_info,
+                'filename': secure_filename(file.filename),
                 'uploaded_at': datetime.utcnow().isoformat(),
-                'size': file_size
+                'size': size
             }
         else:
             # Local file storage
-            print(f"   📁 Using local file storage")
             upload_folder = app.config.get('UPLOAD_FOLDER', 'uploads')
             os.makedirs(upload_folder, exist_ok=True)
-            unique_filename = f"{uuid.uuid4()}_{secure_filename(file.filename)}"
             filepath = os.path.join(upload_folder, unique_filename)
-            print(f"   📍 Saving to: {filepath}")
-            file.save(filepath)
-            print(f"   ✅ File saved locally")
+            # The multipart body is already spooled, so the whole save can leave the hub
+            blocking_io.run('file_save', file.save, filepath)
             file_info = {
                 '_id': str(uuid.uuid4()),
                 'filename': secure_filename(file.filename),
@@ -587,144 +1355,310 @@ def upload_file(task_id):
             }
         
         # Add attachment to task
-        tasks_collection.update_one(
-            {'_id': ObjectId(task_id), 'storage_id': storage_id},
-            {'$push': {'attachments': file_info}, '$set': {'updated_at': datetime.utcnow()}}
-        )
-        
-        # Fetch updated task
-        updated_task = tasks_collection.find_one({'_id': ObjectId(task_id)})
-        
-        # Emit Socket.IO event for real-time sync
-        socketio.emit('task_updated', {
-            'task': serialize_document(updated_task),
-            'storage_id': storage_id,
-            'update_type': 'attachment_added'
-        }, room=f'storage_{storage_id}')
+        patch = push_media_entry(task_id, storage_id, 'attachments', file_info)
+        if patch is None:
+            return jsonify({'error': 'Task not found'}), 404
         
-        return jsonify({'file_info': file_info})
+        # The task's new version lets the client recognise the echo of this change
+        return jsonify({'file_info': file_info, 'version': patch['version'], 'updated_at': patch['updated_at']})
     except Exception as e:
-        print(f"❌ Error uploading file: {e}")
-        import traceback
-        traceback.print_exc()
+        api_log.exception('Error uploading file')
         return jsonify({'error': f'Failed to upload file: {str(e)}'}), 500
 
 @app.route('/api/tasks/<task_id>/audio', methods=['POST'])
 def upload_audio(task_id):
+    """
+    Store a voice note for a task. Accepts the recording as:
+      - a raw body (audio/* or application/octet-stream) with storage_id/duration query args
+      - multipart/form-data with an 'audio' file part and storage_id/duration form fields
+      - JSON {storage_id, audio_data: <base64 data URL>, duration} (legacy clients)
+    Binary bodies are streamed to storage in chunks instead of being decoded in memory
+    """
     db_check = check_db_connection()
     if db_check:
         return db_check
     try:
-        data = request.get_json()
-        storage_id = data.get('storage_id')
-        if not storage_id:
-            return jsonify({'error': 'Storage ID is required'}), 400
+        content_type = request.mimetype or ''
+        length = None
+        if request.is_json:
+            data = request.get_json()
+            storage_id = data.get('storage_id')
+            audio_data = data.get('audio_data')
+            duration = data.get('duration', 0)
+            if not storage_id:
+                return jsonify({'error': 'Storage ID is required'}), 400
+            if not audio_data:
+                return jsonify({'error': 'Audio data is required'}), 400
+            # Decode base64 audio data
+            try:
+                header, _, encoded = audio_data.rpartition(',')
+                audio_bytes = base64.b64decode(encoded)
+            except Exception as e:
+                return jsonify({'error': f'Invalid audio data: {str(e)}'}), 400
+            content_type = header[5:].split(';')[0] if header.startswith('data:') else 'audio/webm'
+            audio_stream = BytesIO(audio_bytes)
+            length = len(audio_bytes)
+        elif content_type == 'multipart/form-data':
+            storage_id = request.form.get('storage_id')
+            duration = request.form.get('duration', 0, type=float)
+            audio_file = request.files.get('audio')
+            if not storage_id:
+                return jsonify({'error': 'Storage ID is required'}), 400
+            if not audio_file:
+                return jsonify({'error': 'No audio part in the request'}), 400
+            content_type = audio_file.mimetype or 'audio/webm'
+            audio_stream = audio_file.stream
+        elif content_type.startswith('audio/') or content_type == 'application/octet-stream':
+            storage_id = request.args.get('storage_id')
+            duration = request.args.get('duration', 0, type=float)
+            if not storage_id:
+                return jsonify({'error': 'Storage ID is required'}), 400
+            if content_type == 'application/octet-stream':
+                content_type = 'audio/webm'
+            audio_stream = request.stream
+            length = request.content_length
+        else:
+            return jsonify({'error': f'Unsupported content type: {content_type}'}), 415
+
+        unique_filename = f"audio_{uuid.uuid4()}{AUDIO_EXTENSIONS.get(content_type, '.webm')}"
         
-        audio_data = data.get('audio_data')
-        duration = data.get('duration', 0)
+        upload_log.info('Audio upload', task_id=task_id, size=length if length is not None else 'streamed',
+                        content_type=content_type, backend='azure' if azure_storage.is_configured() else 'local')
         
-        if not audio_data:
+        audio_info, size = store_media_stream(audio_stream, unique_filename, length, content_type)
+        if audio_info is None:
+            upload_log.error('Azure Storage audio upload returned None', task_id=task_id)
+            return jsonify({'error': 'Failed to upload audio to Azure Storage'}), 500
+        if not size:
+            release_stored_media(audio_info)
             return jsonify({'error': 'Audio data is required'}), 400
-        
-        # Find the task to ensure it exists and belongs to the storage
-        task = tasks_collection.find_one({'_id': ObjectId(task_id), 'storage_id': storage_id})
-        if not task:
-            return jsonify({'error': 'Task not found'}), 404
-        
-        # Decode base64 audio data
-        try:
-            audio_bytes = base64.b64decode(audio_data.split(',')[-1] if ',' in audio_data else audio_data)
-        except Exception as e:
-            return jsonify({'error': f'Invalid audio data: {str(e)}'}), 400
-        
-        # Upload audio file (Azure or local)
-        unique_filename = f"audio_{uuid.uuid4()}.webm"
-        
-        print(f"🎤 Audio upload request:")
-        print(f"   📏 Audio size: {len(audio_bytes)} bytes")
-        print(f"   🔧 Azure Storage configured: {azure_storage.is_configured()}")
-        print(f"   🌍 Azure Environment: {azure_config.AzureEnvironment}")
-        
-        if azure_storage.is_configured():
-            print(f"   ☁️ Using Azure Storage for audio upload")
-            from io import BytesIO
-            audio_file = BytesIO(audio_bytes)
-            audio_file.name = unique_filename
-            upload_result = azure_storage.upload_file(audio_file, filename=unique_filename)
-            if not upload_result:
-                print(f"❌ Azure Storage audio upload returned None")
-                return jsonify({'error': 'Failed to upload audio to Azure Storage'}), 500
-            print(f"   ✅ Audio upload result received: {upload_result.get('unique_filename')}")
-            audio_info = {
-                '_id': str(uuid.uuid4()),
-                'filename': upload_result.get('filename', unique_filename),
-                'unique_filename': upload_result.get('unique_filename'),
-                'blob_url': upload_result.get('blob_url'),
-                'duration': duration,
-                'recorded_at': datetime.utcnow().isoformat(),
-                'size': len(audio_bytes)
-            }
-            print(f"   📋 Audio info saved to DB: filename={audio_info['filename']}, unique_filename={audio_info['unique_filename']}")
-            print(f"   🔗 Blob URL: {audio_info['blob_url']}")
-        else:
-            # Local file storage
-            upload_folder = app.config.get('UPLOAD_FOLDER', 'uploads')
-            os.makedirs(upload_folder, exist_ok=True)
-            filepath = os.path.join(upload_folder, unique_filename)
-            with open(filepath, 'wb') as f:
-                f.write(audio_bytes)
-            audio_info = {
-                '_id': str(uuid.uuid4()),
-                'filename': unique_filename,
-                'unique_filename': unique_filename,
-                'duration': duration,
-                'recorded_at': datetime.utcnow().isoformat(),
-                'size': len(audio_bytes)
-            }
+        audio_info.update({
+            '_id': str(uuid.uuid4()),
+            'duration': duration,
+            'recorded_at': datetime.utcnow().isoformat(),
+            'size': size
+        })
         
         # Add audio recording to task
-        tasks_collection.update_one(
-            {'_id': ObjectId(task_id), 'storage_id': storage_id},
-            {'$push': {'audio_notes': audio_info}, '$set': {'updated_at': datetime.utcnow()}}
-        )
-        
-        # Fetch updated task
-        updated_task = tasks_collection.find_one({'_id': ObjectId(task_id)})
-        
-        # Emit Socket.IO event for real-time sync
-        socketio.emit('task_updated', {
-            'task': serialize_document(updated_task),
-            'storage_id': storage_id,
-            'update_type': 'audio_added'
-        }, room=f'storage_{storage_id}')
+        patch = push_media_entry(task_id, storage_id, 'audio_notes', audio_info)
+        if patch is None:
+            return jsonify({'error': 'Task not found'}), 404
         
-        return jsonify({'audio_info': audio_info})
+        return jsonify({'audio_info': audio_info, 'version': patch['version'], 'updated_at': patch['updated_at']})
     except Exception as e:
-        print(f"❌ Error uploading audio: {e}")
-        import traceback
-        traceback.print_exc()
+        api_log.exception('Error uploading audio')
         return jsonify({'error': f'Failed to upload audio: {str(e)}'}), 500
 
+# --- Resumable Upload Sessions ---
+def upload_session_error(error):
+    return jsonify({'error': error.message, **error.details}), error.status_code
+
+@app.route('/api/tasks/<task_id>/uploads', methods=['POST'])
+def create_upload_session(task_id, direct=False):
+    """Start a resumable upload: {storage_id, filename, size, content_type}"""
+    db_check = check_db_connection()
+    if db_check:
+        return db_check
+    try:
+        data = request.get_json() or {}
+        storage_id = data.get('storage_id')
+        if not storage_id:
+            return jsonify({'error': 'Storage ID is required'}), 400
+        try:
+            size = int(data.get('size') or 0)
+        except (TypeError, ValueError):
+            return jsonify({'error': 'size must be an integer'}), 400
+        if not task_exists(task_id, storage_id):
+            return jsonify({'error': 'Task not found'}), 404
+        session = upload_sessions.create(task_id, storage_id, data.get('filename'), size, data.get('content_type'),
+                                         direct=direct)
+        upload_log.info('Upload session created', upload_id=session['_id'], filename=session['filename'], size=size,
+                        chunks=session['total_chunks'], backend=session['backend'])
+        result = upload_sessions.status(session)
+        if direct:
+            try:
+                result.update(upload_sessions.direct_upload_target(session))
+            except UploadSessionError:
+                upload_sessions.abort(session)
+                raise
+        return jsonify(result), 201
+    except UploadSessionError as e:
+        return upload_session_error(e)
+    except Exception as e:
+        api_log.exception('Error creating upload session')
+        return jsonify({'error': f'Failed to create upload session: {str(e)}'}), 500
+
+@app.route('/api/tasks/<task_id>/direct-uploads', methods=['POST'])
+def create_direct_upload(task_id):
+    """
+    Start a direct-to-storage upload: {storage_id, filename, size, content_type}
+    Returns a write-only SAS upload_url the client PUTs the file to, then commits
+    with POST /api/uploads/<upload_id>/complete; 501 when blob storage isn't configured
+    """
+    return create_upload_session(task_id, direct=True)
+
+@app.route('/api/uploads/<upload_id>', methods=['GET'])
+def get_upload_session(upload_id):
+    """Report which chunks of a session have been received"""
+    db_check = check_db_connection()
+    if db_check:
+        return db_check
+    try:
+        storage_id = request.args.get('storage_id')
+        if not storage_id:
+            return jsonify({'error': 'Storage ID is required'}), 400
+        return jsonify(upload_sessions.status(upload_sessions.get(upload_id, storage_id)))
+    except UploadSessionError as e:
+        return upload_session_error(e)
+    except Exception as e:
+        api_log.error('Error fetching upload session', error=str(e))
+        return jsonify({'error': f'Failed to fetch upload session: {str(e)}'}), 500
+
+@app.route('/api/uploads/<upload_id>/chunks/<int:index>', methods=['PUT'])
+def put_upload_chunk(upload_id, index):
+    """Store one chunk (raw request body); re-sending a chunk replaces it"""
+    db_check = check_db_connection()
+    if db_check:
+        return db_check
+    try:
+        storage_id = request.args.get('storage_id')
+        if not storage_id:
+            return jsonify({'error': 'Storage ID is required'}), 400
+        if request.content_length is None:
+            return jsonify({'error': 'Content-Length is required'}), 411
+        session = upload_sessions.get(upload_id, storage_id)
+        session = upload_sessions.write_chunk(session, index, request.stream, request.content_length)
+        return jsonify(upload_sessions.status(session))
+    except UploadSessionError as e:
+        return upload_session_error(e)
+    except Exception as e:
+        api_log.exception('Error storing upload chunk')
+        return jsonify({'error': f'Failed to store chunk: {str(e)}'}), 500
+
+@app.route('/api/uploads/<upload_id>/complete', methods=['POST'])
+def complete_upload_session(upload_id):
+    """Assemble the chunks and attach the file to the task"""
+    db_check = check_db_connection()
+    if db_check:
+        return db_check
+    try:
+        storage_id = request.args.get('storage_id')
+        if not storage_id:
+            return jsonify({'error': 'Storage ID is required'}), 400
+        session = upload_sessions.get(upload_id, storage_id)
+        media_info, size = upload_sessions.finalize(session)
+        file_info = {
+            '_id': str(uuid.uuid4()),
+            **media_info,
+            'uploaded_at': datetime.utcnow().isoformat(),
+            'size': size
+        }
+        upload_log.info('Upload session finalized', upload_id=upload_id, unique_filename=file_info['unique_filename'], size=size)
+        patch = push_media_entry(session['task_id'], storage_id, 'attachments', file_info)
+        if patch is None:
+            return jsonify({'error': 'Task not found'}), 404
+        return jsonify({'file_info': file_info, 'version': patch['version'], 'updated_at': patch['updated_at']})
+    except UploadSessionError as e:
+        return upload_session_error(e)
+    except Exception as e:
+        api_log.exception('Error finalizing upload')
+        return jsonify({'error': f'Failed to finalize upload: {str(e)}'}), 500
+
+@app.route('/api/uploads/<upload_id>', methods=['DELETE'])
+def abort_upload_session(upload_id):
+    """Cancel a session and discard its chunks"""
+    db_check = check_db_connection()
+    if db_check:
+        return db_check
+    try:
+        storage_id = request.args.get('storage_id')
+        if not storage_id:
+            return jsonify({'error': 'Storage ID is required'}), 400
+        upload_sessions.abort(upload_sessions.get(upload_id, storage_id))
+        return jsonify({'success': True})
+    except UploadSessionError as e:
+        return upload_session_error(e)
+    except Exception as e:
+        api_log.error('Error aborting upload', error=str(e))
+        return jsonify({'error': f'Failed to abort upload: {str(e)}'}), 500
+
+# --- Fake Blob Storage Emulator ---
+def fake_blob_access_error(permission):
+    """Check the fake SAS query (sp/se/sig) of the current request; returns an error response or None"""
+    if request.args.get('sig') != 'fake':
+        return jsonify({'error': 'Missing or invalid signature'}), 403
+    try:
+        expires_at = datetime.strptime(request.args.get('se', ''), '%Y-%m-%dT%H:%M:%SZ')
+    except ValueError:
+        return jsonify({'error': 'Missing or invalid expiry'}), 403
+    if expires_at < datetime.utcnow():
+        return jsonify({'error': 'Signature expired'}), 403
+    if not set(permission) & set(request.args.get('sp', '')):
+        return jsonify({'error': 'Signature does not grant this operation'}), 403
+    return None
+
+@app.route('/api/fake-blob/<container>/<path:blob_name>', methods=['PUT'])
+def fake_blob_put(container, blob_name):
+    """Put Blob against the fake storage backend (AZURE_STORAGE_FAKE_DIR + AZURE_STORAGE_FAKE_URL)"""
+    if not azure_storage.is_fake() or container != azure_storage.container_name:
+        return jsonify({'error': 'Not found'}), 404
+    error = fake_blob_access_error('cw')
+    if error:
+        return error
+    if request.headers.get('x-ms-blob-type') != 'BlockBlob':
+        return jsonify({'error': 'x-ms-blob-type: BlockBlob is required'}), 400
+    if request.content_length is None:
+        return jsonify({'error': 'Content-Length is required'}), 411
+    # Stands in for Blob Storage, so the app's MAX_CONTENT_LENGTH doesn't apply; direct
+    # uploads are capped by the session size limit instead
+    request.max_content_length = upload_sessions.max_bytes
+    try:
+        blob_client = azure_storage.container_client.get_blob_client(blob_name)
+        # Reads come from the request socket (green), so this stays on the hub
+        blob_client.upload_blob(request.stream, length=request.content_length, overwrite=True,
+                                content_settings=azure_storage._content_settings(request.mimetype or None))
+        return '', 201
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+
+@app.route('/api/fake-blob/<container>/<path:blob_name>', methods=['GET'])
+def fake_blob_get(container, blob_name):
+    """Get Blob against the fake storage backend"""
+    if not azure_storage.is_fake() or container != azure_storage.container_name:
+        return jsonify({'error': 'Not found'}), 404
+    error = fake_blob_access_error('r')
+    if error:
+        return error
+    try:
+        blob_client = azure_storage.container_client.get_blob_client(blob_name)
+        properties = blob_client.get_blob_properties()
+        downloader = blob_client.download_blob()
+    except (ValueError, FakeResourceNotFoundError):
+        return jsonify({'error': 'Blob not found'}), 404
+    response = Response(downloader.chunks(), mimetype=properties.content_settings.content_type or 'application/octet-stream')
+    response.headers['Content-Length'] = str(properties.size)
+    response.headers['ETag'] = properties.etag
+    return response
+
 @app.route('/api/files/<filename>', methods=['GET'])
 def download_file(filename):
     try:
         if azure_storage.is_configured():
             # Get file from Azure Blob Storage
-            blob_url = azure_storage.get_file_url(filename)
+            blob_url = azure_storage.get_read_url(filename)
             if not blob_url:
                 return jsonify({'error': 'File not found'}), 404
-            # Return redirect to Azure blob URL
+            # Redirect to a short-lived read-only SAS URL for the blob
             from flask import redirect
             return redirect(blob_url)
         else:
             # Local file storage
-            upload_folder = app.config.get('UPLOAD_FOLDER', 'uploads')
-            filepath = os.path.join(upload_folder, filename)
-            if not os.path.exists(filepath):
+            response = send_local_media(filename, as_attachment=True)
+            if response is None:
                 return jsonify({'error': 'File not found'}), 404
-            return send_file(filepath, as_attachment=True)
+            return response
     except Exception as e:
-        print(f"❌ Error downloading file: {e}")
+        api_log.error('Error downloading file', error=str(e))
         return jsonify({'error': f'Failed to download file: {str(e)}'}), 500
 
 @app.route('/api/audio/<filename>', methods=['GET'])
@@ -733,22 +1667,22 @@ def stream_audio(filename):
     try:
         if azure_storage.is_configured():
             # Get audio file from Azure Blob Storage
-            blob_url = azure_storage.get_file_url(filename)
+            blob_url = azure_storage.get_read_url(filename)
             if not blob_url:
                 return jsonify({'error': 'Audio file not found'}), 404
-            # Return redirect to Azure blob URL
+            # Redirect to a short-lived read-only SAS URL for the blob
             from flask import redirect
             return redirect(blob_url)
         else:
             # Local file storage
-            upload_folder = app.config.get('UPLOAD_FOLDER', 'uploads')
-            filepath = os.path.join(upload_folder, filename)
-            if not os.path.exists(filepath):
+            # Stream audio file with proper content type; Range requests make seeking cheap
+            mimetype = next((mime for mime, ext in AUDIO_EXTENSIONS.items() if filename.endswith(ext)), 'audio/webm')
+            response = send_local_media(filename, mimetype=mimetype)
+            if response is None:
                 return jsonify({'error': 'Audio file not found'}), 404
-            # Stream audio file with proper content type
-            return send_file(filepath, mimetype='audio/webm')
+            return response
     except Exception as e:
-        print(f"❌ Error streaming audio: {e}")
+        api_log.error('Error streaming audio', error=str(e))
         return jsonify({'error': f'Failed to stream audio: {str(e)}'}), 500
 
 @app.route('/api/tasks/<task_id>/attachments/<attachment_id>', methods=['DELETE'])
@@ -761,55 +1695,25 @@ def delete_attachment(task_id, attachment_id):
         if not storage_id:
             return jsonify({'error': 'Storage ID is required'}), 400
         
-        # Find the task
-        task = tasks_collection.find_one({'_id': ObjectId(task_id), 'storage_id': storage_id})
-        if not task:
-            return jsonify({'error': 'Task not found'}), 404
-        
-        # Find the attachment
-        attachments = task.get('attachments', [])
-        attachment = None
-        for att in attachments:
-            att_id = toIdString(att.get('_id', ''))
-            if att_id == attachment_id or att.get('unique_filename') == attachment_id:
-                attachment = att
-                break
-        
-        if not attachment:
+        # Remove the attachment from the task in a single round-trip
+        patch, removed = pull_media_entry(task_id, storage_id, 'attachments', attachment_id)
+        if not patch:
+            if not task_exists(task_id, storage_id):
+                return jsonify({'error': 'Task not found'}), 404
             return jsonify({'error': 'Attachment not found'}), 404
+        task_cache.invalidate(storage_id)
+        apply_stats_delta(storage_id, attachment_bytes=-sum((entry.get('size') or 0) for entry in removed))
         
-        # Delete file from storage
-        unique_filename = attachment.get('unique_filename')
-        if unique_filename:
-            if azure_storage.is_configured():
-                azure_storage.delete_file(unique_filename)
-            else:
-                upload_folder = app.config.get('UPLOAD_FOLDER', 'uploads')
-                filepath = os.path.join(upload_folder, unique_filename)
-                if os.path.exists(filepath):
-                    os.remove(filepath)
+        # Delete the file once no task references it any more
+        for entry in removed:
+            release_stored_media(entry)
         
-        # Remove attachment from task
-        tasks_collection.update_one(
-            {'_id': ObjectId(task_id), 'storage_id': storage_id},
-            {'$pull': {'attachments': {'_id': attachment.get('_id')}}, '$set': {'updated_at': datetime.utcnow()}}
-        )
+        # Queue Socket.IO notification carrying only the removed entry IDs
+        broadcaster.task_patched(storage_id, patch)
         
-        # Fetch updated task
-        updated_task = tasks_collection.find_one({'_id': ObjectId(task_id)})
-        
-        # Emit Socket.IO event for real-time sync
-        socketio.emit('task_updated', {
-            'task': serialize_document(updated_task),
-            'storage_id': storage_id,
-            'update_type': 'attachment_deleted'
-        }, room=f'storage_{storage_id}')
-        
-        return jsonify({'message': 'Attachment deleted successfully'})
+        return jsonify({'message': 'Attachment deleted successfully', 'version': patch['version'], 'updated_at': patch['updated_at']})
     except Exception as e:
-        print(f"❌ Error deleting attachment: {e}")
-        import traceback
-        traceback.print_exc()
+        api_log.exception('Error deleting attachment')
         return jsonify({'error': f'Failed to delete attachment: {str(e)}'}), 500
 
 @app.route('/api/tasks/<task_id>/audio/<audio_id>', methods=['DELETE'])
@@ -822,55 +1726,25 @@ def delete_audio(task_id, audio_id):
         if not storage_id:
             return jsonify({'error': 'Storage ID is required'}), 400
         
-        # Find the task
-        task = tasks_collection.find_one({'_id': ObjectId(task_id), 'storage_id': storage_id})
-        if not task:
-            return jsonify({'error': 'Task not found'}), 404
-        
-        # Find the audio recording
-        audio_notes = task.get('audio_notes', [])
-        audio = None
-        for aud in audio_notes:
-            aud_id = toIdString(aud.get('_id', ''))
-            if aud_id == audio_id or aud.get('unique_filename') == audio_id:
-                audio = aud
-                break
-        
-        if not audio:
+        # Remove the audio recording from the task in a single round-trip
+        patch, removed = pull_media_entry(task_id, storage_id, 'audio_notes', audio_id)
+        if not patch:
+            if not task_exists(task_id, storage_id):
+                return jsonify({'error': 'Task not found'}), 404
             return jsonify({'error': 'Audio recording not found'}), 404
+        task_cache.invalidate(storage_id)
+        apply_stats_delta(storage_id, attachment_bytes=-sum((entry.get('size') or 0) for entry in removed))
         
-        # Delete file from storage
-        unique_filename = audio.get('unique_filename')
-        if unique_filename:
-            if azure_storage.is_configured():
-                azure_storage.delete_file(unique_filename)
-            else:
-                upload_folder = app.config.get('UPLOAD_FOLDER', 'uploads')
-                filepath = os.path.join(upload_folder, unique_filename)
-                if os.path.exists(filepath):
-                    os.remove(filepath)
+        # Delete the file once no task references it any more
+        for entry in removed:
+            release_stored_media(entry)
         
-        # Remove audio recording from task
-        tasks_collection.update_one(
-            {'_id': ObjectId(task_id), 'storage_id': storage_id},
-            {'$pull': {'audio_notes': {'_id': audio.get('_id')}}, '$set': {'updated_at': datetime.utcnow()}}
-        )
+        # Queue Socket.IO notification carrying only the removed entry IDs
+        broadcaster.task_patched(storage_id, patch)
         
-        # Fetch updated task
-        updated_task = tasks_collection.find_one({'_id': ObjectId(task_id)})
-        
-        # Emit Socket.IO event for real-time sync
-        socketio.emit('task_updated', {
-            'task': serialize_document(updated_task),
-            'storage_id': storage_id,
-            'update_type': 'audio_deleted'
-        }, room=f'storage_{storage_id}')
-        
-        return jsonify({'message': 'Audio recording deleted successfully'})
+        return jsonify({'message': 'Audio recording deleted successfully', 'version': patch['version'], 'updated_at': patch['updated_at']})
     except Exception as e:
-        print(f"❌ Error deleting audio: {e}")
-        import traceback
-        traceback.print_exc()
+        api_log.exception('Error deleting audio')
         return jsonify({'error': f'Failed to delete audio: {str(e)}'}), 500
 
 @app.route('/api/tasks/<task_id>/restore', methods=['POST'])
@@ -884,14 +1758,9 @@ def restore_backup(task_id):
         if not storage_id:
             return jsonify({'error': 'Storage ID is required'}), 400
         
-        # Find the backup task
-        backup_task = tasks_collection.find_one({'_id': ObjectId(task_id), 'storage_id': storage_id, 'is_backup': True})
-        if not backup_task:
-            return jsonify({'error': 'Backup task not found'}), 404
-        
-        # Update the backup task to convert it to a normal task (in-place restoration)
-        update_result = tasks_collection.update_one(
-            {'_id': ObjectId(task_id), 'storage_id': storage_id},
+        # Convert the backup task to a normal task (in-place restoration)
+        restored_task = tasks_collection.find_one_and_update(
+            {'_id': ObjectId(task_id), 'storage_id': storage_id, 'is_backup': True},
             {
                 '$set': {
                     'is_backup': False,
@@ -900,32 +1769,28 @@ def restore_backup(task_id):
                 '$unset': {
                     'original_id': '',
                     'backup_reason': ''
-                }
-            }
+                },
+                '$inc': {'version': 1}
+            },
+            return_document=ReturnDocument.AFTER
         )
+        if not restored_task:
+            return jsonify({'error': 'Backup task not found'}), 404
+        task_cache.invalidate(storage_id)
+        apply_stats_delta(storage_id, backups=-1)
         
-        if update_result.modified_count == 0:
-            return jsonify({'error': 'Failed to restore backup'}), 500
-        
-        # Fetch the updated task
-        restored_task = tasks_collection.find_one({'_id': ObjectId(task_id)})
-        
-        # Emit Socket.IO event to notify all clients that this task was restored
-        print(f"📤 Emitting task_restored event for task {task_id} to room storage_{storage_id[:8]}...")
-        socketio.emit('task_restored', {
-            'task': serialize_document(restored_task),
-            'storage_id': storage_id,
-            'task_id': task_id
-        }, room=f'storage_{storage_id}')
+        # Queue Socket.IO notification so all clients see the restored task
+        broadcaster.task_patched(storage_id, make_patch(
+            task_id, restored_task['version'], restored_task['updated_at'],
+            {'is_backup': False, 'original_id': None, 'backup_reason': None}
+        ))
         
         return jsonify({
             'success': True,
             'restored_task': serialize_document(restored_task)
         })
     except Exception as e:
-        print(f"❌ Error restoring backup: {e}")
-        import traceback
-        traceback.print_exc()
+        api_log.exception('Error restoring backup')
         return jsonify({'error': f'Failed to restore backup: {str(e)}'}), 500
 
 @app.route('/api/storage/migrate', methods=['POST'])
@@ -944,22 +1809,21 @@ def migrate_storage():
         if old_storage_id == new_storage_id:
             return jsonify({'error': 'Old and new storage IDs must be different'}), 400
         
-        # Migrate all tasks from old storage to new storage
+        # Migrate all tasks from old storage to new storage; the IDs are read first so the
+        # moved tasks can be tombstoned for delta-sync clients still on the old storage
+        task_ids = [task['_id'] for task in tasks_collection.find({'storage_id': old_storage_id}, {'_id': 1})]
         result = tasks_collection.update_many(
-            {'storage_id': old_storage_id},
-            {'$set': {'storage_id': new_storage_id, 'updated_at': datetime.utcnow()}}
+            {'_id': {'$in': task_ids}, 'storage_id': old_storage_id},
+            {'$set': {'storage_id': new_storage_id, 'updated_at': datetime.utcnow()}, '$inc': {'version': 1}}
         )
+        record_tombstones(old_storage_id, task_ids)
+        task_cache.invalidate(old_storage_id, new_storage_id)
+        # Counters for both storages changed wholesale; rebuild the new one and drop the old
+        stats_collection.delete_one({'_id': old_storage_id})
+        broadcast_task_stats(new_storage_id, seed_storage_stats(new_storage_id))
         
         # Migrate socket connections
-        if old_storage_id in storage_connections:
-            old_connections = storage_connections.pop(old_storage_id, set())
-            storage_connections.setdefault(new_storage_id, set()).update(old_connections)
-            
-            # Update sid_to_storages mapping
-            for sid in old_connections:
-                if sid in sid_to_storages:
-                    sid_to_storages[sid].discard(old_storage_id)
-                    sid_to_storages[sid].add(new_storage_id)
+        presence.move(old_storage_id, new_storage_id)
         
         # Update broadcast counts
         update_and_broadcast_online_count(new_storage_id)
@@ -970,9 +1834,7 @@ def migrate_storage():
             'tasks_migrated': result.modified_count
         })
     except Exception as e:
-        print(f"❌ Error migrating storage: {e}")
-        import traceback
-        traceback.print_exc()
+        api_log.exception('Error migrating storage')
         return jsonify({'error': f'Failed to migrate storage: {str(e)}'}), 500
 
 # --- Run Flask App ---
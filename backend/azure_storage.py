@@ -5,6 +5,15 @@ Uses environment variables or azure_config module
 """
 import os
 import uuid
+import base64
+import shutil
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime, timedelta, timezone
+from urllib.parse import urlencode
+from io import BytesIO
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
 from werkzeug.utils import secure_filename
 import logging
 
@@ -16,9 +25,10 @@ except ImportError:
 
 # Optional Azure Storage imports - only import if available
 try:
-    from azure.storage.blob import BlobServiceClient, BlobClient, ContainerClient
+    from azure.storage.blob import BlobServiceClient, BlobClient, ContainerClient, ContentSettings, BlobBlock
+    from azure.storage.blob import generate_blob_sas, BlobSasPermissions
     from azure.core.credentials import AzureNamedKeyCredential
-    from azure.core.exceptions import AzureError
+    from azure.core.exceptions import AzureError, ResourceNotFoundError
     AZURE_AVAILABLE = True
 except ImportError:
     # Azure Storage SDK not installed - use local storage only
@@ -26,11 +36,24 @@ except ImportError:
     BlobServiceClient = None
     BlobClient = None
     ContainerClient = None
+    ContentSettings = None
+    BlobBlock = None
+    generate_blob_sas = None
+    BlobSasPermissions = None
     AzureNamedKeyCredential = None
     AzureError = Exception
+    ResourceNotFoundError = None
+
+import fake_blob_storage
+from blocking_io import blocking_io
+from metrics import metrics
 
 logger = logging.getLogger(__name__)
 
+def block_id_for(index):
+    """Block id for block `index`; fixed width because Azure requires equal-length ids within a blob"""
+    return base64.b64encode(f"{index:08d}".encode()).decode()
+
 class AzureStorageManager:
     def __init__(self):
         # Get credentials from azure_config module or environment variables
@@ -50,10 +73,38 @@ class AzureStorageManager:
         self.blob_service_client = None
         self.container_client = None
         
+        # Streaming uploads are staged as blocks of this size with at most max_concurrency
+        # in flight, so memory per upload is bounded by the block size, not the file size
+        self.block_size = int(os.getenv('AZURE_UPLOAD_BLOCK_SIZE', 4 * 1024 * 1024))
+        self.max_concurrency = max(1, int(os.getenv('AZURE_UPLOAD_MAX_CONCURRENCY', 2)))
+        # Clients download through short-lived read-only SAS URLs, cached per blob and re-signed
+        # once less than the refresh margin is left (keep the margin above TASK_CACHE_TTL, since
+        # signed URLs are embedded in cached task lists)
+        self.sas_ttl = int(os.getenv('AZURE_SAS_TTL_SECONDS', 2 * 3600))
+        self.sas_refresh_margin = min(int(os.getenv('AZURE_SAS_REFRESH_MARGIN_SECONDS', 3600)), self.sas_ttl // 2)
+        self.sas_cache_max_entries = int(os.getenv('AZURE_SAS_CACHE_MAX_ENTRIES', 10000))
+        self._sas_cache = OrderedDict()  # blob_name -> (url, expires_at)
+        self._sas_lock = threading.Lock()
+        # Filesystem-backed fake container for offline testing of the blob code paths
+        self.fake_dir = os.getenv('AZURE_STORAGE_FAKE_DIR', '')
+        # Public base URL of the app's emulator routes (e.g. http://localhost:5000/api/fake-blob);
+        # makes fake blob URLs HTTP so browsers can upload to and read from them
+        self.fake_url = os.getenv('AZURE_STORAGE_FAKE_URL', '').rstrip('/')
+        
         self._initialize_client()
     
     def _initialize_client(self):
         """Initialize Azure Blob Storage client"""
+        if self.fake_dir:
+            self.container_client = fake_blob_storage.FakeContainerClient(self.fake_dir, self.container_name,
+                                                                          base_url=self.fake_url or None)
+            try:
+                self.container_client.create_container()
+            except FileExistsError:
+                pass
+            print(f"🧪 Using fake blob storage at {self.fake_dir} (container '{self.container_name}')")
+            return
+        
         # If Azure SDK is not installed, don't try to initialize
         if not AZURE_AVAILABLE:
             logger.info("Azure Storage SDK not installed. Using local storage only.")
@@ -93,7 +144,7 @@ class AzureStorageManager:
                 self.container_name
             )
             try:
-                self.container_client.create_container()
+                self._io('blob_create_container', self.container_client.create_container)
                 print(f"✅ Container '{self.container_name}' created/verified")
             except Exception as e:
                 # Container already exists or other error
@@ -120,15 +171,20 @@ class AzureStorageManager:
             self.container_client = None
     
     def is_configured(self):
-        """Check if Azure Storage is properly configured"""
+        """Check if Azure Storage (or the fake backend) is properly configured"""
+        if self.is_fake():
+            return True
         return self.blob_service_client is not None and self.container_client is not None
     
+    def is_fake(self):
+        return isinstance(self.container_client, fake_blob_storage.FakeContainerClient)
+    
     def upload_file(self, file, filename=None):
         """
         Upload a file to Azure Blob Storage
         Returns the blob URL or None if upload fails
         """
-        if not AZURE_AVAILABLE or not self.is_configured():
+        if not self.is_configured():
             logger.warning("Azure Storage not available or not configured, returning None")
             return None
         
@@ -140,16 +196,10 @@ class AzureStorageManager:
             else:
                 unique_filename = filename
             
-            # Upload to blob storage
+            # Stream to blob storage block by block instead of reading the whole file
             blob_client = self.container_client.get_blob_client(unique_filename)
-            
-            # If file is a file-like object, read it
-            if hasattr(file, 'read'):
-                file_content = file.read()
-                blob_client.upload_blob(file_content, overwrite=True)
-            else:
-                # If it's already bytes
-                blob_client.upload_blob(file, overwrite=True)
+            stream = file if hasattr(file, 'read') else BytesIO(file)
+            self._upload_blocks(blob_client, stream, getattr(file, 'mimetype', None))
             
             # Return the blob URL
             blob_url = blob_client.url
@@ -166,16 +216,162 @@ class AzureStorageManager:
             logger.error(f"File upload error: {str(e)}")
             return None
     
+    def upload_stream(self, stream, blob_name, length=None, content_type=None):
+        """
+        Upload from a readable stream without buffering it in memory
+        Returns the same dict as upload_file or None if upload fails
+        """
+        if not self.is_configured():
+            logger.warning("Azure Storage not available or not configured, returning None")
+            return None
+        
+        try:
+            blob_client = self.container_client.get_blob_client(blob_name)
+            self._upload_blocks(blob_client, stream, content_type, length)
+            return {
+                'unique_filename': blob_name,
+                'blob_url': blob_client.url,
+                'filename': blob_name
+            }
+        except AzureError as e:
+            logger.error(f"Azure Storage stream upload error: {str(e)}")
+            return None
+        except Exception as e:
+            logger.error(f"Stream upload error: {str(e)}")
+            return None
+    
+    def _upload_blocks(self, blob_client, stream, content_type=None, length=None):
+        """
+        Read a stream block_size bytes at a time and stage each block, keeping at
+        most max_concurrency blocks in flight; a stream that fits in one block is
+        sent with a single upload_blob call. Returns the number of bytes uploaded
+        """
+        content_settings = self._content_settings(content_type)
+        remaining = length
+        
+        def read_block():
+            nonlocal remaining
+            size = self.block_size if remaining is None else min(self.block_size, remaining)
+            data = bytearray()
+            # Request and socket streams may return short reads before EOF; only b'' ends the stream
+            while len(data) < size:
+                piece = stream.read(size - len(data))
+                if not piece:
+                    break
+                data.extend(piece)
+            if remaining is not None:
+                remaining -= len(data)
+            return bytes(data)
+        
+        block = read_block()
+        next_block = read_block() if len(block) == self.block_size else b''
+        if not next_block:
+            self._io('blob_upload', blob_client.upload_blob, block, overwrite=True, content_settings=content_settings)
+            metrics.blob_bytes.inc(len(block), direction='upload')
+            return len(block)
+        
+        block_ids = []
+        total = 0
+        pending = set()
+        with ThreadPoolExecutor(max_workers=self.max_concurrency) as executor:
+            try:
+                while block:
+                    if len(pending) >= self.max_concurrency:
+                        done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                        for future in done:
+                            future.result()
+                    block_id = block_id_for(len(block_ids))
+                    block_ids.append(block_id)
+                    total += len(block)
+                    pending.add(executor.submit(self._io, 'blob_stage_block', blob_client.stage_block, block_id, block, length=len(block)))
+                    block, next_block = next_block, (read_block() if next_block else b'')
+                for future in pending:
+                    future.result()
+            except Exception:
+                # Uncommitted blocks are discarded by the service; just stop staging
+                for future in pending:
+                    future.cancel()
+                raise
+        
+        block_type = BlobBlock or fake_blob_storage.BlobBlock
+        self._io('blob_commit', blob_client.commit_block_list,
+                 [block_type(block_id=block_id) for block_id in block_ids], content_settings=content_settings)
+        metrics.blob_bytes.inc(total, direction='upload')
+        return total
+    
+    def stage_chunk(self, blob_name, index, stream, length):
+        """
+        Stage one chunk of a resumable upload as block `index` of the blob (re-staging replaces it)
+        The chunk is read from the request first so only self-contained calls reach the I/O pool
+        Returns the number of bytes staged
+        """
+        data = bytearray()
+        while len(data) < length:
+            piece = stream.read(length - len(data))
+            if not piece:
+                break
+            data.extend(piece)
+        if len(data) != length:
+            return len(data)
+        blob_client = self.container_client.get_blob_client(blob_name)
+        self._io('blob_stage_block', blob_client.stage_block, block_id_for(index), bytes(data), length=length)
+        metrics.blob_bytes.inc(length, direction='upload')
+        return length
+    
+    def commit_chunks(self, blob_name, chunk_count, content_type=None):
+        """Commit blocks 0..chunk_count-1 staged by stage_chunk; returns the upload_file-style dict or None"""
+        try:
+            blob_client = self.container_client.get_blob_client(blob_name)
+            block_type = BlobBlock or fake_blob_storage.BlobBlock
+            self._io('blob_commit', blob_client.commit_block_list,
+                     [block_type(block_id=block_id_for(index)) for index in range(chunk_count)],
+                     content_settings=self._content_settings(content_type))
+            return {
+                'unique_filename': blob_name,
+                'blob_url': blob_client.url,
+                'filename': blob_name
+            }
+        except Exception as e:
+            logger.error(f"Azure Storage commit error: {str(e)}")
+            return None
+    
+    def discard_chunks(self, blob_name):
+        """Forget staged chunks of an aborted upload"""
+        # Azure garbage-collects uncommitted blocks after a week; only the fake backend keeps them around
+        if self.is_fake():
+            blocking_io.run('file_rmtree', shutil.rmtree, self.container_client.blocks_root / blob_name, ignore_errors=True)
+    
+    def _io(self, label, func, *args, **kwargs):
+        # The fake backend is plain disk I/O; real blob calls are network requests
+        runner = blocking_io.run if self.is_fake() else blocking_io.run_network
+        started = time.perf_counter()
+        status = 'error'
+        try:
+            result = runner(label, func, *args, **kwargs)
+            status = 'ok'
+            return result
+        finally:
+            metrics.blob_operations.observe(time.perf_counter() - started, operation=label, status=status)
+    
+    def _content_settings(self, content_type):
+        if not content_type:
+            return None
+        if self.is_fake() or ContentSettings is None:
+            return fake_blob_storage.FakeContentSettings(content_type=content_type)
+        return ContentSettings(content_type=content_type)
+    
     def delete_file(self, blob_name):
         """
         Delete a file from Azure Blob Storage
         """
-        if not AZURE_AVAILABLE or not self.is_configured():
+        if not self.is_configured():
             return False
         
         try:
             blob_client = self.container_client.get_blob_client(blob_name)
-            blob_client.delete_blob()
+            self._io('blob_delete', blob_client.delete_blob)
+            with self._sas_lock:
+                self._sas_cache.pop(blob_name, None)
             return True
         except AzureError as e:
             logger.error(f"Azure Storage delete error: {str(e)}")
@@ -184,11 +380,130 @@ class AzureStorageManager:
             logger.error(f"File delete error: {str(e)}")
             return False
     
+    def get_container_info(self):
+        """Storage backend summary for /api/diagnostic (no listing, so it stays cheap)"""
+        return {
+            'configured': self.is_configured(),
+            'fake': self.is_fake(),
+            'container_name': self.container_name,
+            'account_name': self.account_name or None,
+            'container_url': self.container_client.url if self.is_configured() else None,
+            'sas_cache_entries': len(self._sas_cache)
+        }
+    
+    def iter_blobs(self, name_starts_with=None):
+        """Stream the container listing page by page (BlobProperties with name, size, last_modified)"""
+        if not self.is_configured():
+            return
+        yield from self.container_client.list_blobs(name_starts_with=name_starts_with)
+    
+    def list_files(self, max_results=100):
+        """
+        First max_results files of the container as JSON-ready dicts
+        Returns None if the listing fails
+        """
+        if not self.is_configured():
+            return None
+        try:
+            files = []
+            for blob in self.iter_blobs():
+                if len(files) >= max_results:
+                    break
+                content_settings = getattr(blob, 'content_settings', None)
+                files.append({
+                    'name': blob.name,
+                    'size': blob.size,
+                    'last_modified': blob.last_modified.isoformat() if blob.last_modified else None,
+                    'content_type': getattr(content_settings, 'content_type', None)
+                })
+            return files
+        except AzureError as e:
+            logger.error(f"Azure Storage list error: {str(e)}")
+            return None
+        except Exception as e:
+            logger.error(f"File list error: {str(e)}")
+            return None
+
+    def get_blob_size(self, blob_name):
+        """Size of a committed blob in bytes, or None if it doesn't exist"""
+        if not self.is_configured():
+            return None
+        not_found = tuple(e for e in (ResourceNotFoundError, fake_blob_storage.FakeResourceNotFoundError) if e)
+        blob_client = self.container_client.get_blob_client(blob_name)
+        try:
+            return self._io('blob_properties', blob_client.get_blob_properties).size
+        except not_found:
+            return None
+    
+    def get_read_url(self, blob_name):
+        """
+        Read-only SAS URL for a blob, served from cache while it has more than
+        sas_refresh_margin left; falls back to the bare blob URL if signing isn't possible
+        """
+        if not self.is_configured():
+            return None
+        now = datetime.now(timezone.utc)
+        with self._sas_lock:
+            cached = self._sas_cache.get(blob_name)
+            if cached and cached[1] - now > timedelta(seconds=self.sas_refresh_margin):
+                self._sas_cache.move_to_end(blob_name)
+                return cached[0]
+        
+        expires_at = now + timedelta(seconds=self.sas_ttl)
+        url = self.generate_sas_url(blob_name, 'r', expires_at)
+        if url is None:
+            return self.get_file_url(blob_name)
+        with self._sas_lock:
+            self._sas_cache[blob_name] = (url, expires_at)
+            self._sas_cache.move_to_end(blob_name)
+            while len(self._sas_cache) > self.sas_cache_max_entries:
+                self._sas_cache.popitem(last=False)
+        return url
+    
+    def generate_sas_url(self, blob_name, permission, expires_at):
+        """Blob URL with a SAS token for `permission` (e.g. 'r', 'cw'); None if no account key is available"""
+        try:
+            blob_client = self.container_client.get_blob_client(blob_name)
+            if self.is_fake():
+                # Unsigned stand-in with the same shape, so callers can exercise expiry handling offline
+                query = urlencode({'sp': permission, 'se': expires_at.strftime('%Y-%m-%dT%H:%M:%SZ'), 'sig': 'fake'})
+                return f"{blob_client.url}?{query}"
+            account_key = self._account_key()
+            if not account_key or generate_blob_sas is None:
+                return None
+            sas = generate_blob_sas(
+                account_name=self.blob_service_client.account_name,
+                container_name=self.container_name,
+                blob_name=blob_name,
+                account_key=account_key,
+                permission=BlobSasPermissions.from_string(permission),
+                expiry=expires_at,
+                # Tolerate clock skew between us and the storage service
+                start=datetime.now(timezone.utc) - timedelta(minutes=5)
+            )
+            return f"{blob_client.url}?{sas}"
+        except Exception as e:
+            logger.error(f"Error generating SAS URL: {str(e)}")
+            return None
+    
+    def _account_key(self):
+        if self.account_key:
+            return self.account_key
+        # The SDK resolves connection strings (including UseDevelopmentStorage=true for Azurite)
+        credential = getattr(self.blob_service_client, 'credential', None)
+        if getattr(credential, 'account_key', None):
+            return credential.account_key
+        for part in (self.connection_string or '').split(';'):
+            key, _, value = part.strip().partition('=')
+            if key == 'AccountKey':
+                return value
+        return None
+    
     def get_file_url(self, blob_name):
         """
         Get the URL for a blob
         """
-        if not AZURE_AVAILABLE or not self.is_configured():
+        if not self.is_configured():
             return None
         
         try:
@@ -0,0 +1,112 @@
+"""
+Blocking I/O Module
+Runs blocking calls (disk writes/deletes, CPU-heavy work) on eventlet's pool of
+native threads when the server runs under eventlet, so a slow upload can't stall
+the hub and with it every Socket.IO heartbeat in the process
+In threading mode every request already has its own thread and calls run inline
+
+Only offload self-contained calls: code running in the pool must not touch
+green primitives (sockets of the request, green locks, Socket.IO emits)
+Network calls (blob SDK requests) go through run_network: once eventlet has
+monkey-patched sockets they already yield to the hub and the SDK's shared green
+connection pool must stay on the hub thread, so they are only offloaded when
+sockets are not patched
+"""
+import os
+import threading
+import time
+
+
+class BlockingIOPool:
+    def __init__(self, size=None):
+        # Native threads in the pool; calls beyond this wait in tpool's queue
+        self.size = size if size is not None else int(os.getenv('BLOCKING_IO_THREADS', 20))
+        self.enabled = os.getenv('BLOCKING_IO_OFFLOAD', 'True').lower() in ('true', '1', 'yes')
+        self._tpool = None
+        self._green_sockets = False
+        self._lock = threading.Lock()
+        self._in_flight = 0
+        self._max_in_flight = 0
+        self._ops = {}  # label -> {'count', 'errors', 'total_ms', 'max_ms', 'wait_total_ms', 'wait_max_ms'}
+
+    def init_app(self, async_mode):
+        """Offload through eventlet.tpool when the app runs on eventlet"""
+        if async_mode != 'eventlet' or not self.enabled:
+            return
+        try:
+            import eventlet
+            from eventlet import tpool
+            # Must be set before the pool starts its threads
+            os.environ.setdefault('EVENTLET_THREADPOOL_SIZE', str(self.size))
+            tpool.set_num_threads(self.size)
+            self._tpool = tpool
+            self._green_sockets = eventlet.patcher.is_monkey_patched('socket')
+            print(f"✅ Blocking I/O offloaded to {self.size} native threads")
+        except Exception as e:
+            print(f"⚠️ eventlet tpool unavailable, blocking I/O runs inline: {e}")
+
+    def run_network(self, label, func, *args, **kwargs):
+        """Like run(), but stays on the hub when sockets are green (see module docstring)"""
+        return self._call(label, func, args, kwargs, offload=not self._green_sockets)
+
+    def run(self, label, func, *args, **kwargs):
+        """Call func(*args, **kwargs), on a native thread under eventlet, and record its timing"""
+        return self._call(label, func, args, kwargs, offload=True)
+
+    def _call(self, label, func, args, kwargs, offload):
+        submitted = time.monotonic()
+        started = []
+
+        def call():
+            started.append(time.monotonic())
+            return func(*args, **kwargs)
+
+        with self._lock:
+            self._in_flight += 1
+            self._max_in_flight = max(self._max_in_flight, self._in_flight)
+        ok = False
+        try:
+            result = self._tpool.execute(call) if offload and self._tpool is not None else call()
+            ok = True
+            return result
+        finally:
+            finished = time.monotonic()
+            wait_ms = ((started[0] if started else finished) - submitted) * 1000
+            total_ms = (finished - submitted) * 1000
+            with self._lock:
+                self._in_flight -= 1
+                op = self._ops.setdefault(label, {'count': 0, 'errors': 0, 'total_ms': 0.0, 'max_ms': 0.0,
+                                                  'wait_total_ms': 0.0, 'wait_max_ms': 0.0})
+                op['count'] += 1
+                op['errors'] += 0 if ok else 1
+                op['total_ms'] += total_ms
+                op['max_ms'] = max(op['max_ms'], total_ms)
+                op['wait_total_ms'] += wait_ms
+                op['wait_max_ms'] = max(op['wait_max_ms'], wait_ms)
+
+    def stats(self):
+        with self._lock:
+            return {
+                'offloaded': self._tpool is not None,
+                'network_offloaded': self._tpool is not None and not self._green_sockets,
+                'threads': self.size if self._tpool is not None else 0,
+                'in_flight': self._in_flight,
+                # Calls beyond the thread count are queued inside tpool
+                'queued': max(0, self._in_flight - self.size) if self._tpool is not None else 0,
+                'max_in_flight': self._max_in_flight,
+                'operations': {
+                    label: {
+                        'count': op['count'],
+                        'errors': op['errors'],
+                        'avg_ms': round(op['total_ms'] / op['count'], 2),
+                        'max_ms': round(op['max_ms'], 2),
+                        'avg_wait_ms': round(op['wait_total_ms'] / op['count'], 2),
+                        'max_wait_ms': round(op['wait_max_ms'], 2)
+                    }
+                    for label, op in self._ops.items()
+                }
+            }
+
+
+# Global instance
+blocking_io = BlockingIOPool()
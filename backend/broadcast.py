@@ -0,0 +1,190 @@
+"""
+Room Broadcast Module
+Buffers task change notifications per storage room and flushes them as a
+single coalesced 'tasks_changed' Socket.IO event
+
+Updates are sent as field-level patches where possible:
+    {'_id', 'version', 'base_version', 'updated_at',
+     'set': {field: value}, 'push': {field: [entries]}, 'pull': {field: [entry _ids]}}
+Clients apply a patch only if their copy is at base_version, otherwise they refetch the task
+"""
+import os
+import threading
+from collections import OrderedDict
+
+from structured_logging import get_logger
+
+log = get_logger('broadcast')
+
+
+def make_patch(task_id, version, updated_at, set_fields=None, push=None, pull=None):
+    """Build a task patch; version is the task version after the change"""
+    return {
+        '_id': task_id,
+        'version': version,
+        'base_version': version - 1,
+        'updated_at': updated_at.isoformat() if hasattr(updated_at, 'isoformat') else updated_at,
+        'set': set_fields or {},
+        'push': push or {},
+        'pull': pull or {}
+    }
+
+
+def apply_patch(task, patch):
+    """Apply a patch to a full (serialized) task document in place"""
+    task.update(patch['set'])
+    for field, entries in patch['push'].items():
+        # Skip entries already present, so applying a patch twice is harmless
+        present = {str(entry.get('_id')) for entry in task.get(field) or []}
+        task[field] = list(task.get(field) or []) + [entry for entry in entries if str(entry.get('_id')) not in present]
+    for field, entry_ids in patch['pull'].items():
+        task[field] = [entry for entry in (task.get(field) or []) if str(entry.get('_id')) not in entry_ids]
+    task['version'] = patch['version']
+    task['updated_at'] = patch['updated_at']
+    return task
+
+
+def merge_patches(first, second):
+    """Combine two consecutive patches for the same task into one"""
+    merged = make_patch(first['_id'], second['version'], second['updated_at'],
+                        {**first['set'], **second['set']},
+                        {field: list(entries) for field, entries in first['push'].items()},
+                        {field: list(entry_ids) for field, entry_ids in first['pull'].items()})
+    merged['base_version'] = first['base_version']
+    for field, entries in second['push'].items():
+        merged['push'][field] = merged['push'].get(field, []) + list(entries)
+    for field, entry_ids in second['pull'].items():
+        pushed = merged['push'].get(field, [])
+        pushed_ids = {str(entry.get('_id')) for entry in pushed}
+        # Entries pushed and pulled within the same window cancel out
+        if pushed:
+            merged['push'][field] = [entry for entry in pushed if str(entry.get('_id')) not in entry_ids]
+            if not merged['push'][field]:
+                del merged['push'][field]
+        remaining = [entry_id for entry_id in entry_ids if entry_id not in pushed_ids]
+        if remaining:
+            merged['pull'][field] = merged['pull'].get(field, []) + remaining
+    return merged
+
+
+class RoomBroadcaster:
+    def __init__(self, window_ms=None, max_pending=None):
+        # How long changes are collected before a room is flushed (0 = emit immediately)
+        self.window_ms = window_ms if window_ms is not None else int(os.getenv('BROADCAST_COALESCE_MS', 50))
+        # Above this many buffered changes a room only gets a resync hint instead of the payload
+        self.max_pending = max_pending if max_pending is not None else int(os.getenv('BROADCAST_MAX_PENDING', 200))
+        self.socketio = None
+        self._buffers = {}
+        self._lock = threading.Lock()
+
+    def init_app(self, socketio):
+        self.socketio = socketio
+
+    # --- Producers ---
+    def task_created(self, storage_id, task):
+        self.changes(storage_id, created=[task])
+
+    def task_updated(self, storage_id, task):
+        self.changes(storage_id, updated=[task])
+
+    def task_patched(self, storage_id, patch):
+        self.changes(storage_id, patched=[patch])
+
+    def task_deleted(self, storage_id, task_id):
+        self.changes(storage_id, deleted=[task_id])
+
+    def stats_changed(self, storage_id, stats):
+        self.changes(storage_id, stats=stats)
+
+    def changes(self, storage_id, created=(), updated=(), patched=(), deleted=(), stats=None):
+        """Merge a set of changes into the room buffer and schedule a flush"""
+        with self._lock:
+            buffer = self._buffers.get(storage_id)
+            if buffer is None:
+                buffer = self._buffers[storage_id] = {
+                    'created': OrderedDict(),
+                    'updated': OrderedDict(),
+                    'patched': OrderedDict(),
+                    'deleted': OrderedDict(),
+                    'stats': None,
+                    'resync': False,
+                    'scheduled': False
+                }
+            for task in created:
+                buffer['created'][task['_id']] = task
+            for task in updated:
+                # A task created in this window is still reported as created, with its latest state
+                target = buffer['created'] if task['_id'] in buffer['created'] else buffer['updated']
+                target[task['_id']] = task
+                buffer['patched'].pop(task['_id'], None)
+            for patch in patched:
+                task_id = patch['_id']
+                # Patches fold into a full document already queued for the task
+                if task_id in buffer['created']:
+                    apply_patch(buffer['created'][task_id], patch)
+                elif task_id in buffer['updated']:
+                    apply_patch(buffer['updated'][task_id], patch)
+                elif task_id in buffer['patched']:
+                    buffer['patched'][task_id] = merge_patches(buffer['patched'][task_id], patch)
+                else:
+                    buffer['patched'][task_id] = patch
+            for task_id in deleted:
+                buffer['created'].pop(task_id, None)
+                buffer['updated'].pop(task_id, None)
+                buffer['patched'].pop(task_id, None)
+                buffer['deleted'][task_id] = True
+            if stats is not None:
+                buffer['stats'] = stats
+
+            pending = sum(len(buffer[key]) for key in ('created', 'updated', 'patched', 'deleted'))
+            if pending > self.max_pending:
+                # Back-pressure: don't ship an unbounded payload to every client in the room
+                for key in ('created', 'updated', 'patched', 'deleted'):
+                    buffer[key].clear()
+                buffer['resync'] = True
+
+            if buffer['scheduled']:
+                return
+            buffer['scheduled'] = True
+            immediate = self.window_ms <= 0 or self.socketio is None
+
+        if immediate:
+            self.flush(storage_id)
+        else:
+            self.socketio.start_background_task(self._flush_later, storage_id)
+
+    # --- Flushing ---
+    def _flush_later(self, storage_id):
+        self.socketio.sleep(self.window_ms / 1000.0)
+        self.flush(storage_id)
+
+    def flush(self, storage_id):
+        """Emit everything buffered for a room as one tasks_changed event"""
+        with self._lock:
+            buffer = self._buffers.pop(storage_id, None)
+        if buffer is None or self.socketio is None:
+            return
+        payload = {
+            'storage_id': storage_id,
+            'created': list(buffer['created'].values()),
+            'updated': list(buffer['updated'].values()),
+            'patched': list(buffer['patched'].values()),
+            'deleted': list(buffer['deleted'].keys())
+        }
+        if buffer['resync']:
+            payload['resync'] = True
+        if buffer['stats'] is not None:
+            payload['stats'] = buffer['stats']
+        count = sum(len(payload[key]) for key in ('created', 'updated', 'patched', 'deleted'))
+        log.debug('Emitting tasks_changed', storage=storage_id[:8], changes=count, resync=buffer['resync'])
+        self.socketio.emit('tasks_changed', payload, room=f'storage_{storage_id}')
+
+    def flush_all(self):
+        with self._lock:
+            storage_ids = list(self._buffers)
+        for storage_id in storage_ids:
+            self.flush(storage_id)
+
+
+# Global instance
+broadcaster = RoomBroadcaster()
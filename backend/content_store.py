@@ -0,0 +1,119 @@
+"""
+Content Store Module
+Content-addressed deduplication for attachments and audio notes
+
+Uploads are hashed (SHA-256) while they stream to storage. The first upload of a
+given content is kept and recorded in the content_refs collection under its digest;
+later uploads of the same bytes drop their fresh copy and point at the stored one.
+Every task entry referencing a digest holds one reference, and the bytes are only
+deleted when the last reference is released
+Enable for new uploads with CONTENT_ADDRESSED_STORAGE=true; entries that already
+carry a sha256 are always released through their reference count
+"""
+import hashlib
+import os
+from datetime import datetime
+
+from pymongo import ReturnDocument
+from pymongo.errors import DuplicateKeyError
+
+
+class ContentStore:
+    def __init__(self):
+        self.enabled = os.getenv('CONTENT_ADDRESSED_STORAGE', 'False').lower() in ('true', '1', 'yes')
+        self.collection = None
+        self._stats = {'stored': 0, 'deduplicated': 0, 'deduplicated_bytes': 0, 'released': 0, 'deleted': 0}
+
+    def init_app(self, collection):
+        self.collection = collection
+
+    def hasher(self):
+        """A fresh hash object for an upload, or None when deduplication is off"""
+        return hashlib.sha256() if self.enabled and self.collection is not None else None
+
+    def acquire(self, digest, size, media_info):
+        """
+        Take a reference on `digest` for a freshly stored upload described by media_info
+        Returns the stored entry ({unique_filename, blob_url}) to use instead when the
+        content already exists (the caller deletes its own copy), or None to keep it
+        """
+        now = datetime.utcnow()
+        for _ in range(3):
+            existing = self.collection.find_one_and_update(
+                {'_id': digest, 'refs': {'$gt': 0}},
+                {'$inc': {'refs': 1}, '$set': {'updated_at': now}},
+                return_document=ReturnDocument.AFTER
+            )
+            if existing:
+                if existing.get('size') != size:
+                    # Same digest, different length: never alias it
+                    self.collection.update_one({'_id': digest}, {'$inc': {'refs': -1}})
+                    media_info.pop('sha256', None)
+                    return None
+                self._stats['deduplicated'] += 1
+                self._stats['deduplicated_bytes'] += size
+                return {'unique_filename': existing['unique_filename'], 'blob_url': existing.get('blob_url')}
+            try:
+                self.collection.insert_one({
+                    '_id': digest,
+                    'unique_filename': media_info['unique_filename'],
+                    'blob_url': media_info.get('blob_url'),
+                    'size': size,
+                    'refs': 1,
+                    'created_at': now,
+                    'updated_at': now
+                })
+                self._stats['stored'] += 1
+                return None
+            except DuplicateKeyError:
+                # Lost a race with another upload, or the digest is being released; look again
+                continue
+        # Keep the upload as a plain, unshared file
+        media_info.pop('sha256', None)
+        return None
+
+    def retain(self, entries):
+        """
+        Take one more reference for each entry copied onto another task (backups)
+        Returns the entries that could be shared; others are dropped, since deleting
+        either copy would remove bytes the other still points at
+        """
+        retained = []
+        for entry in entries or []:
+            if not isinstance(entry, dict) or not entry.get('sha256') or self.collection is None:
+                continue
+            stored = self.collection.find_one_and_update(
+                {'_id': entry['sha256'], 'refs': {'$gt': 0}, 'unique_filename': entry.get('unique_filename')},
+                {'$inc': {'refs': 1}, '$set': {'updated_at': datetime.utcnow()}},
+                return_document=ReturnDocument.AFTER
+            )
+            if stored:
+                # Keep the stored (unsigned) URL rather than whatever the client sent
+                retained.append({**entry, 'blob_url': stored.get('blob_url'), 'size': stored['size']})
+        return retained
+
+    def release(self, digest):
+        """
+        Drop one reference on `digest`
+        Returns the unique_filename whose bytes should be deleted now, or None
+        """
+        stored = self.collection.find_one_and_update(
+            {'_id': digest},
+            {'$inc': {'refs': -1}, '$set': {'updated_at': datetime.utcnow()}},
+            return_document=ReturnDocument.AFTER
+        )
+        self._stats['released'] += 1
+        if not stored or stored['refs'] > 0:
+            return None
+        # Only the caller whose delete succeeds removes the bytes; a concurrent acquire revives the doc
+        if self.collection.delete_one({'_id': digest, 'refs': {'$lte': 0}}).deleted_count:
+            self._stats['deleted'] += 1
+            return stored['unique_filename']
+        return None
+
+    def stats(self):
+        return {'enabled': self.enabled, **self._stats}
+
+
+# Global instance
+content_store = ContentStore()
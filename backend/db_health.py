@@ -0,0 +1,106 @@
+"""
+Database Health Monitor Module
+Tracks MongoDB/Cosmos DB reachability from PyMongo's own server heartbeats
+so request handlers can check a cached flag instead of pinging per request
+"""
+import os
+import threading
+import time
+from datetime import datetime
+
+from pymongo import monitoring
+
+from structured_logging import get_logger
+
+log = get_logger('db')
+
+
+class DatabaseHealthMonitor(monitoring.ServerHeartbeatListener):
+    def __init__(self, stale_after=None):
+        # Without a heartbeat for this long the cached state is re-checked with a single ping
+        self.stale_after = stale_after if stale_after is not None else float(os.getenv('DB_HEALTH_STALE_SECONDS', 60))
+        self._servers = {}  # address -> {'ok', 'error', 'checked_at', 'rtt_ms'}
+        self._lock = threading.Lock()
+        self._probe_lock = threading.Lock()
+        self._probe = None
+        self._last_update = 0.0
+
+    # --- PyMongo heartbeat listener hooks (called from driver monitor threads) ---
+    def started(self, event):
+        pass
+
+    def succeeded(self, event):
+        self._record(event.connection_id, True, None, event.duration * 1000)
+
+    def failed(self, event):
+        self._record(event.connection_id, False, str(event.reply), event.duration * 1000)
+
+    # --- Public API ---
+    def set_probe(self, probe):
+        """Register the callable used to ping the database when heartbeats go quiet"""
+        self._probe = probe
+
+    def record_ping(self, ok, error=None):
+        """Record the outcome of an explicit ping (e.g. the startup check)"""
+        self._record('ping', ok, error, None)
+
+    def is_connected(self):
+        """Return the cached connection state, re-probing only if it has gone stale"""
+        if time.monotonic() - self._last_update > self.stale_after:
+            self._refresh()
+        with self._lock:
+            return any(server['ok'] for server in self._servers.values())
+
+    def status(self):
+        """Connection summary for /health and /api/diagnostic"""
+        connected = self.is_connected()
+        with self._lock:
+            servers = {
+                f"{address[0]}:{address[1]}" if isinstance(address, tuple) else str(address): dict(state)
+                for address, state in self._servers.items()
+            }
+            age = time.monotonic() - self._last_update if self._last_update else None
+        errors = [state['error'] for state in servers.values() if state['error']]
+        return {
+            'status': 'connected' if connected else ('error' if errors else 'disconnected'),
+            'error': None if connected else (errors[0] if errors else None),
+            'last_check_age_seconds': round(age, 1) if age is not None else None,
+            'servers': servers
+        }
+
+    def _record(self, address, ok, error, rtt_ms):
+        with self._lock:
+            if address != 'ping':
+                # Any real heartbeat, failed or not, supersedes the startup/probe ping entry
+                self._servers.pop('ping', None)
+            self._servers[address] = {
+                'ok': ok,
+                'error': error,
+                'checked_at': datetime.utcnow().isoformat(),
+                'rtt_ms': round(rtt_ms, 2) if rtt_ms is not None else None
+            }
+            self._last_update = time.monotonic()
+
+    def _refresh(self):
+        if self._probe is None:
+            return
+        # Only one caller probes; everyone else keeps using the last known state
+        if not self._probe_lock.acquire(blocking=False):
+            return
+        try:
+            if time.monotonic() - self._last_update <= self.stale_after:
+                return
+            try:
+                self._probe()
+                self.record_ping(True)
+            except Exception as e:
+                log.warning('Database health probe failed', exc_info=True)
+                with self._lock:
+                    self._servers.clear()
+                self.record_ping(False, str(e))
+        finally:
+            self._probe_lock.release()
+
+
+# Global instance
+db_health = DatabaseHealthMonitor()
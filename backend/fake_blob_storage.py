@@ -0,0 +1,231 @@
+"""
+Fake Blob Storage Module
+Filesystem-backed stand-in for the subset of azure.storage.blob used by
+AzureStorageManager, so block uploads can be exercised without an account
+Enable with AZURE_STORAGE_FAKE_DIR=<directory>; with a base_url, blob URLs point at
+the app's emulator routes instead of file:// paths
+"""
+import json
+import os
+import shutil
+import threading
+from datetime import datetime, timezone
+from pathlib import Path
+from urllib.parse import quote
+
+
+class BlobBlock:
+    def __init__(self, block_id, state=None):
+        self.id = block_id
+        self.block_id = block_id
+        self.state = state
+        self.size = None
+
+
+class FakeContentSettings:
+    def __init__(self, content_type=None):
+        self.content_type = content_type
+
+
+class FakeBlobProperties:
+    def __init__(self, name, size, last_modified, content_type, etag):
+        self.name = name
+        self.size = size
+        self.last_modified = last_modified
+        self.etag = etag
+        self.content_settings = FakeContentSettings(content_type)
+
+
+class FakeResourceNotFoundError(Exception):
+    pass
+
+
+class FakeDownloader:
+    def __init__(self, path, offset=None, length=None, chunk_size=4 * 1024 * 1024):
+        self._path = path
+        self._offset = offset or 0
+        self._length = length
+        self._chunk_size = chunk_size
+        self.size = os.path.getsize(path)
+
+    def chunks(self):
+        remaining = self._length if self._length is not None else self.size - self._offset
+        with open(self._path, 'rb') as f:
+            f.seek(self._offset)
+            while remaining > 0:
+                chunk = f.read(min(self._chunk_size, remaining))
+                if not chunk:
+                    break
+                remaining -= len(chunk)
+                yield chunk
+
+    def readall(self):
+        return b''.join(self.chunks())
+
+
+class FakeBlobClient:
+    def __init__(self, container, blob_name):
+        if not blob_name or blob_name.startswith(('/', '.')) or '..' in blob_name.split('/'):
+            raise ValueError(f"Invalid blob name: {blob_name}")
+        self.container = container
+        self.blob_name = blob_name
+        self._path = container.root / blob_name
+        self._meta_path = container.meta_root / f"{blob_name}.json"
+        self._blocks_dir = container.blocks_root / blob_name
+
+    @property
+    def url(self):
+        if self.container.base_url:
+            return f"{self.container.url}/{quote(self.blob_name)}"
+        return self._path.resolve().as_uri()
+
+    # --- Writes ---
+    def upload_blob(self, data, length=None, overwrite=False, content_settings=None, **kwargs):
+        if not overwrite and self._path.exists():
+            raise FileExistsError(f"Blob already exists: {self.blob_name}")
+        tmp_path = self._tmp_path()
+        with open(tmp_path, 'wb') as f:
+            self._write(f, data, length)
+        self._publish(tmp_path, content_settings)
+        return {'etag': self._etag()}
+
+    def stage_block(self, block_id, data, length=None, **kwargs):
+        self._blocks_dir.mkdir(parents=True, exist_ok=True)
+        with open(self._blocks_dir / self._block_file(block_id), 'wb') as f:
+            self._write(f, data, length)
+
+    def commit_block_list(self, block_list, content_settings=None, metadata=None, **kwargs):
+        tmp_path = self._tmp_path()
+        with open(tmp_path, 'wb') as out:
+            for block in block_list:
+                block_id = getattr(block, 'block_id', None) or getattr(block, 'id', None) or block
+                block_path = self._blocks_dir / self._block_file(block_id)
+                if not block_path.exists():
+                    out.close()
+                    os.remove(tmp_path)
+                    raise FakeResourceNotFoundError(f"Block {block_id} was not staged for {self.blob_name}")
+                with open(block_path, 'rb') as f:
+                    shutil.copyfileobj(f, out)
+        self._publish(tmp_path, content_settings)
+        # Committing discards every uncommitted block, as Azure does
+        shutil.rmtree(self._blocks_dir, ignore_errors=True)
+        return {'etag': self._etag()}
+
+    def delete_blob(self, **kwargs):
+        if not self._path.exists():
+            raise FakeResourceNotFoundError(f"Blob not found: {self.blob_name}")
+        os.remove(self._path)
+        if self._meta_path.exists():
+            os.remove(self._meta_path)
+
+    # --- Reads ---
+    def exists(self, **kwargs):
+        return self._path.exists()
+
+    def get_blob_properties(self, **kwargs):
+        if not self._path.exists():
+            raise FakeResourceNotFoundError(f"Blob not found: {self.blob_name}")
+        return self.container._properties(self.blob_name)
+
+    def download_blob(self, offset=None, length=None, **kwargs):
+        if not self._path.exists():
+            raise FakeResourceNotFoundError(f"Blob not found: {self.blob_name}")
+        return FakeDownloader(self._path, offset, length)
+
+    def get_block_list(self, block_list_type='committed', **kwargs):
+        """Return (committed, uncommitted); committed blocks aren't tracked after commit"""
+        uncommitted = []
+        if block_list_type in ('uncommitted', 'all') and self._blocks_dir.exists():
+            for block_path in sorted(self._blocks_dir.iterdir()):
+                block = BlobBlock(bytes.fromhex(block_path.name).decode())
+                block.size = block_path.stat().st_size
+                uncommitted.append(block)
+        return [], uncommitted
+
+    # --- Internals ---
+    @staticmethod
+    def _block_file(block_id):
+        # Block ids are arbitrary base64 strings; hex keeps them filesystem-safe
+        return block_id.encode().hex()
+
+    @staticmethod
+    def _write(f, data, length):
+        if isinstance(data, (bytes, bytearray)):
+            f.write(data)
+        elif hasattr(data, 'read'):
+            remaining = length
+            while remaining is None or remaining > 0:
+                chunk = data.read(1024 * 1024 if remaining is None else min(1024 * 1024, remaining))
+                if not chunk:
+                    break
+                f.write(chunk)
+                if remaining is not None:
+                    remaining -= len(chunk)
+        else:
+            for chunk in data:
+                f.write(chunk)
+
+    def _tmp_path(self):
+        self._path.parent.mkdir(parents=True, exist_ok=True)
+        return self._path.with_name(f".{self._path.name}.{threading.get_ident()}.tmp")
+
+    def _publish(self, tmp_path, content_settings):
+        os.replace(tmp_path, self._path)
+        self._meta_path.parent.mkdir(parents=True, exist_ok=True)
+        with open(self._meta_path, 'w') as f:
+            json.dump({'content_type': getattr(content_settings, 'content_type', None)}, f)
+
+    def _etag(self):
+        stat = self._path.stat()
+        return f'"{stat.st_mtime_ns:x}-{stat.st_size:x}"'
+
+
+class FakeContainerClient:
+    def __init__(self, root, container_name='uploads', base_url=None):
+        self.container_name = container_name
+        self.base_url = base_url
+        self.base = Path(root)
+        self.root = self.base / container_name
+        self.meta_root = self.base / '.meta' / container_name
+        self.blocks_root = self.base / '.blocks' / container_name
+
+    @property
+    def url(self):
+        if self.base_url:
+            return f"{self.base_url}/{quote(self.container_name)}"
+        return self.root.resolve().as_uri()
+
+    def create_container(self, **kwargs):
+        if self.root.exists():
+            raise FileExistsError(f"Container {self.container_name} already exists")
+        self.root.mkdir(parents=True)
+
+    def get_blob_client(self, blob):
+        return FakeBlobClient(self, blob)
+
+    def list_blobs(self, name_starts_with=None, **kwargs):
+        if not self.root.exists():
+            return
+        for path in sorted(self.root.rglob('*')):
+            if not path.is_file() or path.name.endswith('.tmp'):
+                continue
+            name = path.relative_to(self.root).as_posix()
+            if name_starts_with and not name.startswith(name_starts_with):
+                continue
+            yield self._properties(name)
+
+    def _properties(self, name):
+        path = self.root / name
+        meta_path = self.meta_root / f"{name}.json"
+        content_type = None
+        if meta_path.exists():
+            with open(meta_path) as f:
+                content_type = json.load(f).get('content_type')
+        stat = path.stat()
+        return FakeBlobProperties(
+            name,
+            stat.st_size,
+            datetime.fromtimestamp(stat.st_mtime, tz=timezone.utc),
+            content_type,
+            f'"{stat.st_mtime_ns:x}-{stat.st_size:x}"'
+        )
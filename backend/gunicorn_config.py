@@ -9,7 +9,9 @@ bind = f"0.0.0.0:{os.getenv('PORT', '5000')}"
 backlog = 2048
 
 # Worker processes
-workers = 1
+# More than one worker needs REDIS_URL (Socket.IO message queue + shared presence);
+# clients must then use the websocket transport since gunicorn has no sticky sessions
+workers = int(os.getenv('GUNICORN_WORKERS', 1))
 worker_class = 'eventlet'
 worker_connections = 1000
 timeout = 60
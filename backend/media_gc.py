@@ -0,0 +1,219 @@
+"""
+Media Garbage Collector Module
+Background sweeper for stored files no task references any more: files of deleted
+tasks, uploads whose task vanished mid-request, partial blobs of failed uploads and
+chunk folders of crashed upload sessions
+
+Each run streams the container (or upload folder) listing in batches, checks every
+batch against the tasks, content_refs and upload_sessions collections with one query
+each, and deletes unreferenced files older than the grace period at a bounded rate
+One worker sweeps at a time (Mongo lease); MEDIA_GC_DRY_RUN=true only counts
+"""
+import os
+import shutil
+import time
+import uuid
+from datetime import datetime, timedelta, timezone
+
+from pymongo.errors import DuplicateKeyError
+
+from blocking_io import blocking_io
+
+from structured_logging import get_logger
+
+log = get_logger('media_gc')
+
+
+class MediaGarbageCollector:
+    def __init__(self):
+        self.enabled = os.getenv('MEDIA_GC_ENABLED', 'False').lower() in ('true', '1', 'yes')
+        self.dry_run = os.getenv('MEDIA_GC_DRY_RUN', 'False').lower() in ('true', '1', 'yes')
+        self.interval = float(os.getenv('MEDIA_GC_INTERVAL_SECONDS', 6 * 3600))
+        # Files younger than this may belong to an upload that hasn't been attached yet
+        self.grace = timedelta(hours=float(os.getenv('MEDIA_GC_GRACE_HOURS', 24)))
+        self.batch_size = int(os.getenv('MEDIA_GC_BATCH_SIZE', 500))
+        self.max_deletes = int(os.getenv('MEDIA_GC_MAX_DELETES_PER_RUN', 5000))
+        self.deletes_per_second = float(os.getenv('MEDIA_GC_DELETES_PER_SECOND', 20))
+        self.owner = f"{os.getpid()}-{uuid.uuid4().hex[:8]}"
+        self.db = None
+        self.blob_storage = None
+        self._upload_folder = None
+        self._sleep = time.sleep
+        self._started = False
+        self.running = False
+        self.last_run = None
+        self.totals = {'runs': 0, 'scanned': 0, 'orphans': 0, 'deleted': 0, 'bytes_reclaimed': 0, 'errors': 0}
+
+    def init_app(self, db, blob_storage, upload_folder, socketio=None):
+        """upload_folder may be a path or a callable; with socketio, sweeps run on a schedule"""
+        self.db = db
+        self.blob_storage = blob_storage
+        self._upload_folder = upload_folder
+        if socketio is not None:
+            self._sleep = socketio.sleep
+            if self.enabled and not self._started:
+                self._started = True
+                socketio.start_background_task(self._loop)
+
+    @property
+    def upload_folder(self):
+        return self._upload_folder() if callable(self._upload_folder) else self._upload_folder
+
+    def _loop(self):
+        while True:
+            # First sweep one interval after startup, not on every worker boot
+            self._sleep(self.interval)
+            try:
+                if self._acquire_lease():
+                    self.sweep()
+            except Exception:
+                log.exception('Media GC run failed')
+
+    def _acquire_lease(self):
+        """Hold the sweeper lease for one interval; False if another worker has it"""
+        now = datetime.utcnow()
+        try:
+            self.db.media_gc_lease.update_one(
+                {'_id': 'sweeper', '$or': [{'expires_at': {'$lt': now}}, {'owner': self.owner}]},
+                {'$set': {'owner': self.owner, 'expires_at': now + timedelta(seconds=self.interval)}},
+                upsert=True
+            )
+            return True
+        except DuplicateKeyError:
+            return False
+
+    # --- Sweeping ---
+    def sweep(self, dry_run=None):
+        """Run one pass and return its report"""
+        dry_run = self.dry_run if dry_run is None else dry_run
+        self.running = True
+        started = time.monotonic()
+        report = {
+            'started_at': datetime.utcnow().isoformat(),
+            'dry_run': dry_run,
+            'backend': 'azure' if self.blob_storage.is_configured() else 'local',
+            'scanned': 0, 'referenced': 0, 'too_recent': 0,
+            'orphans': 0, 'orphan_bytes': 0, 'deleted': 0, 'bytes_reclaimed': 0,
+            'session_dirs_removed': 0, 'errors': 0, 'orphan_sample': []
+        }
+        try:
+            cutoff = datetime.now(timezone.utc) - self.grace
+            batch = []
+            for name, size, modified in self._listing():
+                report['scanned'] += 1
+                if modified > cutoff:
+                    report['too_recent'] += 1
+                    continue
+                batch.append((name, size))
+                if len(batch) >= self.batch_size:
+                    self._sweep_batch(batch, report, dry_run)
+                    batch = []
+            if batch:
+                self._sweep_batch(batch, report, dry_run)
+            if not self.blob_storage.is_configured():
+                self._sweep_session_dirs(cutoff, report, dry_run)
+        finally:
+            self.running = False
+            report['duration_ms'] = round((time.monotonic() - started) * 1000, 1)
+            self.last_run = report
+            self.totals['runs'] += 1
+            for key in ('scanned', 'orphans', 'deleted', 'bytes_reclaimed', 'errors'):
+                self.totals[key] += report[key]
+        log.info('Media GC run finished', dry_run=dry_run, scanned=report['scanned'], orphans=report['orphans'],
+                 orphan_bytes=report['orphan_bytes'], deleted=report['deleted'], duration_ms=report['duration_ms'])
+        return report
+
+    def _listing(self):
+        """Yield (name, size, last_modified) for every stored file, streaming the listing"""
+        if self.blob_storage.is_configured():
+            for blob in self.blob_storage.iter_blobs():
+                yield blob.name, blob.size, blob.last_modified
+            return
+        folder = self.upload_folder
+        if not os.path.isdir(folder):
+            return
+        with os.scandir(folder) as entries:
+            for entry in entries:
+                # Dot-prefixed entries are in-flight temp files and the .sessions folder
+                if entry.name.startswith('.') or not entry.is_file(follow_symlinks=False):
+                    continue
+                stat = entry.stat()
+                yield entry.name, stat.st_size, datetime.fromtimestamp(stat.st_mtime, tz=timezone.utc)
+
+    def _referenced(self, names):
+        """The subset of names some task, shared content entry or open upload session points at"""
+        referenced = set()
+        wanted = set(names)
+        for task in self.db.tasks.find(
+            {'$or': [{'attachments.unique_filename': {'$in': names}}, {'audio_notes.unique_filename': {'$in': names}}]},
+            {'attachments.unique_filename': 1, 'audio_notes.unique_filename': 1}
+        ):
+            for field in ('attachments', 'audio_notes'):
+                referenced.update(entry.get('unique_filename') for entry in task.get(field) or [] if isinstance(entry, dict))
+        for doc in self.db.content_refs.find({'unique_filename': {'$in': names}, 'refs': {'$gt': 0}}, {'unique_filename': 1}):
+            referenced.add(doc['unique_filename'])
+        for doc in self.db.upload_sessions.find({'unique_filename': {'$in': names}}, {'unique_filename': 1}):
+            referenced.add(doc['unique_filename'])
+        return referenced & wanted
+
+    def _sweep_batch(self, batch, report, dry_run):
+        referenced = self._referenced([name for name, _ in batch])
+        for name, size in batch:
+            if name in referenced:
+                report['referenced'] += 1
+                continue
+            report['orphans'] += 1
+            report['orphan_bytes'] += size or 0
+            if len(report['orphan_sample']) < 20:
+                report['orphan_sample'].append(name)
+            if dry_run or report['deleted'] >= self.max_deletes:
+                continue
+            try:
+                self._delete(name)
+                report['deleted'] += 1
+                report['bytes_reclaimed'] += size or 0
+            except Exception as e:
+                report['errors'] += 1
+                log.warning('Media GC could not delete file', name=name, error=str(e))
+            if self.deletes_per_second > 0:
+                self._sleep(1 / self.deletes_per_second)
+
+    def _delete(self, name):
+        if self.blob_storage.is_configured():
+            if not self.blob_storage.delete_file(name):
+                raise RuntimeError('blob delete failed')
+        else:
+            blocking_io.run('file_remove', os.remove, os.path.join(self.upload_folder, name))
+
+    def _sweep_session_dirs(self, cutoff, report, dry_run):
+        """Remove chunk folders of local upload sessions whose session document is gone"""
+        sessions_dir = os.path.join(self.upload_folder, '.sessions')
+        if not os.path.isdir(sessions_dir):
+            return
+        with os.scandir(sessions_dir) as entries:
+            candidates = [entry.name for entry in entries if entry.is_dir(follow_symlinks=False)
+                          and datetime.fromtimestamp(entry.stat().st_mtime, tz=timezone.utc) <= cutoff]
+        if not candidates:
+            return
+        live = {doc['_id'] for doc in self.db.upload_sessions.find({'_id': {'$in': candidates}}, {'_id': 1})}
+        for upload_id in candidates:
+            if upload_id in live:
+                continue
+            if not dry_run:
+                blocking_io.run('file_rmtree', shutil.rmtree, os.path.join(sessions_dir, upload_id), ignore_errors=True)
+            report['session_dirs_removed'] += 1
+
+    def stats(self):
+        return {
+            'enabled': self.enabled,
+            'dry_run': self.dry_run,
+            'interval_seconds': self.interval,
+            'grace_hours': self.grace.total_seconds() / 3600,
+            'running': self.running,
+            'last_run': self.last_run,
+            'totals': dict(self.totals)
+        }
+
+
+# Global instance
+media_gc = MediaGarbageCollector()
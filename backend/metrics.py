@@ -0,0 +1,306 @@
+"""
+Metrics Module
+Low-overhead in-process counters, gauges and histograms rendered in the
+Prometheus text format by GET /metrics
+
+Instrumented:
+    HTTP requests per Flask endpoint, MongoDB commands (PyMongo command listener),
+    Socket.IO events in/out per event name, blob storage operations and bytes,
+    plus room sizes read from the presence store at scrape time
+
+With several gunicorn workers each one publishes a snapshot of its own metrics to
+Redis every METRICS_PUBLISH_SECONDS; whichever worker serves /metrics sums the
+snapshots of all live workers, so a scrape covers the whole instance. A worker that
+dies takes its counts with it, which Prometheus treats like any counter reset
+"""
+import bisect
+import functools
+import json
+import os
+import threading
+import time
+import uuid
+
+from flask import g, request
+from pymongo import monitoring
+
+# Seconds; covers sub-millisecond cache hits up to slow uploads
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+
+class Metric:
+    def __init__(self, name, help_text, label_names=()):
+        self.name = name
+        self.help = help_text
+        self.label_names = tuple(label_names)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def _key(self, labels):
+        return tuple(str(labels.get(name, '')) for name in self.label_names)
+
+    def snapshot(self):
+        with self._lock:
+            values = [[list(key), value if not isinstance(value, list) else list(value)] for key, value in self._values.items()]
+        return {'type': self.type, 'help': self.help, 'labels': list(self.label_names), 'values': values}
+
+
+class Counter(Metric):
+    type = 'counter'
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+
+class Gauge(Metric):
+    """Worker-local gauge; values of all workers are summed"""
+    type = 'gauge'
+
+    def set(self, value, **labels):
+        with self._lock:
+            self._values[self._key(labels)] = value
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, amount=1, **labels):
+        self.inc(-amount, **labels)
+
+
+class Histogram(Metric):
+    type = 'histogram'
+
+    def __init__(self, name, help_text, label_names=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, help_text, label_names)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            # [per-bucket counts..., +Inf count, sum, count]
+            state = self._values.get(key)
+            if state is None:
+                state = self._values[key] = [0] * (len(self.buckets) + 1) + [0.0, 0]
+            state[index] += 1
+            state[-2] += value
+            state[-1] += 1
+
+    def snapshot(self):
+        snapshot = super().snapshot()
+        snapshot['buckets'] = list(self.buckets)
+        return snapshot
+
+
+class MongoCommandListener(monitoring.CommandListener):
+    """Counts and times every command the driver sends"""
+
+    def __init__(self, registry):
+        self.registry = registry
+
+    def started(self, event):
+        pass
+
+    def succeeded(self, event):
+        self.registry.mongo_commands.observe(event.duration_micros / 1e6, command=event.command_name, status='ok')
+
+    def failed(self, event):
+        self.registry.mongo_commands.observe(event.duration_micros / 1e6, command=event.command_name, status='error')
+
+
+class MetricsRegistry:
+    def __init__(self):
+        self.enabled = os.getenv('METRICS_ENABLED', 'True').lower() in ('true', '1', 'yes')
+        self.publish_interval = float(os.getenv('METRICS_PUBLISH_SECONDS', 5))
+        self.key_prefix = os.getenv('METRICS_KEY_PREFIX', 'taskflow:metrics')
+        self.worker_id = f"{os.getpid()}-{uuid.uuid4().hex[:8]}"
+        self._metrics = []
+        self._collectors = []
+        self._redis = None
+
+        self.http_requests = self.histogram('http_request_duration_seconds', 'Flask request latency',
+                                            ('endpoint', 'method', 'status'))
+        self.http_in_flight = self.gauge('http_requests_in_flight', 'Requests being handled')
+        self.mongo_commands = self.histogram('mongodb_command_duration_seconds', 'MongoDB command latency',
+                                             ('command', 'status'))
+        self.socket_events_in = self.counter('socketio_events_received_total', 'Socket.IO events received', ('event',))
+        self.socket_events_out = self.counter('socketio_events_emitted_total', 'Socket.IO events emitted', ('event',))
+        self.socket_handler_duration = self.histogram('socketio_handler_duration_seconds', 'Socket.IO handler latency', ('event',))
+        self.blob_operations = self.histogram('blob_operation_duration_seconds', 'Blob storage operation latency',
+                                              ('operation', 'status'))
+        self.blob_bytes = self.counter('blob_bytes_total', 'Bytes moved to or from blob storage', ('direction',))
+        self.mongo_listener = MongoCommandListener(self)
+
+    # --- Registration ---
+    def counter(self, name, help_text, label_names=()):
+        return self._register(Counter(name, help_text, label_names))
+
+    def gauge(self, name, help_text, label_names=()):
+        return self._register(Gauge(name, help_text, label_names))
+
+    def histogram(self, name, help_text, label_names=(), buckets=DEFAULT_BUCKETS):
+        return self._register(Histogram(name, help_text, label_names, buckets))
+
+    def _register(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def add_collector(self, collector):
+        """collector() -> [(name, type, help, [(labels dict, value)])], evaluated at scrape time by the serving worker"""
+        self._collectors.append(collector)
+
+    # --- Instrumentation helpers ---
+    def init_app(self, app, socketio, redis_client=None):
+        """Time every request, count emitted events, and share snapshots through Redis when available"""
+        if not self.enabled:
+            return
+
+        @app.before_request
+        def _start_timer():
+            g._metrics_started = time.perf_counter()
+            self.http_in_flight.inc()
+
+        @app.after_request
+        def _observe_request(response):
+            started = g.get('_metrics_started')
+            if started is not None:
+                self.http_requests.observe(time.perf_counter() - started, endpoint=request.endpoint or 'unmatched',
+                                           method=request.method, status=response.status_code)
+            return response
+
+        @app.teardown_request
+        def _end_request(exc):
+            # Runs even when the request failed before producing a response
+            if g.pop('_metrics_started', None) is not None:
+                self.http_in_flight.dec()
+
+        # flask_socketio.emit() inside handlers goes through socketio.emit as well
+        emit = socketio.emit
+
+        @functools.wraps(emit)
+        def counted_emit(event, *args, **kwargs):
+            self.socket_events_out.inc(event=event)
+            return emit(event, *args, **kwargs)
+        socketio.emit = counted_emit
+
+        if redis_client is not None:
+            self._redis = redis_client
+            socketio.start_background_task(self._publish_loop, socketio)
+
+    def track_event(self, event):
+        """Decorator for Socket.IO handlers: count and time incoming `event`"""
+        def decorator(handler):
+            @functools.wraps(handler)
+            def wrapper(*args, **kwargs):
+                self.socket_events_in.inc(event=event)
+                started = time.perf_counter()
+                try:
+                    return handler(*args, **kwargs)
+                finally:
+                    self.socket_handler_duration.observe(time.perf_counter() - started, event=event)
+            return wrapper
+        return decorator
+
+    # --- Cross-worker aggregation ---
+    def snapshot(self):
+        return {metric.name: metric.snapshot() for metric in self._metrics}
+
+    def _publish_loop(self, socketio):
+        while True:
+            try:
+                self.publish()
+            except Exception:
+                pass  # Next round retries; a scrape still includes this worker's live values
+            socketio.sleep(self.publish_interval)
+
+    def publish(self):
+        pipe = self._redis.pipeline()
+        pipe.set(f"{self.key_prefix}:worker:{self.worker_id}", json.dumps(self.snapshot()),
+                 ex=max(int(self.publish_interval * 3), 1))
+        pipe.sadd(f"{self.key_prefix}:workers", self.worker_id)
+        pipe.execute()
+
+    def _worker_snapshots(self):
+        snapshots = [self.snapshot()]
+        if self._redis is None:
+            return snapshots, 1
+        workers = [w.decode() if isinstance(w, bytes) else w for w in self._redis.smembers(f"{self.key_prefix}:workers")]
+        others = [w for w in workers if w != self.worker_id]
+        if others:
+            for worker_id, raw in zip(others, self._redis.mget([f"{self.key_prefix}:worker:{w}" for w in others])):
+                if raw is None:
+                    # Expired: the worker is gone
+                    self._redis.srem(f"{self.key_prefix}:workers", worker_id)
+                else:
+                    snapshots.append(json.loads(raw))
+        return snapshots, len(snapshots)
+
+    # --- Exposition ---
+    def render(self):
+        """Prometheus text exposition (version 0.0.4) of all workers' metrics"""
+        snapshots, workers = self._worker_snapshots()
+        merged = {}
+        for snapshot in snapshots:
+            for name, metric in snapshot.items():
+                target = merged.setdefault(name, {**metric, 'values': {}})
+                for labels, value in metric['values']:
+                    key = tuple(labels)
+                    current = target['values'].get(key)
+                    if current is None:
+                        target['values'][key] = list(value) if isinstance(value, list) else value
+                    elif isinstance(value, list):
+                        target['values'][key] = [a + b for a, b in zip(current, value)]
+                    else:
+                        target['values'][key] = current + value
+
+        lines = [
+            '# HELP metrics_workers Workers whose metrics are included in this scrape',
+            '# TYPE metrics_workers gauge',
+            f'metrics_workers {workers}'
+        ]
+        for name, metric in merged.items():
+            lines.append(f"# HELP {name} {metric['help']}")
+            lines.append(f"# TYPE {name} {metric['type']}")
+            for key, value in sorted(metric['values'].items()):
+                labels = dict(zip(metric['labels'], key))
+                if metric['type'] == 'histogram':
+                    cumulative = 0
+                    for bound, count in zip(list(metric['buckets']) + ['+Inf'], value[:-2]):
+                        cumulative += count
+                        lines.append(f"{name}_bucket{_labels({**labels, 'le': _number(bound)})} {cumulative}")
+                    lines.append(f"{name}_sum{_labels(labels)} {_number(value[-2])}")
+                    lines.append(f"{name}_count{_labels(labels)} {value[-1]}")
+                else:
+                    lines.append(f"{name}{_labels(labels)} {_number(value)}")
+        for collector in self._collectors:
+            try:
+                collected = collector()
+            except Exception:
+                continue
+            for name, metric_type, help_text, samples in collected:
+                lines.append(f"# HELP {name} {help_text}")
+                lines.append(f"# TYPE {name} {metric_type}")
+                for labels, value in samples:
+                    lines.append(f"{name}{_labels(labels)} {_number(value)}")
+        return '\n'.join(lines) + '\n'
+
+
+def _number(value):
+    if isinstance(value, str):
+        return value
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+def _labels(labels):
+    if not labels:
+        return ''
+    escaped = (str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for value in labels.values())
+    return '{' + ','.join(f'{name}="{value}"' for name, value in zip(labels, escaped)) + '}'
+
+
+# Global instance
+metrics = MetricsRegistry()
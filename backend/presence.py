@@ -0,0 +1,270 @@
+"""
+Presence Module
+Tracks which Socket.IO connections (sids) are joined to which storage rooms,
+used for the per-storage online counts
+
+Two backends share the same interface:
+    InMemoryPresenceStore - process-local dicts, only correct with a single worker
+    RedisPresenceStore    - shared Redis sets, correct across any number of workers
+Select with PRESENCE_BACKEND=memory|redis (defaults to redis when REDIS_URL is set)
+"""
+import os
+import threading
+import uuid
+
+from structured_logging import get_logger
+
+try:
+    import redis
+    redis_available = True
+except ImportError:
+    redis_available = False
+
+log = get_logger('presence')
+
+
+class InMemoryPresenceStore:
+    shared = False
+
+    def __init__(self):
+        self._storage_sids = {}   # storage_id -> set of sids
+        self._sid_storages = {}   # sid -> set of storage_ids
+        self._lock = threading.Lock()
+
+    def join(self, storage_id, sid):
+        """Register sid in a storage and return the storage's new connection count"""
+        with self._lock:
+            self._storage_sids.setdefault(storage_id, set()).add(sid)
+            self._sid_storages.setdefault(sid, set()).add(storage_id)
+            return len(self._storage_sids[storage_id])
+
+    def leave(self, storage_id, sid):
+        """Remove sid from a storage and return the storage's new connection count"""
+        with self._lock:
+            sids = self._storage_sids.get(storage_id)
+            if sids:
+                sids.discard(sid)
+                if not sids:
+                    del self._storage_sids[storage_id]
+            storages = self._sid_storages.get(sid)
+            if storages:
+                storages.discard(storage_id)
+                if not storages:
+                    del self._sid_storages[sid]
+            return len(self._storage_sids.get(storage_id, ()))
+
+    def disconnect(self, sid):
+        """Remove sid from every storage; returns the storage_ids it was in"""
+        with self._lock:
+            storages = self._sid_storages.pop(sid, set())
+            for storage_id in storages:
+                sids = self._storage_sids.get(storage_id)
+                if sids:
+                    sids.discard(sid)
+                    if not sids:
+                        del self._storage_sids[storage_id]
+            return storages
+
+    def count(self, storage_id):
+        with self._lock:
+            return len(self._storage_sids.get(storage_id, ()))
+
+    def move(self, old_storage_id, new_storage_id):
+        """Re-home every connection of one storage onto another (storage migration)"""
+        with self._lock:
+            sids = self._storage_sids.pop(old_storage_id, set())
+            if sids:
+                self._storage_sids.setdefault(new_storage_id, set()).update(sids)
+            for sid in sids:
+                storages = self._sid_storages.get(sid)
+                if storages is not None:
+                    storages.discard(old_storage_id)
+                    storages.add(new_storage_id)
+
+    def room_sizes(self):
+        """Connection count of every storage with at least one connection"""
+        with self._lock:
+            return [len(sids) for sids in self._storage_sids.values()]
+
+    def heartbeat(self):
+        """Nothing to keep alive or reap in a single process"""
+        return set()
+
+    def stats(self):
+        with self._lock:
+            return {
+                'backend': 'memory',
+                'storages': len(self._storage_sids),
+                'connections': len(self._sid_storages)
+            }
+
+
+class RedisPresenceStore:
+    """
+    Keys (all under key_prefix):
+        storage:<storage_id>   set of '<worker_id>|<sid>' members
+        conn:<worker_id>|<sid> set of storage_ids the connection joined
+        worker:<worker_id>     liveness key, refreshed by heartbeat() with a TTL
+        worker_conns:<worker_id> set of members owned by the worker
+        workers                set of worker_ids that may own members
+    A worker that dies without cleaning up stops refreshing its liveness key;
+    the next heartbeat from any other worker reaps its members
+    """
+    shared = True
+
+    def __init__(self, client, key_prefix=None, worker_id=None, worker_ttl=None):
+        self.client = client
+        self.key_prefix = key_prefix or os.getenv('PRESENCE_KEY_PREFIX', 'taskflow:presence')
+        # Socket.IO sids are only unique per process, so members are namespaced by worker
+        self.worker_id = worker_id or f"{os.getpid()}-{uuid.uuid4().hex[:8]}"
+        self.worker_ttl = worker_ttl if worker_ttl is not None else int(os.getenv('PRESENCE_WORKER_TTL', 60))
+
+    def _key(self, *parts):
+        return ':'.join((self.key_prefix,) + parts)
+
+    def _member(self, sid):
+        return f"{self.worker_id}|{sid}"
+
+    def join(self, storage_id, sid):
+        member = self._member(sid)
+        pipe = self.client.pipeline()
+        pipe.sadd(self._key('storage', storage_id), member)
+        pipe.sadd(self._key('conn', member), storage_id)
+        pipe.sadd(self._key('worker_conns', self.worker_id), member)
+        pipe.scard(self._key('storage', storage_id))
+        return pipe.execute()[-1]
+
+    def leave(self, storage_id, sid):
+        member = self._member(sid)
+        pipe = self.client.pipeline()
+        pipe.srem(self._key('storage', storage_id), member)
+        pipe.srem(self._key('conn', member), storage_id)
+        pipe.scard(self._key('storage', storage_id))
+        return pipe.execute()[-1]
+
+    def disconnect(self, sid):
+        return self._remove_member(self.worker_id, self._member(sid))
+
+    def _remove_member(self, worker_id, member):
+        storages = {self._decode(s) for s in self.client.smembers(self._key('conn', member))}
+        pipe = self.client.pipeline()
+        for storage_id in storages:
+            pipe.srem(self._key('storage', storage_id), member)
+        pipe.delete(self._key('conn', member))
+        pipe.srem(self._key('worker_conns', worker_id), member)
+        pipe.execute()
+        return storages
+
+    def count(self, storage_id):
+        return self.client.scard(self._key('storage', storage_id))
+
+    def move(self, old_storage_id, new_storage_id):
+        old_key, new_key = self._key('storage', old_storage_id), self._key('storage', new_storage_id)
+        members = [self._decode(m) for m in self.client.smembers(old_key)]
+        if not members:
+            return
+        pipe = self.client.pipeline()
+        pipe.sadd(new_key, *members)
+        pipe.delete(old_key)
+        for member in members:
+            pipe.srem(self._key('conn', member), old_storage_id)
+            pipe.sadd(self._key('conn', member), new_storage_id)
+        pipe.execute()
+
+    def room_sizes(self):
+        keys = list(self.client.scan_iter(match=self._key('storage', '*'), count=500))
+        if not keys:
+            return []
+        pipe = self.client.pipeline()
+        for key in keys:
+            pipe.scard(key)
+        return [size for size in pipe.execute() if size]
+
+    def heartbeat(self):
+        """Refresh this worker's liveness and reap members of dead workers; returns affected storage_ids"""
+        pipe = self.client.pipeline()
+        pipe.set(self._key('worker', self.worker_id), 1, ex=self.worker_ttl)
+        pipe.sadd(self._key('workers'), self.worker_id)
+        pipe.execute()
+
+        affected = set()
+        for worker_id in (self._decode(w) for w in self.client.smembers(self._key('workers'))):
+            if worker_id == self.worker_id or self.client.exists(self._key('worker', worker_id)):
+                continue
+            members = [self._decode(m) for m in self.client.smembers(self._key('worker_conns', worker_id))]
+            for member in members:
+                affected |= self._remove_member(worker_id, member)
+            self.client.srem(self._key('workers'), worker_id)
+            self.client.delete(self._key('worker_conns', worker_id))
+            log.info('Reaped presence entries of dead worker', worker=worker_id, entries=len(members))
+        return affected
+
+    def stats(self):
+        return {
+            'backend': 'redis',
+            'worker_id': self.worker_id,
+            'workers': self.client.scard(self._key('workers')),
+            'connections': self.client.scard(self._key('worker_conns', self.worker_id))
+        }
+
+    @staticmethod
+    def _decode(value):
+        return value.decode() if isinstance(value, bytes) else value
+
+
+def create_redis_client(url):
+    """Build a Redis client from a URL; 'fakeredis://' gives an in-process stand-in for local testing"""
+    if url.startswith('fakeredis://'):
+        import fakeredis
+        return fakeredis.FakeRedis()
+    if not redis_available:
+        raise RuntimeError("REDIS_URL is set but the 'redis' package is not installed")
+    return redis.Redis.from_url(url)
+
+
+def create_presence_store():
+    redis_url = os.getenv('REDIS_URL', '')
+    backend = os.getenv('PRESENCE_BACKEND', 'redis' if redis_url else 'memory').lower()
+    if backend == 'redis':
+        try:
+            store = RedisPresenceStore(create_redis_client(redis_url or 'redis://localhost:6379/0'))
+            store.client.ping()
+            print(f"✅ Presence tracking in Redis (worker {store.worker_id})")
+            return store
+        except Exception as e:
+            print(f"⚠️ Redis presence backend unavailable, falling back to in-memory: {e}")
+    return InMemoryPresenceStore()
+
+
+class PresenceTracker:
+    """Wraps the configured store and runs its heartbeat as a Socket.IO background task"""
+
+    def __init__(self, store=None):
+        self.store = store or create_presence_store()
+        self.heartbeat_interval = float(os.getenv('PRESENCE_HEARTBEAT_SECONDS', 15))
+        self._on_reaped = None
+        self._started = False
+
+    def __getattr__(self, name):
+        return getattr(self.store, name)
+
+    def init_app(self, socketio, on_reaped=None):
+        """Start the heartbeat loop; on_reaped(storage_id) is called for storages that lost dead-worker connections"""
+        self._on_reaped = on_reaped
+        if self.store.shared and not self._started:
+            self._started = True
+            socketio.start_background_task(self._heartbeat_loop, socketio)
+
+    def _heartbeat_loop(self, socketio):
+        while True:
+            try:
+                for storage_id in self.store.heartbeat():
+                    if self._on_reaped:
+                        self._on_reaped(storage_id)
+            except Exception as e:
+                log.warning('Presence heartbeat failed', error=str(e))
+            socketio.sleep(self.heartbeat_interval)
+
+
+# Global instance
+presence = PresenceTracker()
@@ -9,5 +9,6 @@ pip install -r requirements.txt
 
 # Run the Flask app using Gunicorn for production
 # Azure will set the PORT environment variable
-gunicorn --bind 0.0.0.0:${PORT:-5000} --worker-class eventlet -w 1 --threads 2 --timeout 60 app:app
+# Set GUNICORN_WORKERS > 1 together with REDIS_URL to scale across cores
+gunicorn --bind 0.0.0.0:${PORT:-5000} --worker-class eventlet -w ${GUNICORN_WORKERS:-1} --threads 2 --timeout 60 app:app
 
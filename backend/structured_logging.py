@@ -0,0 +1,207 @@
+"""
+Structured Logging Module
+Leveled, structured logging for request-time code paths
+
+    log = get_logger('upload')
+    log.info('File stored', task_id=task_id, size=size)
+
+Records go to a bounded in-memory queue and are formatted and written by a native
+thread, so a slow stdout (Azure's log pipe) never blocks a request or, under
+eventlet, the hub; when the queue is full records are dropped and counted
+Configuration (environment):
+    LOG_LEVEL         default level (INFO)
+    LOG_LEVELS        per-subsystem overrides, e.g. "taskflow.socket=WARNING,engineio=INFO"
+    LOG_SAMPLE_RATES  keep a fraction of DEBUG/INFO records, e.g. "taskflow.socket=0.1"
+    LOG_FORMAT        text (default) or json
+    LOG_QUEUE_SIZE    records buffered before dropping (10000)
+"""
+import atexit
+import json
+import logging
+import os
+import sys
+from datetime import datetime, timezone
+
+ROOT_LOGGER = 'taskflow'
+
+# Keyword arguments LoggerAdapter passes through to Logger.log
+_RESERVED_KWARGS = ('exc_info', 'stack_info', 'stacklevel', 'extra')
+
+
+def _native_modules():
+    """threading/queue as they were before eventlet monkey-patched them"""
+    try:
+        from eventlet import patcher
+        if patcher.is_monkey_patched('thread'):
+            return patcher.original('threading'), patcher.original('queue')
+    except ImportError:
+        pass
+    import queue
+    import threading
+    return threading, queue
+
+
+def _parse_pairs(value):
+    pairs = {}
+    for item in (value or '').split(','):
+        name, _, setting = item.partition('=')
+        if name.strip() and setting.strip():
+            pairs[name.strip()] = setting.strip()
+    return pairs
+
+
+class StructuredLogger(logging.LoggerAdapter):
+    """Logger whose keyword arguments become structured fields of the record"""
+
+    def process(self, msg, kwargs):
+        fields = {key: kwargs.pop(key) for key in list(kwargs) if key not in _RESERVED_KWARGS}
+        if fields:
+            kwargs['extra'] = {**kwargs.get('extra', {}), 'fields': fields}
+        return msg, kwargs
+
+
+class SamplingFilter(logging.Filter):
+    """Keep every Nth DEBUG/INFO record per logger; warnings and errors always pass"""
+
+    def __init__(self, rates):
+        super().__init__()
+        self.rates = rates  # logger name prefix -> fraction kept
+        self._every = {}
+        self._seen = {}
+
+    def _keep_every(self, name):
+        every = self._every.get(name)
+        if every is None:
+            rate = next((rate for prefix, rate in sorted(self.rates.items(), key=lambda item: -len(item[0]))
+                         if name == prefix or name.startswith(prefix + '.')), 1.0)
+            every = self._every[name] = max(1, round(1 / rate)) if rate > 0 else 0
+        return every
+
+    def filter(self, record):
+        if record.levelno >= logging.WARNING:
+            return True
+        every = self._keep_every(record.name)
+        if every == 1:
+            return True
+        if every == 0:
+            return False
+        seen = self._seen.get(record.name, 0)
+        self._seen[record.name] = seen + 1
+        if seen % every:
+            return False
+        record.sample_rate = 1 / every
+        return True
+
+
+class TextFormatter(logging.Formatter):
+    def __init__(self):
+        super().__init__('%(asctime)s %(levelname)s %(name)s: %(message)s')
+
+    def formatMessage(self, record):
+        # Fields go on the message line, ahead of any traceback
+        line = super().formatMessage(record)
+        fields = getattr(record, 'fields', None)
+        if fields:
+            line += ' ' + ' '.join(f"{key}={value}" for key, value in fields.items())
+        if getattr(record, 'sample_rate', None):
+            line += f" sample_rate={record.sample_rate:g}"
+        return line
+
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record):
+        entry = {
+            'ts': datetime.fromtimestamp(record.created, tz=timezone.utc).isoformat(),
+            'level': record.levelname,
+            'logger': record.name,
+            'msg': record.getMessage(),
+            **(getattr(record, 'fields', None) or {})
+        }
+        if getattr(record, 'sample_rate', None):
+            entry['sample_rate'] = record.sample_rate
+        if record.exc_text:
+            entry['exc'] = record.exc_text
+        return json.dumps(entry, default=str)
+
+
+class AsyncBufferedHandler(logging.Handler):
+    """Queue records for a native writer thread; never blocks the caller"""
+
+    def __init__(self, target, capacity=10000):
+        super().__init__()
+        self.target = target
+        threading, queue = _native_modules()
+        self._queue = queue.Queue(capacity)
+        self._full = queue.Full
+        self.dropped = 0
+        self.written = 0
+        self._thread = threading.Thread(target=self._drain, name='log-writer', daemon=True)
+        self._thread.start()
+        atexit.register(self.close)
+
+    def emit(self, record):
+        # Render arguments and tracebacks now; the objects may change before the writer runs
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        try:
+            self._queue.put_nowait(record)
+        except self._full:
+            self.dropped += 1
+
+    def _drain(self):
+        while True:
+            record = self._queue.get()
+            if record is None:
+                return
+            try:
+                self.target.emit(record)
+                self.written += 1
+            except Exception:
+                pass
+
+    def close(self):
+        if self._thread.is_alive():
+            self._queue.put(None)
+            self._thread.join(timeout=2)
+        self.target.flush()
+        super().close()
+
+    def stats(self):
+        return {'queued': self._queue.qsize(), 'written': self.written, 'dropped': self.dropped}
+
+
+_handler = None
+
+
+def configure_logging():
+    """Install the async handler on the root logger (idempotent)"""
+    global _handler
+    if _handler is not None:
+        return _handler
+    stream = logging.StreamHandler(sys.stdout)
+    stream.setFormatter(JsonFormatter() if os.getenv('LOG_FORMAT', 'text').lower() == 'json' else TextFormatter())
+    _handler = AsyncBufferedHandler(stream, int(os.getenv('LOG_QUEUE_SIZE', 10000)))
+    rates = {name: float(rate) for name, rate in _parse_pairs(os.getenv('LOG_SAMPLE_RATES')).items()}
+    if rates:
+        _handler.addFilter(SamplingFilter(rates))
+
+    root = logging.getLogger()
+    root.addHandler(_handler)
+    root.setLevel(os.getenv('LOG_LEVEL', 'INFO').upper())
+    # The Azure SDK logs every HTTP request at INFO
+    levels = {'azure': 'WARNING', **_parse_pairs(os.getenv('LOG_LEVELS'))}
+    for name, level in levels.items():
+        logging.getLogger(name).setLevel(level.upper())
+    return _handler
+
+
+def get_logger(subsystem):
+    """Structured logger for one subsystem (taskflow.<subsystem>)"""
+    return StructuredLogger(logging.getLogger(f"{ROOT_LOGGER}.{subsystem}"), {})
+
+
+def stats():
+    return _handler.stats() if _handler is not None else {'queued': 0, 'written': 0, 'dropped': 0}
@@ -0,0 +1,169 @@
+"""
+Task List Cache Module
+In-process cache of serialized task lists, keyed by storage_id
+Entries are evicted LRU-first once the entry count or memory cap is exceeded
+With several workers, invalidations are fanned out over a Redis pub/sub channel
+"""
+import json
+import os
+import threading
+import time
+import uuid
+from collections import OrderedDict
+
+from structured_logging import get_logger
+
+log = get_logger('cache')
+
+
+class TaskListCache:
+    def __init__(self, max_entries=None, max_bytes=None, ttl=None):
+        self.max_entries = max_entries if max_entries is not None else int(os.getenv('TASK_CACHE_MAX_ENTRIES', 256))
+        self.max_bytes = max_bytes if max_bytes is not None else int(os.getenv('TASK_CACHE_MAX_BYTES', 64 * 1024 * 1024))
+        # Safety net so an entry never outlives a missed invalidation for long
+        self.ttl = ttl if ttl is not None else float(os.getenv('TASK_CACHE_TTL', 300))
+        self.enabled = os.getenv('TASK_CACHE_ENABLED', 'True').lower() in ('true', '1', 'yes')
+
+        self._entries = OrderedDict()  # storage_id -> (body, stored_at)
+        self._total_bytes = 0
+        self._lock = threading.Lock()
+        self._load_locks = {}
+        self._generations = {}
+        self.hits = 0
+        self.misses = 0
+        self._bus = None
+        self._bus_channel = None
+        self._origin = uuid.uuid4().hex
+
+    def get(self, storage_id):
+        """Return the cached JSON body for a storage, or None on a miss"""
+        if not self.enabled:
+            return None
+        with self._lock:
+            entry = self._entries.get(storage_id)
+            if entry is None:
+                self.misses += 1
+                return None
+            body, stored_at = entry
+            if self.ttl and time.monotonic() - stored_at > self.ttl:
+                self._drop(storage_id)
+                self.misses += 1
+                return None
+            self._entries.move_to_end(storage_id)
+            self.hits += 1
+            return body
+
+    def get_or_load(self, storage_id, loader):
+        """
+        Return the cached JSON body for a storage, calling loader() on a miss
+        Concurrent misses for the same storage share a single load
+        """
+        body = self.get(storage_id)
+        if body is not None:
+            return body
+        if not self.enabled:
+            return loader()
+
+        with self._lock:
+            load_lock = self._load_locks.setdefault(storage_id, threading.Lock())
+        with load_lock:
+            # Another request may have filled the entry while we waited
+            with self._lock:
+                entry = self._entries.get(storage_id)
+                if entry is not None:
+                    self._entries.move_to_end(storage_id)
+                    return entry[0]
+                generation = self._generations.get(storage_id, 0)
+            body = loader()
+            self._put(storage_id, body, generation)
+        with self._lock:
+            if self._load_locks.get(storage_id) is load_lock and not load_lock.locked():
+                del self._load_locks[storage_id]
+        return body
+
+    def invalidate(self, *storage_ids):
+        """Drop cached lists for the given storages after a mutation, in every worker"""
+        self._invalidate_local(storage_ids)
+        if self._bus is not None:
+            try:
+                self._bus.publish(self._bus_channel, json.dumps({'origin': self._origin, 'ids': [s for s in storage_ids if s]}))
+            except Exception as e:
+                # Other workers fall back to the TTL for this change
+                log.warning('Failed to publish cache invalidation', error=str(e))
+
+    def attach_bus(self, client, start_background_task, channel=None):
+        """Share invalidations with other workers through Redis pub/sub"""
+        self._bus = client
+        self._bus_channel = channel or os.getenv('TASK_CACHE_CHANNEL', 'taskflow:task-cache')
+        start_background_task(self._listen)
+
+    def _listen(self):
+        while True:
+            try:
+                pubsub = self._bus.pubsub(ignore_subscribe_messages=True)
+                pubsub.subscribe(self._bus_channel)
+                for message in pubsub.listen():
+                    data = json.loads(message['data'])
+                    if data.get('origin') != self._origin:
+                        self._invalidate_local(data.get('ids', []))
+            except Exception as e:
+                # Anything cached while disconnected may have missed invalidations
+                log.warning('Cache invalidation listener error, clearing cache', error=str(e))
+                self.clear()
+                time.sleep(1)
+
+    def _invalidate_local(self, storage_ids):
+        with self._lock:
+            for storage_id in storage_ids:
+                if not storage_id:
+                    continue
+                # Bump the generation so an in-flight load does not store stale data
+                self._generations[storage_id] = self._generations.get(storage_id, 0) + 1
+                self._drop(storage_id)
+
+    def clear(self):
+        with self._lock:
+            for storage_id in list(self._entries) + list(self._load_locks):
+                self._generations[storage_id] = self._generations.get(storage_id, 0) + 1
+            self._entries.clear()
+            self._total_bytes = 0
+
+    def stats(self):
+        with self._lock:
+            return {
+                'enabled': self.enabled,
+                'entries': len(self._entries),
+                'bytes': self._total_bytes,
+                'max_entries': self.max_entries,
+                'max_bytes': self.max_bytes,
+                'hits': self.hits,
+                'misses': self.misses,
+                'shared_invalidation': self._bus is not None
+            }
+
+    def _put(self, storage_id, body, generation):
+        size = len(body)
+        with self._lock:
+            if self._generations.get(storage_id, 0) != generation:
+                return
+            if size > self.max_bytes:
+                return
+            self._drop(storage_id)
+            self._entries[storage_id] = (body, time.monotonic())
+            self._total_bytes += size
+            while self._entries and (len(self._entries) > self.max_entries or self._total_bytes > self.max_bytes):
+                oldest = next(iter(self._entries))
+                self._drop(oldest)
+            # Generations only matter while a key might be reloaded; keep the map bounded
+            if len(self._generations) > self.max_entries * 4:
+                self._generations = {k: v for k, v in self._generations.items()
+                                     if k in self._entries or k in self._load_locks}
+
+    def _drop(self, storage_id):
+        entry = self._entries.pop(storage_id, None)
+        if entry is not None:
+            self._total_bytes -= len(entry[0])
+
+
+# Global instance
+task_cache = TaskListCache()
@@ -0,0 +1,275 @@
+"""
+Upload Sessions Module
+Resumable, chunked uploads for large attachments
+
+A session is created with the final file size, chunks are PUT by index (any order,
+retries overwrite), the client can query which chunks arrived, and finalize
+assembles the file:
+    - Azure Storage: every chunk is staged as a block on the final blob, finalize commits the block list
+    - local storage: chunks are written under <upload folder>/.sessions/<upload_id>/ and concatenated
+Direct sessions skip the app server for the bytes: the client PUTs the whole file to
+a write-only SAS URL and finalize verifies the blob exists with the announced size
+Session state lives in MongoDB so any worker can serve any chunk
+"""
+import os
+import shutil
+import uuid
+from datetime import datetime, timedelta, timezone
+
+from pymongo import ReturnDocument
+from werkzeug.utils import secure_filename
+
+from blocking_io import blocking_io
+
+from structured_logging import get_logger
+
+log = get_logger('upload')
+
+
+class UploadSessionError(Exception):
+    def __init__(self, message, status_code=400, **details):
+        super().__init__(message)
+        self.message = message
+        self.status_code = status_code
+        self.details = details
+
+
+class UploadSessionManager:
+    def __init__(self):
+        self.chunk_size = int(os.getenv('UPLOAD_CHUNK_SIZE', 4 * 1024 * 1024))
+        self.max_bytes = int(os.getenv('UPLOAD_SESSION_MAX_BYTES', 512 * 1024 * 1024))
+        self.ttl = timedelta(hours=float(os.getenv('UPLOAD_SESSION_TTL_HOURS', 24)))
+        # How long a direct-upload SAS URL stays valid; the session outlives it by `ttl` for the commit
+        self.direct_sas_ttl = timedelta(seconds=int(os.getenv('DIRECT_UPLOAD_SAS_TTL_SECONDS', 15 * 60)))
+        self.copy_buffer_size = 256 * 1024
+        self.collection = None
+        self.blob_storage = None
+        self._upload_folder = None
+
+    def init_app(self, collection, blob_storage, upload_folder):
+        """upload_folder may be a path or a callable returning the current upload folder"""
+        self.collection = collection
+        self.blob_storage = blob_storage
+        self._upload_folder = upload_folder
+
+    @property
+    def upload_folder(self):
+        return self._upload_folder() if callable(self._upload_folder) else self._upload_folder
+
+    # --- Session lifecycle ---
+    def create(self, task_id, storage_id, filename, size, content_type=None, direct=False):
+        """Create a chunked session, or with direct=True one the client uploads to blob storage itself"""
+        if direct and not self.blob_storage.is_configured():
+            raise UploadSessionError('Direct uploads require Azure Storage; use the chunked or multipart upload', 501)
+        if size <= 0:
+            raise UploadSessionError('File size must be greater than zero')
+        if size > self.max_bytes:
+            raise UploadSessionError(f'File exceeds the {self.max_bytes} byte upload limit', 413)
+        self.purge_expired()
+
+        safe_name = secure_filename(filename or '') or 'file'
+        now = datetime.utcnow()
+        session = {
+            '_id': uuid.uuid4().hex,
+            'task_id': task_id,
+            'storage_id': storage_id,
+            'filename': safe_name,
+            'unique_filename': f"{uuid.uuid4()}_{safe_name}",
+            'content_type': content_type,
+            'size': size,
+            'chunk_size': size if direct else self.chunk_size,
+            'total_chunks': 0 if direct else -(-size // self.chunk_size),
+            'backend': 'direct' if direct else ('azure' if self.blob_storage.is_configured() else 'local'),
+            'received': {},
+            'status': 'open',
+            'created_at': now,
+            'expires_at': now + self.ttl
+        }
+        if direct:
+            session['sas_expires_at'] = now + self.direct_sas_ttl
+            session['expires_at'] = session['sas_expires_at'] + self.ttl
+        self.collection.insert_one(session)
+        return session
+
+    def direct_upload_target(self, session):
+        """Where and how the client PUTs the file of a direct session"""
+        expires_at = session['sas_expires_at'].replace(tzinfo=timezone.utc)
+        upload_url = self.blob_storage.generate_sas_url(session['unique_filename'], 'cw', expires_at)
+        if not upload_url:
+            raise UploadSessionError('Could not sign an upload URL for this storage account', 501)
+        headers = {'x-ms-blob-type': 'BlockBlob'}
+        if session['content_type']:
+            headers['Content-Type'] = session['content_type']
+        return {
+            'unique_filename': session['unique_filename'],
+            'upload_url': upload_url,
+            'upload_method': 'PUT',
+            'upload_headers': headers,
+            'upload_expires_at': session['sas_expires_at'].isoformat()
+        }
+
+    def get(self, upload_id, storage_id):
+        session = self.collection.find_one({'_id': upload_id, 'storage_id': storage_id})
+        if not session or session['expires_at'] < datetime.utcnow():
+            raise UploadSessionError('Upload session not found', 404)
+        return session
+
+    def status(self, session):
+        received = sorted(int(index) for index in session['received'])
+        # Bytes the client can skip when resuming sequentially
+        contiguous = 0
+        while str(contiguous) in session['received']:
+            contiguous += 1
+        return {
+            'upload_id': session['_id'],
+            'task_id': session['task_id'],
+            'filename': session['filename'],
+            'size': session['size'],
+            'chunk_size': session['chunk_size'],
+            'total_chunks': session['total_chunks'],
+            'received_chunks': received,
+            'received_bytes': sum(session['received'].values()),
+            'next_offset': min(contiguous * session['chunk_size'], session['size']),
+            'complete': len(received) == session['total_chunks'],
+            'status': session['status'],
+            'backend': session['backend'],
+            'expires_at': session['expires_at'].isoformat()
+        }
+
+    def write_chunk(self, session, index, stream, length):
+        """Store chunk `index` from a stream of `length` bytes"""
+        if session['status'] != 'open':
+            raise UploadSessionError('Upload session is already being finalized', 409)
+        if session['backend'] == 'direct':
+            raise UploadSessionError('Direct upload sessions are uploaded to blob storage, not in chunks', 409)
+        if index < 0 or index >= session['total_chunks']:
+            raise UploadSessionError(f"Chunk index must be between 0 and {session['total_chunks'] - 1}")
+        expected = self._chunk_length(session, index)
+        if length != expected:
+            raise UploadSessionError(f'Chunk {index} must be exactly {expected} bytes', 400, expected_size=expected)
+
+        if session['backend'] == 'azure':
+            written = self.blob_storage.stage_chunk(session['unique_filename'], index, stream, length)
+            if written != expected:
+                raise UploadSessionError(f'Chunk {index} was truncated ({written} of {expected} bytes)', 400)
+        else:
+            chunk_dir = self._chunk_dir(session)
+            blocking_io.run('file_mkdir', os.makedirs, chunk_dir, exist_ok=True)
+            tmp_path = os.path.join(chunk_dir, f".{index:08d}.{uuid.uuid4().hex}")
+            written = 0
+            # Reads come from the request socket (green); only the disk writes are offloaded
+            with blocking_io.run('file_open', open, tmp_path, 'wb') as f:
+                while True:
+                    data = stream.read(self.copy_buffer_size)
+                    if not data:
+                        break
+                    blocking_io.run('file_write', f.write, data)
+                    written += len(data)
+            if written != expected:
+                blocking_io.run('file_remove', os.remove, tmp_path)
+                raise UploadSessionError(f'Chunk {index} was truncated ({written} of {expected} bytes)', 400)
+            blocking_io.run('file_replace', os.replace, tmp_path, os.path.join(chunk_dir, f"{index:08d}"))
+
+        updated = self.collection.find_one_and_update(
+            {'_id': session['_id'], 'status': 'open'},
+            {'$set': {f'received.{index}': expected}},
+            return_document=ReturnDocument.AFTER
+        )
+        if not updated:
+            raise UploadSessionError('Upload session is no longer open', 409)
+        return updated
+
+    def finalize(self, session):
+        """
+        Assemble the uploaded chunks into the final file/blob
+        Returns (media_info, size); the session document is removed afterwards
+        """
+        missing = [index for index in range(session['total_chunks']) if str(index) not in session['received']]
+        if missing:
+            raise UploadSessionError('Upload is incomplete', 409, missing_chunks=missing[:100])
+        if session['backend'] == 'direct':
+            # Only trust what storage actually holds
+            blob_size = self.blob_storage.get_blob_size(session['unique_filename'])
+            if blob_size is None:
+                raise UploadSessionError('The file has not been uploaded to storage yet', 409)
+            if blob_size != session['size']:
+                raise UploadSessionError(f"Uploaded file is {blob_size} bytes, expected {session['size']}", 409,
+                                         uploaded_size=blob_size)
+        # Claim the session so a duplicate finalize can't assemble it twice
+        claimed = self.collection.find_one_and_update(
+            {'_id': session['_id'], 'status': 'open'},
+            {'$set': {'status': 'finalizing'}}
+        )
+        if not claimed:
+            raise UploadSessionError('Upload session is already being finalized', 409)
+
+        try:
+            if session['backend'] == 'direct':
+                media_info = {
+                    'filename': session['filename'],
+                    'unique_filename': session['unique_filename'],
+                    'blob_url': self.blob_storage.get_file_url(session['unique_filename'])
+                }
+            elif session['backend'] == 'azure':
+                result = self.blob_storage.commit_chunks(session['unique_filename'], session['total_chunks'], session['content_type'])
+                if not result:
+                    raise UploadSessionError('Failed to commit upload to Azure Storage', 500)
+                media_info = {
+                    'filename': session['filename'],
+                    'unique_filename': result['unique_filename'],
+                    'blob_url': result['blob_url']
+                }
+            else:
+                chunk_dir = self._chunk_dir(session)
+                target = os.path.join(self.upload_folder, session['unique_filename'])
+                blocking_io.run('file_assemble', self._assemble, chunk_dir, session['total_chunks'], target)
+                media_info = {'filename': session['filename'], 'unique_filename': session['unique_filename']}
+        except Exception:
+            self.collection.update_one({'_id': session['_id']}, {'$set': {'status': 'open'}})
+            raise
+
+        self.collection.delete_one({'_id': session['_id']})
+        return media_info, session['size']
+
+    def abort(self, session):
+        """Drop a session and whatever chunks it received"""
+        self.collection.delete_one({'_id': session['_id']})
+        if session['backend'] == 'direct':
+            # The client may have uploaded the blob without committing it
+            if self.blob_storage.get_blob_size(session['unique_filename']) is not None:
+                self.blob_storage.delete_file(session['unique_filename'])
+        elif session['backend'] == 'azure':
+            self.blob_storage.discard_chunks(session['unique_filename'])
+        else:
+            blocking_io.run('file_rmtree', shutil.rmtree, self._chunk_dir(session), ignore_errors=True)
+
+    def purge_expired(self, limit=50):
+        """Abort a bounded number of expired sessions (run opportunistically on create)"""
+        expired = list(self.collection.find({'expires_at': {'$lt': datetime.utcnow()}}).limit(limit))
+        for session in expired:
+            try:
+                self.abort(session)
+            except Exception as e:
+                log.warning('Could not purge upload session', upload_id=session['_id'], error=str(e))
+        if expired:
+            log.info('Purged expired upload sessions', count=len(expired))
+
+    # --- Helpers ---
+    def _assemble(self, chunk_dir, total_chunks, target):
+        with open(target, 'wb') as out:
+            for index in range(total_chunks):
+                with open(os.path.join(chunk_dir, f"{index:08d}"), 'rb') as chunk:
+                    shutil.copyfileobj(chunk, out, self.copy_buffer_size)
+        shutil.rmtree(chunk_dir, ignore_errors=True)
+
+    def _chunk_length(self, session, index):
+        if index == session['total_chunks'] - 1:
+            return session['size'] - index * session['chunk_size']
+        return session['chunk_size']
+
+    def _chunk_dir(self, session):
+        return os.path.join(self.upload_folder, '.sessions', session['_id'])
+
+
+# Global instance
+upload_sessions = UploadSessionManager()
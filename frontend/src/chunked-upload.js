@@ -0,0 +1,137 @@
+// Resumable uploads for large attachments using the backend upload-session API,
+// and direct-to-storage uploads through pre-signed blob URLs when Azure Storage is configured
+import axios from 'axios';
+import apiConfig from './api-config.js';
+
+class ChunkedUploader {
+  constructor() {
+    // Files above this size use upload sessions instead of a single multipart POST
+    this.threshold = 4 * 1024 * 1024;
+    this.maxRetries = 5;
+    this.sessionKeyPrefix = 'uploadSession:';
+    // null until the backend tells us whether it can sign direct uploads
+    this.directSupported = null;
+  }
+
+  shouldUse(file) {
+    return file.size > this.threshold;
+  }
+
+  // Same file picked again for the same task resumes its unfinished session
+  sessionKey(taskId, file) {
+    return `${this.sessionKeyPrefix}${taskId}:${file.name}:${file.size}:${file.lastModified}`;
+  }
+
+  async openSession(apiUrl, taskId, storageId, file) {
+    const key = this.sessionKey(taskId, file);
+    const savedId = localStorage.getItem(key);
+    if (savedId) {
+      try {
+        const { data } = await axios.get(`${apiUrl}/uploads/${savedId}`, { params: { storage_id: storageId } });
+        if (data.status === 'open') {
+          console.log(`Resuming upload session ${savedId} (${data.received_chunks.length}/${data.total_chunks} chunks)`);
+          return data;
+        }
+      } catch (error) {
+        if (error.response?.status !== 404) throw error;
+      }
+      localStorage.removeItem(key);
+    }
+
+    const { data } = await axios.post(`${apiUrl}/tasks/${taskId}/uploads`, {
+      storage_id: storageId,
+      filename: file.name,
+      size: file.size,
+      content_type: file.type || null
+    });
+    localStorage.setItem(key, data.upload_id);
+    return data;
+  }
+
+  async putChunk(apiUrl, session, storageId, index, chunk) {
+    for (let attempt = 0; ; attempt++) {
+      try {
+        await axios.put(`${apiUrl}/uploads/${session.upload_id}/chunks/${index}`, chunk, {
+          params: { storage_id: storageId },
+          headers: { 'Content-Type': 'application/octet-stream' }
+        });
+        return;
+      } catch (error) {
+        const status = error.response?.status;
+        // Client errors won't go away on retry; network drops and 5xx will
+        const retryable = !status || status >= 500 || status === 408 || status === 429;
+        if (!retryable || attempt >= this.maxRetries) throw error;
+        const delay = Math.min(1000 * 2 ** attempt, 15000);
+        console.log(`Chunk ${index} failed (${status || error.message}), retrying in ${delay}ms`);
+        await new Promise(resolve => setTimeout(resolve, delay));
+      }
+    }
+  }
+
+  // PUT the file straight to blob storage and commit it; resolves to { file_info, version, updated_at },
+  // or null when the backend can't sign direct uploads (use upload() / multipart instead)
+  async uploadDirect(taskId, storageId, file, onProgress) {
+    if (this.directSupported === false) return null;
+    const apiUrl = await apiConfig.getApiUrl();
+    let session;
+    try {
+      ({ data: session } = await axios.post(`${apiUrl}/tasks/${taskId}/direct-uploads`, {
+        storage_id: storageId,
+        filename: file.name,
+        size: file.size,
+        content_type: file.type || null
+      }));
+    } catch (error) {
+      if (error.response?.status === 501) {
+        this.directSupported = false;
+        return null;
+      }
+      throw error;
+    }
+    this.directSupported = true;
+
+    try {
+      await axios.put(session.upload_url, file, {
+        headers: session.upload_headers,
+        onUploadProgress: event => onProgress?.(event.loaded / file.size)
+      });
+      const { data } = await axios.post(`${apiUrl}/uploads/${session.upload_id}/complete`, null, {
+        params: { storage_id: storageId }
+      });
+      return data;
+    } catch (error) {
+      // Don't leave an uncommitted blob behind
+      axios.delete(`${apiUrl}/uploads/${session.upload_id}`, { params: { storage_id: storageId } }).catch(() => {});
+      throw error;
+    }
+  }
+
+  // Upload a file in chunks, skipping chunks the server already has; resolves to { file_info, version, updated_at }
+  async upload(taskId, storageId, file, onProgress) {
+    const apiUrl = await apiConfig.getApiUrl();
+    const session = await this.openSession(apiUrl, taskId, storageId, file);
+    const received = new Set(session.received_chunks);
+    let uploaded = session.received_bytes;
+    onProgress?.(uploaded / file.size);
+
+    for (let index = 0; index < session.total_chunks; index++) {
+      if (received.has(index)) continue;
+      const start = index * session.chunk_size;
+      const chunk = file.slice(start, Math.min(start + session.chunk_size, file.size));
+      await this.putChunk(apiUrl, session, storageId, index, chunk);
+      uploaded += chunk.size;
+      onProgress?.(uploaded / file.size);
+    }
+
+    const { data } = await axios.post(`${apiUrl}/uploads/${session.upload_id}/complete`, null, {
+      params: { storage_id: storageId }
+    });
+    localStorage.removeItem(this.sessionKey(taskId, file));
+    return data;
+  }
+}
+
+// Create a singleton instance
+const chunkedUploader = new ChunkedUploader();
+
+export default chunkedUploader;
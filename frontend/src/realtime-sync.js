@@ -12,13 +12,20 @@ class RealtimeSync {
     this.isIdle = true;
     this.isEditing = false;
     this.isRecording = false;
+    // Latest presence digest per server worker: { source: { users, receivedAt } }
+    this.presenceSources = {};
+    this.lastSentActivity = null;
+    this.lastSentActivityAt = 0;
     this.callbacks = {
       onTaskCreated: null,
       onTaskUpdated: null,
+      onTaskPatched: null,
       onTaskDeleted: null,
-      onUserActivity: null,
+      onActiveUsers: null,
       onConnectionChange: null,
-      onStorageOnlineCount: null
+      onStorageOnlineCount: null,
+      onTaskStats: null,
+      onResyncRequired: null
     };
   }
 
@@ -43,6 +50,7 @@ class RealtimeSync {
 
       this._s1d = _s1d;
       this.userId = userId;
+      this.presenceSources = {};
 
       this.setupEventListeners();
       
@@ -97,42 +105,35 @@ class RealtimeSync {
       console.log('DEBUG: Joined storage room');
     });
 
-    this.socket.on('task_created', (data) => {
-      console.log('Received task_created event');
-      if (data.storage_id === this._s1d) {
-        console.log('Processing task_created for current storage');
-        this.callbacks.onTaskCreated?.(data.task);
-      } else {
-        console.log('Ignoring task_created for different storage');
+    // All task changes arrive coalesced per room; fan out to the per-task callbacks
+    this.socket.on('tasks_changed', (data) => {
+      if (data.storage_id !== this._s1d) return;
+      if (data.resync) {
+        // Server dropped the detailed payload (too many changes); pull a delta instead
+        this.callbacks.onResyncRequired?.();
       }
-    });
-
-    this.socket.on('task_updated', (data) => {
-      console.log('DEBUG: Received task_updated event');
-      console.log('DEBUG: Update type:', data.update_type);
-      if (data.storage_id === this._s1d) {
-        console.log('DEBUG: Processing task_updated for current storage');
-        console.log('DEBUG: Calling onTaskUpdated callback');
-        this.callbacks.onTaskUpdated?.(data);
-      } else {
-        console.log('DEBUG: Ignoring task_updated for different storage');
+      (data.created || []).forEach(task => this.callbacks.onTaskCreated?.(task));
+      (data.updated || []).forEach(task => this.callbacks.onTaskUpdated?.({
+        task,
+        storage_id: data.storage_id,
+        update_type: 'updated'
+      }));
+      (data.patched || []).forEach(patch => this.callbacks.onTaskPatched?.(patch));
+      (data.deleted || []).forEach(taskId => this.callbacks.onTaskDeleted?.(taskId));
+      if (data.stats) {
+        this.callbacks.onTaskStats?.({ storage_id: data.storage_id, stats: data.stats });
       }
     });
 
-    this.socket.on('task_deleted', (data) => {
-      console.log('Received task_deleted event');
-      if (data.storage_id === this._s1d) {
-        console.log('Processing task_deleted for current storage');
-        this.callbacks.onTaskDeleted?.(data.task_id);
+    // One digest per room and server worker lists every active user's state
+    this.socket.on('presence_digest', (data) => {
+      if (data.storage_id !== this._s1d) return;
+      if (data.users.length) {
+        this.presenceSources[data.source] = { users: data.users, receivedAt: Date.now() };
       } else {
-        console.log('Ignoring task_deleted for different storage');
-      }
-    });
-
-    this.socket.on('user_activity_update', (data) => {
-      if (data.user_id !== this.userId) {
-        this.callbacks.onUserActivity?.(data);
+        delete this.presenceSources[data.source];
       }
+      this.notifyActiveUsers();
     });
 
     this.socket.on('storage_online_count', (data) => {
@@ -153,9 +154,6 @@ class RealtimeSync {
     // Add a catch-all event listener for debugging
     this.socket.onAny((eventName) => {
       console.log('DEBUG: Received Socket.IO event:', eventName);
-      if (eventName === 'task_updated') {
-        console.log('DEBUG: task_updated event received');
-      }
     });
   }
 
@@ -181,14 +179,47 @@ class RealtimeSync {
     this.isIdle = activity === 'idle';
     this.isEditing = activity === 'editing';
     this.isRecording = activity === 'recording';
+    this.lastActivity = Date.now();
+
+    // Repeating an unchanged state is only useful as a heartbeat, which startPresenceHeartbeat covers
+    if (activity === this.lastSentActivity && Date.now() - this.lastSentActivityAt < 5000) return;
+    this.sendActivity(activity);
+  }
 
+  sendActivity(activity) {
     this.socket.emit('user_activity', {
       storage_id: this._s1d,
       user_id: this.userId,
-      activity: activity
+      activity
     });
+    this.lastSentActivity = activity;
+    this.lastSentActivityAt = Date.now();
+  }
 
-    this.lastActivity = Date.now();
+  // Merge the digests of all workers into { user_id: { user_id, activity, timestamp } }
+  notifyActiveUsers() {
+    const users = {};
+    Object.values(this.presenceSources).forEach(({ users: sourceUsers }) => {
+      sourceUsers.forEach(user => {
+        if (user.user_id === this.userId) return;
+        const known = users[user.user_id];
+        // The same user in two tabs on different workers: keep the latest state
+        if (!known || new Date(user.updated_at) > new Date(known.timestamp)) {
+          users[user.user_id] = { user_id: user.user_id, activity: user.activity, timestamp: user.updated_at };
+        }
+      });
+    });
+    this.callbacks.onActiveUsers?.(users);
+  }
+
+  // Forget workers whose digests stopped arriving (each resends at least every 30s while it has users)
+  prunePresence(maxAgeMs = 90000) {
+    const cutoff = Date.now() - maxAgeMs;
+    const stale = Object.keys(this.presenceSources).filter(source => this.presenceSources[source].receivedAt < cutoff);
+    stale.forEach(source => delete this.presenceSources[source]);
+    if (stale.length) {
+      this.notifyActiveUsers();
+    }
   }
 
   startIdleDetection() {
@@ -211,11 +242,7 @@ class RealtimeSync {
     this.presenceInterval = setInterval(() => {
       if (!this.socket || !this.isConnected || !this._s1d || !this.userId) return;
       const activity = this.isRecording ? 'recording' : (this.isEditing ? 'editing' : (this.isIdle ? 'idle' : 'idle'));
-      this.socket.emit('user_activity', {
-        storage_id: this._s1d,
-        user_id: this.userId,
-        activity
-      });
+      this.sendActivity(activity);
     }, 30000); // 30s heartbeat for faster presence updates
   }
 
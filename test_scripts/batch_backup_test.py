@@ -0,0 +1,101 @@
+#!/usr/bin/env python3
+"""
+Test script for backups created through /api/tasks/batch
+Uploads an attachment and a voice note with content-addressed storage on, backs the
+task up with a batch 'create', deletes the original and checks that the backup's
+files are still stored; then deletes the backup and checks that they are gone
+
+Fully offline: runs the app in-process against mongomock and the fake blob store
+(pip install mongomock)
+
+Usage:
+    python test_scripts/batch_backup_test.py
+"""
+try:
+    import eventlet
+    eventlet.monkey_patch()
+except ImportError:
+    pass
+
+import contextlib
+import os
+import sys
+import tempfile
+from io import BytesIO
+
+SCRIPTS_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_ROOT = os.path.dirname(SCRIPTS_DIR)
+STORAGE_ID = 'batch-backup-test'
+
+workdir = tempfile.mkdtemp(prefix='taskflow-batch-test-')
+os.environ['MONGO_URI'] = 'mongodb://localhost:27017/taskflow_batch_test'
+os.environ['AZURE_STORAGE_FAKE_DIR'] = os.path.join(workdir, 'blobs')
+os.environ['CONTENT_ADDRESSED_STORAGE'] = 'true'
+os.environ.setdefault('LOG_LEVEL', 'WARNING')
+os.environ.pop('REDIS_URL', None)
+
+sys.path.insert(0, SCRIPTS_DIR)
+from benchmark_backend import use_mongomock
+
+use_mongomock()
+sys.path.insert(0, os.path.join(REPO_ROOT, 'backend'))
+with contextlib.redirect_stdout(sys.stderr):
+    import app as appmod
+
+
+def stored_files():
+    return {blob.name for blob in appmod.azure_storage.iter_blobs()}
+
+
+def check(label, ok):
+    print(f"{'✅' if ok else '❌'} {label}")
+    return ok
+
+
+def test_batch_backup():
+    """Back a task up through the batch endpoint, then delete the original and the backup"""
+    print("=" * 60)
+    print("🧪 Testing batch-created backups of tasks with media")
+    print("=" * 60)
+    client = appmod.app.test_client()
+    results = []
+
+    task = client.post('/api/tasks', json={'storage_id': STORAGE_ID, 'title': 'Original'}).get_json()
+    client.post(f"/api/tasks/{task['_id']}/upload", content_type='multipart/form-data',
+                data={'storage_id': STORAGE_ID, 'file': (BytesIO(os.urandom(4096)), 'report.pdf')})
+    client.post(f"/api/tasks/{task['_id']}/audio?storage_id={STORAGE_ID}", data=os.urandom(2048),
+                content_type='audio/webm')
+    original = next(t for t in client.get(f'/api/tasks?storage_id={STORAGE_ID}').get_json()
+                    if t['_id'] == task['_id'])
+    media = [entry['unique_filename'] for field in ('attachments', 'audio_notes') for entry in original[field]]
+    results.append(check(f"original has {len(media)} content-addressed files",
+                         len(media) == 2 and all(entry.get('sha256') for field in ('attachments', 'audio_notes')
+                                                 for entry in original[field])))
+
+    response = client.post('/api/tasks/batch', json={'storage_id': STORAGE_ID, 'operations': [{
+        'op': 'create',
+        'task': {'title': 'Original', 'is_backup': True, 'original_id': original['_id'],
+                 'backup_reason': 'batch', 'attachments': original['attachments'],
+                 'audio_notes': original['audio_notes']}
+    }]})
+    backup = response.get_json()['results'][0]['task']
+    results.append(check("backup shares the original's files",
+                         len(backup['attachments']) == 1 and len(backup['audio_notes']) == 1))
+
+    client.delete(f"/api/tasks/{original['_id']}?storage_id={STORAGE_ID}")
+    results.append(check('files survive deleting the original', set(media) <= stored_files()))
+
+    client.post('/api/tasks/batch', json={'storage_id': STORAGE_ID,
+                                          'operations': [{'op': 'delete', 'task_id': backup['_id']}]})
+    results.append(check('files are removed with the last reference', not set(media) & stored_files()))
+
+    print("=" * 60)
+    if not all(results):
+        print("❌ Batch-created backups do not keep their media")
+        return False
+    print("✅ Batch-created backups keep their media")
+    return True
+
+
+if __name__ == "__main__":
+    sys.exit(0 if test_batch_backup() else 1)
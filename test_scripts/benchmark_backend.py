@@ -0,0 +1,310 @@
+#!/usr/bin/env python3
+"""
+Backend benchmark suite
+Boots the Flask app in-process against mongomock (or a local mongod) and the
+filesystem-backed fake blob store, drives the main endpoints at configurable
+storage sizes and concurrency, and reports latency percentiles and throughput
+as JSON that can be compared across commits
+
+Scenarios:
+    get_tasks        GET  /api/tasks (cached full list)
+    get_tasks_page   GET  /api/tasks?limit=50
+    create_task      POST /api/tasks
+    update_task      PUT  /api/tasks/<id>
+    get_task_stats   GET  /api/tasks/stats
+    upload           POST /api/tasks/<id>/upload (multipart, --upload-size bytes)
+    audio            POST /api/tasks/<id>/audio (raw body, --audio-size bytes)
+
+Usage:
+    pip install mongomock
+    python test_scripts/benchmark_backend.py --storage-sizes 100,1000 --concurrency 8 --output bench.json
+    python test_scripts/benchmark_backend.py --mongo-uri mongodb://localhost:27017/taskflow_bench
+    python test_scripts/benchmark_backend.py --compare bench.json    # print changes against an earlier run
+
+Progress goes to stderr; the JSON report goes to stdout (or --output)
+"""
+# The app runs under eventlet when it is installed; patch like the gunicorn eventlet
+# worker does, so the concurrent clients below are green threads sharing one hub
+try:
+    import eventlet
+    eventlet.monkey_patch()
+except ImportError:
+    pass
+
+import argparse
+import contextlib
+import json
+import os
+import platform
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+from io import BytesIO
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+BACKEND_DIR = os.path.join(REPO_ROOT, 'backend')
+SCENARIOS = ('get_tasks', 'get_tasks_page', 'create_task', 'update_task', 'get_task_stats', 'upload', 'audio')
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Benchmark the TaskFlow backend in-process')
+    parser.add_argument('--storage-sizes', default='100,1000',
+                        help='Comma-separated number of tasks seeded per storage; every scenario runs once per size')
+    parser.add_argument('--concurrency', type=int, default=4, help='Concurrent clients')
+    parser.add_argument('--requests', type=int, default=200, help='Measured requests per scenario')
+    parser.add_argument('--warmup', type=int, default=20, help='Unmeasured requests per scenario')
+    parser.add_argument('--scenarios', default=','.join(SCENARIOS), help='Comma-separated subset of scenarios')
+    parser.add_argument('--upload-size', type=int, default=256 * 1024, help='Attachment size in bytes')
+    parser.add_argument('--audio-size', type=int, default=64 * 1024, help='Voice note size in bytes')
+    parser.add_argument('--mongo-uri', help='Use this MongoDB (the database is dropped first) instead of mongomock')
+    parser.add_argument('--local-storage', action='store_true',
+                        help='Store files in a local upload folder instead of the fake blob store')
+    parser.add_argument('--seed', type=int, default=1, help='Random seed for task selection')
+    parser.add_argument('--output', help='Write the JSON report to this file instead of stdout')
+    parser.add_argument('--compare', help='Earlier JSON report to compare this run against')
+    return parser.parse_args()
+
+
+def log(message):
+    print(message, file=sys.stderr, flush=True)
+
+
+# --- App bootstrap ---
+def use_mongomock():
+    """Route flask_pymongo's client to mongomock (in-memory, no server needed)"""
+    try:
+        import mongomock
+        import mongomock.collection
+    except ImportError:
+        log("❌ mongomock is not installed: pip install mongomock (or pass --mongo-uri)")
+        sys.exit(1)
+    import flask_pymongo
+
+    # pymongo's UpdateOne passes `sort`, which mongomock's bulk builder doesn't accept
+    add_update = mongomock.collection.BulkOperationBuilder.add_update
+    mongomock.collection.BulkOperationBuilder.add_update = \
+        lambda self, *args, sort=None, **kwargs: add_update(self, *args, **kwargs)
+
+    class MockClient(mongomock.MongoClient):
+        def __init__(self, host=None, *args, **kwargs):
+            # Driver options (timeouts, pool size, listeners) don't apply to mongomock
+            super().__init__(host)
+
+    flask_pymongo.MongoClient = MockClient
+
+
+def boot_app(args, workdir):
+    os.environ['MONGO_URI'] = args.mongo_uri or 'mongodb://localhost:27017/taskflow_bench'
+    os.environ.setdefault('LOG_LEVEL', 'WARNING')
+    os.environ.setdefault('USE_CORS', 'False')
+    os.environ.pop('REDIS_URL', None)
+    if args.local_storage:
+        for name in ('AZURE_STORAGE_CONNECTION_STRING', 'AZURE_STORAGE_ACCOUNT_NAME', 'AZURE_STORAGE_FAKE_DIR'):
+            os.environ.pop(name, None)
+    else:
+        os.environ['AZURE_STORAGE_FAKE_DIR'] = os.path.join(workdir, 'blobs')
+    if args.mongo_uri:
+        # Start from an empty database so runs are comparable
+        from pymongo import MongoClient
+        mongo = MongoClient(args.mongo_uri, serverSelectionTimeoutMS=5000)
+        mongo.drop_database(mongo.get_default_database(default='taskflow_bench').name)
+        mongo.close()
+    else:
+        use_mongomock()
+
+    sys.path.insert(0, BACKEND_DIR)
+    # Keep startup banners off stdout so the report stays machine-readable
+    with contextlib.redirect_stdout(sys.stderr):
+        import app as appmod
+    appmod.app.config['UPLOAD_FOLDER'] = os.path.join(workdir, 'uploads')
+    os.makedirs(appmod.app.config['UPLOAD_FOLDER'], exist_ok=True)
+    if appmod.tasks_collection is None:
+        log("❌ The app could not connect to MongoDB")
+        sys.exit(1)
+    return appmod
+
+
+# --- Workload ---
+class Storage:
+    def __init__(self, client, size):
+        self.client = client
+        self.storage_id = f"bench-{size}-{uuid.uuid4().hex[:8]}"
+        self.task_ids = []
+
+    def seed(self, size):
+        for index in range(size):
+            response = self.client.post('/api/tasks', json={
+                'storage_id': self.storage_id,
+                'title': f'Task {index}',
+                'description': 'Benchmark task ' * 4,
+                'priority': ('low', 'medium', 'high')[index % 3],
+                'completed': index % 4 == 0
+            })
+            if response.status_code != 201:
+                raise RuntimeError(f'Seeding failed with {response.status_code}: {response.get_data(as_text=True)[:200]}')
+            self.task_ids.append(response.get_json()['_id'])
+
+
+def make_request(scenario, storage, rng, payloads):
+    client, sid = storage.client, storage.storage_id
+    if scenario == 'get_tasks':
+        return client.get(f'/api/tasks?storage_id={sid}')
+    if scenario == 'get_tasks_page':
+        return client.get(f'/api/tasks?storage_id={sid}&limit=50')
+    if scenario == 'create_task':
+        return client.post('/api/tasks', json={'storage_id': sid, 'title': f'New {rng.random()}', 'priority': 'medium'})
+    if scenario == 'update_task':
+        return client.put(f'/api/tasks/{rng.choice(storage.task_ids)}',
+                          json={'storage_id': sid, 'title': f'Edited {rng.random()}', 'completed': rng.random() < 0.5})
+    if scenario == 'get_task_stats':
+        return client.get(f'/api/tasks/stats?storage_id={sid}')
+    if scenario == 'upload':
+        return client.post(f'/api/tasks/{rng.choice(storage.task_ids)}/upload',
+                           data={'storage_id': sid, 'file': (BytesIO(payloads['upload']), 'bench.bin')},
+                           content_type='multipart/form-data')
+    if scenario == 'audio':
+        return client.post(f'/api/tasks/{rng.choice(storage.task_ids)}/audio?storage_id={sid}&duration=3',
+                           data=payloads['audio'], content_type='audio/webm')
+    raise ValueError(f'Unknown scenario {scenario}')
+
+
+def percentile(sorted_values, fraction):
+    if not sorted_values:
+        return None
+    index = min(len(sorted_values) - 1, max(0, round(fraction * len(sorted_values) + 0.5) - 1))
+    return sorted_values[index]
+
+
+def run_scenario(scenario, storage, args, payloads):
+    rng = random.Random(f"{args.seed}-{scenario}-{len(storage.task_ids)}")
+    errors = {}
+
+    def one(_):
+        started = time.perf_counter()
+        response = make_request(scenario, storage, rng, payloads)
+        elapsed = time.perf_counter() - started
+        response.close()
+        if response.status_code >= 400:
+            errors[response.status_code] = errors.get(response.status_code, 0) + 1
+        return elapsed
+
+    with ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+        list(pool.map(one, range(args.warmup)))
+        errors.clear()
+        started = time.perf_counter()
+        latencies = sorted(pool.map(one, range(args.requests)))
+        wall = time.perf_counter() - started
+
+    ms = [value * 1000 for value in latencies]
+    return {
+        'requests': len(ms),
+        'errors': sum(errors.values()),
+        'error_statuses': {str(status): count for status, count in sorted(errors.items())},
+        'throughput_rps': round(len(ms) / wall, 1) if wall else None,
+        'latency_ms': {
+            'mean': round(sum(ms) / len(ms), 3) if ms else None,
+            'p50': round(percentile(ms, 0.50), 3) if ms else None,
+            'p95': round(percentile(ms, 0.95), 3) if ms else None,
+            'p99': round(percentile(ms, 0.99), 3) if ms else None,
+            'max': round(ms[-1], 3) if ms else None
+        }
+    }
+
+
+# --- Reporting ---
+def git_revision():
+    try:
+        revision = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=REPO_ROOT,
+                                  capture_output=True, text=True, check=True).stdout.strip()
+        dirty = subprocess.run(['git', 'status', '--porcelain', '--untracked-files=no'], cwd=REPO_ROOT,
+                               capture_output=True, text=True).stdout.strip()
+        return f"{revision}-dirty" if dirty else revision
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(report, baseline_path):
+    with open(baseline_path) as f:
+        baseline = json.load(f)
+    log(f"\n📊 Compared with {baseline.get('meta', {}).get('git_revision')} ({baseline_path})")
+    log(f"{'size':>6} {'scenario':<16} {'p50 ms':>16} {'p95 ms':>16} {'rps':>16}")
+    for size, scenarios in report['results'].items():
+        for scenario, current in scenarios.items():
+            previous = baseline.get('results', {}).get(size, {}).get(scenario)
+            if not previous:
+                continue
+
+            def cell(old, new):
+                if not old or new is None:
+                    return f"{new}"
+                return f"{new:.2f} ({(new - old) / old * 100:+.0f}%)"
+            log(f"{size:>6} {scenario:<16} "
+                f"{cell(previous['latency_ms']['p50'], current['latency_ms']['p50']):>16} "
+                f"{cell(previous['latency_ms']['p95'], current['latency_ms']['p95']):>16} "
+                f"{cell(previous['throughput_rps'], current['throughput_rps']):>16}")
+
+
+def main():
+    args = parse_args()
+    scenarios = [name.strip() for name in args.scenarios.split(',') if name.strip()]
+    unknown = set(scenarios) - set(SCENARIOS)
+    if unknown:
+        log(f"❌ Unknown scenarios: {', '.join(sorted(unknown))}")
+        sys.exit(2)
+    sizes = [int(size) for size in args.storage_sizes.split(',') if size.strip()]
+    payloads = {'upload': os.urandom(args.upload_size), 'audio': os.urandom(args.audio_size)}
+
+    workdir = tempfile.mkdtemp(prefix='taskflow-bench-')
+    try:
+        appmod = boot_app(args, workdir)
+        client = appmod.app.test_client()
+        report = {
+            'meta': {
+                'git_revision': git_revision(),
+                'timestamp': datetime.now(timezone.utc).isoformat(),
+                'python': platform.python_version(),
+                'platform': platform.platform(),
+                'mongo': 'mongod' if args.mongo_uri else 'mongomock',
+                'storage': 'local' if args.local_storage else 'fake-blob',
+                'async_mode': appmod.async_mode,
+                'config': {
+                    'storage_sizes': sizes, 'concurrency': args.concurrency, 'requests': args.requests,
+                    'warmup': args.warmup, 'upload_size': args.upload_size, 'audio_size': args.audio_size,
+                    'seed': args.seed
+                }
+            },
+            'results': {}
+        }
+        for size in sizes:
+            log(f"🌱 Seeding a storage with {size} tasks")
+            storage = Storage(client, size)
+            storage.seed(size)
+            results = report['results'][str(size)] = {}
+            for scenario in scenarios:
+                results[scenario] = run_scenario(scenario, storage, args, payloads)
+                latency = results[scenario]['latency_ms']
+                log(f"   {scenario:<16} p50 {latency['p50']:>9.3f} ms  p95 {latency['p95']:>9.3f} ms  "
+                    f"p99 {latency['p99']:>9.3f} ms  {results[scenario]['throughput_rps']:>8} req/s"
+                    + (f"  ⚠️ {results[scenario]['errors']} errors" if results[scenario]['errors'] else ''))
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(output + '\n')
+        log(f"✅ Report written to {args.output}")
+    else:
+        print(output)
+    if args.compare:
+        compare(report, args.compare)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,589 @@
+#!/usr/bin/env python3
+"""
+Socket.IO load generator
+Opens N simulated clients against a locally running server, spreads them over a
+configurable distribution of storage rooms, generates task mutations (HTTP) and
+user_activity traffic, and measures:
+    - end-to-end delivery latency of tasks_changed events, and of activity changes through
+      presence_digest events (or per-ping user_activity_update relays on older servers)
+    - dropped events (expected deliveries that never arrived) and mid-run disconnects
+    - connect/join latency and the online counts the server reports
+    - server CPU and memory, sampled every second (and the generator's own, since a
+      saturated generator inflates latencies)
+
+Fully offline: --spawn starts the app on --port with mongomock and the fake blob
+store, so neither MongoDB nor Azure is needed (pip install mongomock)
+
+Usage:
+    python test_scripts/loadtest_socketio.py --spawn --clients 500 --rooms 50 --distribution zipf
+    python test_scripts/loadtest_socketio.py --url http://127.0.0.1:5000 --server-pid <pid> --clients 200
+Websocket transport needs the websocket-client package; without it clients use long-polling
+
+Progress goes to stderr; the JSON report goes to stdout (or --output)
+"""
+# Thousands of clients only fit in one process as green threads
+import eventlet
+eventlet.monkey_patch()
+
+import argparse
+import json
+import os
+import random
+import resource
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import uuid
+from collections import Counter, defaultdict
+from datetime import datetime, timezone
+
+import engineio.payload
+import requests
+import socketio
+
+# python-engineio refuses long-poll responses carrying more than 16 packets (a server-side
+# flood guard that also applies to its client); a busy room easily queues more between polls,
+# and the browser client has no such limit
+engineio.payload.Payload.max_decode_packets = 1 << 20
+
+SCRIPTS_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_ROOT = os.path.dirname(SCRIPTS_DIR)
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Socket.IO room fan-out and presence load test')
+    parser.add_argument('--url', help='Server to test (default: the spawned server)')
+    parser.add_argument('--spawn', action='store_true', help='Start an offline server (mongomock + fake blob store)')
+    parser.add_argument('--port', type=int, default=5055, help='Port of the spawned server')
+    parser.add_argument('--server-pid', type=int, help='PID of an already running server, for CPU/memory sampling')
+    parser.add_argument('--clients', type=int, default=200, help='Simulated clients')
+    parser.add_argument('--rooms', type=int, default=20, help='Storage rooms the clients are spread over')
+    parser.add_argument('--distribution', choices=('uniform', 'zipf'), default='uniform',
+                        help='How clients are spread over rooms; zipf gives a few very busy rooms')
+    parser.add_argument('--zipf-s', type=float, default=1.1, help='Zipf exponent (higher = more skewed)')
+    parser.add_argument('--duration', type=float, default=30, help='Seconds of measured traffic')
+    parser.add_argument('--mutations-per-second', type=float, default=10, help='Task creates/updates across all rooms')
+    parser.add_argument('--update-ratio', type=float, default=0.5, help='Fraction of mutations that are updates')
+    parser.add_argument('--activity-interval', type=float, default=5,
+                        help='Mean seconds between user_activity pings per client (0 disables)')
+    parser.add_argument('--connect-concurrency', type=int, default=50, help='Clients connecting at the same time')
+    parser.add_argument('--transports', help="Comma-separated engine.io transports (default: websocket if available, else polling)")
+    parser.add_argument('--drain', type=float, default=10,
+                        help='Seconds to wait for in-flight events after traffic stops; later events count as dropped')
+    parser.add_argument('--seed', type=int, default=1, help='Random seed for room assignment and traffic')
+    parser.add_argument('--output', help='Write the JSON report to this file instead of stdout')
+    parser.add_argument('--serve', action='store_true', help=argparse.SUPPRESS)
+    return parser.parse_args()
+
+
+def log(message):
+    print(message, file=sys.stderr, flush=True)
+
+
+def summarize(values):
+    """Latency summary in milliseconds"""
+    if not values:
+        return {'count': 0, 'p50': None, 'p95': None, 'p99': None, 'max': None, 'mean': None}
+    ms = sorted(value * 1000 for value in values)
+
+    def pick(fraction):
+        return round(ms[min(len(ms) - 1, max(0, round(fraction * len(ms) + 0.5) - 1))], 2)
+    return {'count': len(ms), 'p50': pick(0.50), 'p95': pick(0.95), 'p99': pick(0.99),
+            'max': round(ms[-1], 2), 'mean': round(sum(ms) / len(ms), 2)}
+
+
+# --- Offline server ---
+def serve(port):
+    """Run the app on 127.0.0.1:port against mongomock and a temporary fake blob store"""
+    sys.path.insert(0, SCRIPTS_DIR)
+    from benchmark_backend import use_mongomock
+
+    workdir = tempfile.mkdtemp(prefix='taskflow-load-')
+    os.environ['MONGO_URI'] = 'mongodb://localhost:27017/taskflow_load'
+    os.environ['AZURE_STORAGE_FAKE_DIR'] = os.path.join(workdir, 'blobs')
+    os.environ.setdefault('LOG_LEVEL', 'WARNING')
+    os.environ.pop('REDIS_URL', None)
+    use_mongomock()
+    sys.path.insert(0, os.path.join(REPO_ROOT, 'backend'))
+    import app as appmod
+    appmod.app.config['UPLOAD_FOLDER'] = os.path.join(workdir, 'uploads')
+    appmod.socketio.run(appmod.app, host='127.0.0.1', port=port, log_output=False)
+
+
+def spawn_server(port):
+    # A file rather than a pipe: nobody drains the pipe during the run, and a full pipe blocks the server
+    server_log = tempfile.NamedTemporaryFile(prefix='taskflow-load-server-', suffix='.log', delete=False)
+    process = subprocess.Popen([sys.executable, os.path.abspath(__file__), '--serve', '--port', str(port)],
+                               stdout=server_log, stderr=subprocess.STDOUT)
+    process.log_path = server_log.name
+    url = f'http://127.0.0.1:{port}'
+    deadline = time.time() + 60
+    while time.time() < deadline:
+        if process.poll() is not None:
+            with open(process.log_path, errors='replace') as f:
+                raise RuntimeError(f'Server exited: {f.read()[-2000:]}')
+        try:
+            if requests.get(f'{url}/health', timeout=1).status_code == 200:
+                return process, url
+        except requests.RequestException:
+            pass
+        time.sleep(0.25)
+    process.kill()
+    raise RuntimeError('Server did not become healthy within 60 seconds')
+
+
+class ProcessSampler:
+    """CPU% and RSS of the server process, from psutil when installed, else /proc"""
+
+    def __init__(self, pid):
+        self.pid = pid
+        self.samples = []
+        self._stop = threading.Event()
+        try:
+            import psutil
+            self._process = psutil.Process(pid)
+        except ImportError:
+            self._process = None
+        self._ticks = os.sysconf('SC_CLK_TCK') if hasattr(os, 'sysconf') else 100
+
+    def _read(self):
+        if self._process is not None:
+            times = self._process.cpu_times()
+            return times.user + times.system, self._process.memory_info().rss
+        with open(f'/proc/{self.pid}/stat') as f:
+            fields = f.read().rsplit(')', 1)[1].split()
+        cpu = (int(fields[11]) + int(fields[12])) / self._ticks
+        with open(f'/proc/{self.pid}/status') as f:
+            rss = next(int(line.split()[1]) * 1024 for line in f if line.startswith('VmRSS:'))
+        return cpu, rss
+
+    def start(self):
+        threading.Thread(target=self._run, daemon=True).start()
+
+    def _run(self):
+        try:
+            last_cpu, _ = self._read()
+        except (OSError, StopIteration):
+            return
+        last_time = time.time()
+        while not self._stop.wait(1):
+            try:
+                cpu, rss = self._read()
+            except (OSError, StopIteration):
+                return
+            now = time.time()
+            self.samples.append(((cpu - last_cpu) / (now - last_time) * 100, rss))
+            last_cpu, last_time = cpu, now
+
+    def stop(self):
+        self._stop.set()
+        if not self.samples:
+            return None
+        cpu = [sample[0] for sample in self.samples]
+        rss = [sample[1] / (1024 * 1024) for sample in self.samples]
+        return {'samples': len(self.samples), 'cpu_percent_mean': round(sum(cpu) / len(cpu), 1),
+                'cpu_percent_max': round(max(cpu), 1), 'rss_mb_start': round(rss[0], 1),
+                'rss_mb_max': round(max(rss), 1), 'rss_mb_end': round(rss[-1], 1)}
+
+
+# --- Clients ---
+class Recorder:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.room_members = Counter()  # storage_id -> joined clients
+        self.mutations = {}  # marker -> {'sent', 'storage_id', 'task_id', 'expected', 'received'}
+        self.mutation_latency = []
+        self.mutation_http_errors = 0
+        self.resync_events = 0
+        self.stopping = False
+        self.disconnects = Counter()  # reason -> clients dropped by the server or transport mid-run
+        self.activity_sent = {}  # user_id -> send time of the latest ping
+        self.activity_expected = 0
+        self.activity_sends = 0
+        self.activity_received = 0
+        self.activity_latency = []
+        self.activity_states = {}  # user_id -> (activity, time it changed to that state)
+        self.activity_changes = 0
+        self.digests_received = 0
+        self.digest_latency = []
+        self.events = Counter()
+        self.connect_latency = []
+        self.connect_failures = Counter()
+
+    def on_tasks_changed(self, client, payload):
+        received = time.time()
+        if payload.get('resync'):
+            with self.lock:
+                self.resync_events += 1
+        titles = [task.get('title') for task in payload.get('created', []) + payload.get('updated', [])]
+        titles += [patch.get('set', {}).get('title') for patch in payload.get('patched', [])]
+        with self.lock:
+            for title in titles:
+                mutation = self.mutations.get(title)
+                if mutation is not None:
+                    mutation['received'] += 1
+                    client.markers.add(title)
+                    self.mutation_latency.append(received - mutation['sent'])
+
+    def on_activity(self, payload):
+        received = time.time()
+        with self.lock:
+            sent = self.activity_sent.get(payload.get('user_id'))
+            self.activity_received += 1
+            if sent is not None:
+                self.activity_latency.append(received - sent)
+
+    def on_digest(self, client, payload):
+        """Latency from a user changing state to this client first seeing it in a digest"""
+        received = time.time()
+        with self.lock:
+            self.digests_received += 1
+            for user in payload.get('users', []):
+                state = self.activity_states.get(user['user_id'])
+                if state and state[0] == user['activity'] and client.seen_states.get(user['user_id']) != state[1]:
+                    client.seen_states[user['user_id']] = state[1]
+                    self.digest_latency.append(received - state[1])
+
+
+class LoadClient:
+    def __init__(self, index, storage_id, url, transports, recorder):
+        self.user_id = f'load-user-{index}'
+        self.storage_id = storage_id
+        self.url = url
+        self.transports = transports
+        self.recorder = recorder
+        self.joined = threading.Event()
+        self.markers = set()  # mutation markers this client received
+        self.seen_states = {}  # user_id -> state change already seen in a digest
+        self.sio = socketio.Client(reconnection=False)
+        self.sio.on('joined_storage', lambda data: self.joined.set())
+        self.sio.on('tasks_changed', self._on_tasks_changed)
+        self.sio.on('user_activity_update', self._on_activity)
+        self.sio.on('presence_digest', self._on_digest)
+        self.sio.on('*', self._on_other)
+        self.sio.on('disconnect', self._on_disconnect)
+
+    def _count(self, event):
+        with self.recorder.lock:
+            self.recorder.events[event] += 1
+
+    def _on_tasks_changed(self, payload):
+        self._count('tasks_changed')
+        self.recorder.on_tasks_changed(self, payload)
+
+    def _on_activity(self, payload):
+        self._count('user_activity_update')
+        self.recorder.on_activity(payload)
+
+    def _on_digest(self, payload):
+        self._count('presence_digest')
+        self.recorder.on_digest(self, payload)
+
+    def _on_disconnect(self, reason=None):
+        with self.recorder.lock:
+            if self.recorder.stopping or not self.joined.is_set():
+                return
+            # Later events aren't expected to reach this client
+            self.recorder.room_members[self.storage_id] -= 1
+            self.recorder.disconnects[str(reason)] += 1
+
+    def _on_other(self, event, *args):
+        self._count(event)
+
+    def connect(self):
+        started = time.time()
+        try:
+            self.sio.connect(self.url, transports=self.transports, wait_timeout=20)
+            self.sio.emit('join_storage', {'storage_id': self.storage_id})
+            if not self.joined.wait(20):
+                raise TimeoutError('join_storage was not acknowledged')
+        except Exception as e:
+            with self.recorder.lock:
+                self.recorder.connect_failures[type(e).__name__] += 1
+            return False
+        with self.recorder.lock:
+            self.recorder.connect_latency.append(time.time() - started)
+            self.recorder.room_members[self.storage_id] += 1
+        return True
+
+    def send_activity(self, activity):
+        recorder = self.recorder
+        with recorder.lock:
+            now = recorder.activity_sent[self.user_id] = time.time()
+            recorder.activity_sends += 1
+            if recorder.activity_states.get(self.user_id, (None,))[0] != activity:
+                recorder.activity_states[self.user_id] = (activity, now)
+                recorder.activity_changes += 1
+            # The sender is excluded from its own broadcast
+            recorder.activity_expected += recorder.room_members[self.storage_id] - 1
+        self.sio.emit('user_activity', {'storage_id': self.storage_id, 'user_id': self.user_id, 'activity': activity})
+
+    def activity_loop(self, interval, stop, rng):
+        while not stop.is_set():
+            if stop.wait(rng.uniform(0.5, 1.5) * interval):
+                return
+            try:
+                self.send_activity(rng.choice(('idle', 'editing', 'idle', 'recording')))
+            except Exception:
+                return
+
+    def disconnect(self):
+        try:
+            self.sio.disconnect()
+        except Exception:
+            pass
+
+
+def assign_rooms(args, rng):
+    run_id = uuid.uuid4().hex[:8]
+    rooms = [f'load-{run_id}-{index}' for index in range(args.rooms)]
+    if args.distribution == 'zipf':
+        weights = [1 / (rank ** args.zipf_s) for rank in range(1, len(rooms) + 1)]
+    else:
+        weights = [1] * len(rooms)
+    # Every room gets one client first so the requested room count is honoured
+    assignment = rooms[:min(args.clients, len(rooms))]
+    assignment += rng.choices(rooms, weights=weights, k=args.clients - len(assignment))
+    return rooms, assignment
+
+
+def mutation_loop(args, url, rooms, seed_tasks, recorder, stop, rng):
+    session = requests.Session()
+    pool = eventlet.GreenPool(100)
+    interval = 1 / args.mutations_per_second
+
+    def mutate(storage_id):
+        marker = f'lt-{uuid.uuid4().hex[:12]}'
+        task_id = seed_tasks.get(storage_id) if rng.random() < args.update_ratio else None
+        with recorder.lock:
+            recorder.mutations[marker] = {'sent': time.time(), 'storage_id': storage_id, 'task_id': task_id,
+                                          'expected': recorder.room_members[storage_id], 'received': 0}
+        try:
+            if task_id:
+                response = session.put(f'{url}/api/tasks/{task_id}',
+                                       json={'storage_id': storage_id, 'title': marker}, timeout=30)
+            else:
+                response = session.post(f'{url}/api/tasks', json={'storage_id': storage_id, 'title': marker}, timeout=30)
+            ok = response.status_code < 400
+        except requests.RequestException:
+            ok = False
+        if not ok:
+            with recorder.lock:
+                recorder.mutation_http_errors += 1
+                recorder.mutations.pop(marker, None)
+
+    next_at = time.time()
+    while not stop.is_set():
+        pool.spawn_n(mutate, rng.choice(rooms))
+        next_at += interval
+        stop.wait(max(0, next_at - time.time()))
+    pool.waitall()
+
+
+def coalesced_updates(recorder, clients):
+    """
+    Updates a client never saw because a newer update of the same task reached it in
+    the same broadcast window: the server merges them into one patch by design
+    """
+    updates = defaultdict(list)
+    for marker, mutation in recorder.mutations.items():
+        if mutation['task_id']:
+            updates[mutation['storage_id']].append((marker, mutation))
+    coalesced = 0
+    for client in clients:
+        latest = {}
+        for marker, mutation in updates[client.storage_id]:
+            if marker in client.markers:
+                latest[mutation['task_id']] = max(latest.get(mutation['task_id'], 0), mutation['sent'])
+        coalesced += sum(1 for marker, mutation in updates[client.storage_id]
+                         if marker not in client.markers and mutation['sent'] < latest.get(mutation['task_id'], 0))
+    return coalesced
+
+
+def git_revision():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=REPO_ROOT,
+                              capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+    args = parse_args()
+    if args.serve:
+        serve(args.port)
+        return
+
+    # Every client holds at least one socket
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    if soft < hard:
+        resource.setrlimit(resource.RLIMIT_NOFILE, (hard, hard))
+
+    if args.transports:
+        transports = args.transports.split(',')
+    else:
+        try:
+            import websocket  # noqa: F401  (websocket-client)
+            transports = ['websocket']
+        except ImportError:
+            transports = ['polling']
+
+    server = None
+    url = args.url
+    pid = args.server_pid
+    if args.spawn:
+        log(f'🚀 Starting an offline server on port {args.port}')
+        server, url = spawn_server(args.port)
+        pid = server.pid
+    elif not url:
+        log('❌ Pass --url of a running server, or --spawn')
+        sys.exit(2)
+
+    rng = random.Random(args.seed)
+    recorder = Recorder()
+    sampler = ProcessSampler(pid) if pid else None
+    # A saturated generator inflates latencies; its own usage shows when that happens
+    self_sampler = ProcessSampler(os.getpid())
+    clients = []
+    try:
+        self_sampler.start()
+        if sampler:
+            sampler.start()
+        rooms, assignment = assign_rooms(args, rng)
+
+        # One task per room gives the update traffic something to edit
+        seed_tasks = {}
+        for storage_id in rooms:
+            response = requests.post(f'{url}/api/tasks', json={'storage_id': storage_id, 'title': 'load seed'}, timeout=30)
+            if response.status_code == 201:
+                seed_tasks[storage_id] = response.json()['_id']
+
+        log(f'🔌 Connecting {args.clients} clients over {len(rooms)} rooms ({args.distribution}, {",".join(transports)})')
+        clients = [LoadClient(index, storage_id, url, transports, recorder) for index, storage_id in enumerate(assignment)]
+        connect_started = time.time()
+        pool = eventlet.GreenPool(args.connect_concurrency)
+        connected = [client for client, ok in zip(clients, pool.imap(LoadClient.connect, clients)) if ok]
+        connect_seconds = time.time() - connect_started
+        log(f'   {len(connected)} connected in {connect_seconds:.1f}s')
+
+        # Presence as the server sees it, for the busiest room
+        busiest = max(recorder.room_members, key=recorder.room_members.get) if recorder.room_members else None
+        online_check = None
+        if busiest:
+            reported = requests.get(f'{url}/api/storage/online-count', params={'storage_id': busiest}, timeout=30).json()
+            online_check = {'expected': recorder.room_members[busiest], 'reported': reported.get('count')}
+
+        log(f'📨 Generating traffic for {args.duration:.0f}s')
+        stop = threading.Event()
+        workers = []
+        if args.mutations_per_second > 0:
+            workers.append(eventlet.spawn(mutation_loop, args, url, rooms, seed_tasks, recorder, stop,
+                                          random.Random(args.seed + 1)))
+        if args.activity_interval > 0:
+            for index, client in enumerate(connected):
+                workers.append(eventlet.spawn(client.activity_loop, args.activity_interval, stop,
+                                              random.Random(f'{args.seed}-{index}')))
+        with recorder.lock:
+            recorder.events.clear()
+        traffic_started = time.time()
+        time.sleep(args.duration)
+        stop.set()
+        for worker in workers:
+            worker.wait()
+        traffic_seconds = time.time() - traffic_started
+        time.sleep(args.drain)
+    finally:
+        log('🧹 Disconnecting')
+        with recorder.lock:
+            recorder.stopping = True
+        pool = eventlet.GreenPool(args.connect_concurrency)
+        for client in clients:
+            pool.spawn_n(client.disconnect)
+        pool.waitall()
+        resources = sampler.stop() if sampler else None
+        generator_resources = self_sampler.stop()
+        if server:
+            server.terminate()
+            try:
+                server.wait(10)
+            except subprocess.TimeoutExpired:
+                server.kill()
+
+    with recorder.lock:
+        expected = sum(mutation['expected'] for mutation in recorder.mutations.values())
+        delivered = sum(min(mutation['received'], mutation['expected']) for mutation in recorder.mutations.values())
+        coalesced = coalesced_updates(recorder, connected)
+        room_sizes = sorted(recorder.room_members.values())
+        report = {
+            'meta': {
+                'git_revision': git_revision(),
+                'timestamp': datetime.now(timezone.utc).isoformat(),
+                'url': url,
+                'spawned_server': bool(server),
+                'server_log': server.log_path if server else None,
+                'transports': transports,
+                'config': {key: value for key, value in vars(args).items() if key not in ('serve', 'output')}
+            },
+            'connections': {
+                'attempted': len(clients),
+                'connected': len(connected),
+                'failed': dict(recorder.connect_failures),
+                'seconds': round(connect_seconds, 2),
+                'connect_and_join_ms': summarize(recorder.connect_latency),
+                'online_count_check': online_check,
+                'disconnected_during_run': dict(recorder.disconnects)
+            },
+            'rooms': {
+                'count': len(room_sizes),
+                'min_size': room_sizes[0] if room_sizes else 0,
+                'max_size': room_sizes[-1] if room_sizes else 0,
+                'mean_size': round(sum(room_sizes) / len(room_sizes), 1) if room_sizes else 0
+            },
+            'mutations': {
+                'sent': len(recorder.mutations),
+                'http_errors': recorder.mutation_http_errors,
+                'deliveries_expected': expected,
+                'delivered': delivered,
+                'coalesced': coalesced,
+                'dropped': max(0, expected - delivered - coalesced),
+                'drop_rate': round(max(0, expected - delivered - coalesced) / expected, 4) if expected else 0,
+                'resync_events': recorder.resync_events,
+                'latency_ms': summarize(recorder.mutation_latency)
+            },
+            'activity': {
+                'sent': recorder.activity_sends,
+                'state_changes': recorder.activity_changes,
+                # Servers that aggregate presence send digests; older ones relay every ping
+                'digest': {
+                    'received': recorder.digests_received,
+                    'state_change_latency_ms': summarize(recorder.digest_latency)
+                } if recorder.digests_received else None,
+                'relayed': {
+                    'deliveries_expected': recorder.activity_expected,
+                    'delivered': recorder.activity_received,
+                    'dropped': max(0, recorder.activity_expected - recorder.activity_received),
+                    'latency_ms': summarize(recorder.activity_latency)
+                } if recorder.activity_received else None
+            },
+            'events_received': dict(recorder.events),
+            'events_per_client_per_minute': {
+                event: round(count / max(len(connected), 1) / (traffic_seconds / 60), 2)
+                for event, count in recorder.events.items()
+            },
+            'server': resources,
+            'load_generator': generator_resources
+        }
+
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(output + '\n')
+        log(f'✅ Report written to {args.output}')
+    else:
+        print(output)
+
+
+if __name__ == '__main__':
+    main()